@@ -0,0 +1,101 @@
+"""
+Async Database Module
+asyncio facade over EcommerceDatabase for event-loop callers
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from query_filter import QueryFilter
+
+
+# Everything generate_visualizations() in main.py plots
+REPORT_QUERIES = ['headline_snapshot', 'traffic_source_performance', 'device_performance',
+                  'category_performance', 'location_analysis', 'weekday_performance',
+                  'returning_vs_new', 'hourly_patterns', 'daily_trends', 'value_quantiles']
+
+
+class AsyncEcommerceDatabase:
+    """Awaitable versions of the EcommerceDatabase queries
+    
+    Every get_* method is available as aget_*, e.g.
+    await adb.aget_traffic_source_performance(). Queries run on a bounded
+    thread pool over pooled read-only connections, so the event loop never
+    blocks. Concurrent identical requests are coalesced: the first one runs
+    the query and the rest await its result. Create it, and await its
+    queries, on the thread that connected db.
+    """
+    
+    def __init__(self, db, max_workers=4):
+        self.db = db
+        db.connection_pool(max_workers)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._in_flight = {}
+    
+    def __getattr__(self, attr):
+        if attr.startswith('aget_') and hasattr(self.db, attr[1:]):
+            name = attr[1:]
+            
+            async def query(*args, **kwargs):
+                return await self.run(name, *args, **kwargs)
+            
+            query.__name__ = attr
+            return query
+        raise AttributeError(attr)
+    
+    async def run(self, name, *args, **kwargs):
+        """Await one get_* query, sharing an identical in-flight execution"""
+        
+        key = (name, _request_key(args), _request_key(kwargs))
+        future = self._in_flight.get(key)
+        if future is None:
+            # On the event loop's (connecting) thread: a layout upgrade or
+            # rollup rebuild here uses the writer connection
+            self.db.prepare_pooled_reads()
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self.executor, lambda: self.db.run_pooled(name, *args, **kwargs))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        
+        # Shielded so one cancelled caller doesn't cancel the shared query;
+        # each caller gets its own copy of the frame
+        df = await asyncio.shield(future)
+        return df.copy()
+    
+    async def agather_report_inputs(self, filters=None):
+        """Fetch every input of generate_visualizations() in parallel
+        
+        Returns a dict of frames keyed by query name, with the headline
+        snapshot expanded into 'conversion_funnel', 'overall_metrics' and the
+        other headline frames. filters, a QueryFilter, applies to every query.
+        """
+        
+        frames = await asyncio.gather(
+            *(self.run(f'get_{name}', filters=filters) for name in REPORT_QUERIES))
+        inputs = dict(zip(REPORT_QUERIES, frames))
+        inputs.update(self.db.get_headline_metrics(inputs.pop('headline_snapshot')))
+        return inputs
+    
+    def close(self):
+        """Shut down the worker threads"""
+        
+        self.executor.shutdown(wait=True)
+
+
+def _request_key(value):
+    """Hashable form of query arguments, for coalescing identical requests
+    
+    Lists (funnel steps, bin edges) become tuples, dicts sorted item tuples
+    and filters their key().
+    """
+    
+    if isinstance(value, QueryFilter):
+        return ('QueryFilter', value.key())
+    if isinstance(value, dict):
+        return tuple(sorted((name, _request_key(item)) for name, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_request_key(item) for item in value)
+    if hasattr(value, 'tolist'):
+        return _request_key(value.tolist())
+    return value
@@ -0,0 +1,68 @@
+"""
+Connection Pool Module
+Thread-safe pool of read-only SQLite connections
+"""
+
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class ConnectionPool:
+    """Hand out read-only connections to one database file, one per thread or task
+    
+    Connections are opened lazily up to size and reused; a caller that finds
+    them all busy waits for one to be returned. The database should be in WAL
+    mode so these readers never block, or are blocked by, the writer. setup,
+    when given, is called with each new connection (e.g. to register SQL
+    functions).
+    """
+    
+    def __init__(self, db_path, size=4, setup=None):
+        self.uri = f"{Path(db_path).resolve().as_uri()}?mode=ro"
+        self.size = size
+        self.setup = setup
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with block"""
+        
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+    
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+            if self.setup:
+                self.setup(conn)
+            return conn
+        return self._idle.get()
+    
+    def close(self):
+        """Close every idle connection"""
+        
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
@@ -7,20 +7,37 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import random
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from schema import (TRAFFIC_SOURCES, DEVICES, CATEGORIES, LOCATIONS, WEEKDAYS,
+                    EVENT_TYPES, PAGES, SESSION_DTYPES, EVENT_DTYPES, format_ids, report_memory)
+from storage import dataset_path, to_columnar, write_table
 
 
 class EcommerceDataGenerator:
-    """Generate realistic e-commerce session data"""
+    """Generate realistic e-commerce session data
+    
+    With a seed, every engine draws from generator-owned random streams, so
+    the same (seed, num_workers, end_date) reproduces the same data byte for
+    byte. Timestamps cover the 91 days ending on end_date (default: today).
+    num_workers > 1 shards vectorized generation across a process pool.
+    compact=True makes the vectorized engine emit the compact schema
+    (integer ids, categories, narrow ints; see schema.py).
+    """
     
-    def __init__(self, num_sessions=15000):
+    def __init__(self, num_sessions=15000, seed=None, num_workers=1, end_date=None,
+                 compact=False):
         self.num_sessions = num_sessions
-        self.traffic_sources = ['Google Ads', 'Facebook Ads', 'Organic Search', 
-                                'Direct', 'Email Campaign', 'Referral']
-        self.devices = ['Desktop', 'Mobile', 'Tablet']
-        self.categories = ['Electronics', 'Fashion', 'Home & Kitchen', 
-                          'Sports', 'Books', 'Beauty', 'Toys']
-        self.locations = ['Mumbai', 'Delhi', 'Bangalore', 'Hyderabad', 'Chennai',
-                         'Kolkata', 'Pune', 'Ahmedabad', 'Jaipur', 'Lucknow']
+        self.compact = compact
+        self.seed = seed
+        self.num_workers = max(1, num_workers)
+        # Any date-like value (datetime, Timestamp, 'YYYY-MM-DD' text) works
+        self.end_date = pd.Timestamp(end_date).to_pydatetime() if end_date else datetime.now()
+        self.traffic_sources = list(TRAFFIC_SOURCES)
+        self.devices = list(DEVICES)
+        self.categories = list(CATEGORIES)
+        self.locations = list(LOCATIONS)
         
         # Conversion probabilities by traffic source
         self.conversion_rates = {
@@ -41,23 +58,49 @@ class EcommerceDataGenerator:
             'Email Campaign': 0.5,
             'Referral': 0.2
         }
+        
+        # Sampling weights shared by the loop and vectorized engines
+        self.traffic_weights = [30, 25, 20, 10, 10, 5]
+        self.device_weights = [35, 45, 20]  # Mobile dominant
+        self.hour_weights = [1, 1, 1, 1, 1, 2, 3, 4, 5, 6, 7, 8, 8, 7, 6, 5, 6, 7, 8, 7, 5, 3, 2, 1]
+        self.device_multipliers = {
+            'Desktop': 1.2,
+            'Mobile': 0.85,
+            'Tablet': 1.0
+        }
+        
+        # (min, max) session duration and pages by deepest funnel stage reached:
+        # bounced, viewed product, added to cart, started checkout, purchased
+        self.stage_durations = [(5, 30), (60, 300), (120, 480), (180, 600), (300, 900)]
+        self.stage_pages = [(1, 1), (2, 5), (3, 8), (4, 10), (5, 15)]
+        
+        # (event_type, page) logged for landing and each funnel stage, and the
+        # (min, max) seconds elapsed since the previous event
+        self.event_steps = [('page_view', 'homepage'), ('page_view', 'product_page'),
+                            ('add_to_cart', 'product_page'), ('checkout_start', 'checkout'),
+                            ('purchase', 'confirmation')]
+        self.event_gaps = [(0, 0), (10, 60), (30, 120), (20, 90), (60, 180)]
+        
+        # Parent stream for per-shard seeds; rng and random serve single-process runs
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(self.seed_sequence.spawn(1)[0])
+        self.random = random.Random(seed)
     
     def generate_timestamp(self):
         """Generate realistic timestamps over last 3 months"""
-        start_date = datetime.now() - timedelta(days=90)
-        end_date = datetime.now()
+        start_date = self.end_date - timedelta(days=90)
+        end_date = self.end_date
         
         # Random date
         time_between = end_date - start_date
         days_between = time_between.days
-        random_days = random.randint(0, days_between)
+        random_days = self.random.randint(0, days_between)
         random_date = start_date + timedelta(days=random_days)
         
         # Weight towards business hours (9 AM - 9 PM)
-        hour_weights = [1, 1, 1, 1, 1, 2, 3, 4, 5, 6, 7, 8, 8, 7, 6, 5, 6, 7, 8, 7, 5, 3, 2, 1]
-        hour = random.choices(range(24), weights=hour_weights)[0]
-        minute = random.randint(0, 59)
-        second = random.randint(0, 59)
+        hour = self.random.choices(range(24), weights=self.hour_weights)[0]
+        minute = self.random.randint(0, 59)
+        second = self.random.randint(0, 59)
         
         return random_date.replace(hour=hour, minute=minute, second=second)
     
@@ -68,47 +111,42 @@ class EcommerceDataGenerator:
         base_conversion = self.conversion_rates.get(traffic_source, 0.14)
         
         # Device adjustment
-        device_multiplier = {
-            'Desktop': 1.2,
-            'Mobile': 0.85,
-            'Tablet': 1.0
-        }
-        conversion_prob = base_conversion * device_multiplier.get(device, 1.0)
+        conversion_prob = base_conversion * self.device_multipliers.get(device, 1.0)
         
         # Funnel stages
         landed = True
-        viewed_product = random.random() < 0.65  # 65% view products
-        added_to_cart = viewed_product and random.random() < 0.54  # 54% of viewers add to cart
-        started_checkout = added_to_cart and random.random() < 0.57  # 57% proceed to checkout
-        completed_purchase = started_checkout and random.random() < (conversion_prob * 2.8)
+        viewed_product = self.random.random() < 0.65  # 65% view products
+        added_to_cart = viewed_product and self.random.random() < 0.54  # 54% of viewers add to cart
+        started_checkout = added_to_cart and self.random.random() < 0.57  # 57% proceed to checkout
+        completed_purchase = started_checkout and self.random.random() < (conversion_prob * 2.8)
         
         # Session metrics
         if not viewed_product:
             # Bounced
-            session_duration = random.randint(5, 30)  # seconds
+            session_duration = self.random.randint(5, 30)  # seconds
             pages_viewed = 1
             bounced = True
         elif viewed_product and not added_to_cart:
-            session_duration = random.randint(60, 300)
-            pages_viewed = random.randint(2, 5)
+            session_duration = self.random.randint(60, 300)
+            pages_viewed = self.random.randint(2, 5)
             bounced = False
         elif added_to_cart and not started_checkout:
-            session_duration = random.randint(120, 480)
-            pages_viewed = random.randint(3, 8)
+            session_duration = self.random.randint(120, 480)
+            pages_viewed = self.random.randint(3, 8)
             bounced = False
         elif started_checkout and not completed_purchase:
-            session_duration = random.randint(180, 600)
-            pages_viewed = random.randint(4, 10)
+            session_duration = self.random.randint(180, 600)
+            pages_viewed = self.random.randint(4, 10)
             bounced = False
         else:
             # Completed purchase
-            session_duration = random.randint(300, 900)
-            pages_viewed = random.randint(5, 15)
+            session_duration = self.random.randint(300, 900)
+            pages_viewed = self.random.randint(5, 15)
             bounced = False
         
         # Revenue if purchased
         if completed_purchase:
-            revenue = round(random.uniform(500, 5000), 2)
+            revenue = round(self.random.uniform(500, 5000), 2)
         else:
             revenue = 0
         
@@ -124,8 +162,11 @@ class EcommerceDataGenerator:
             'revenue': revenue
         }
     
-    def generate_sessions(self):
-        """Generate complete session dataset"""
+    def generate_sessions(self, vectorized=False):
+        """Generate complete session dataset (num_workers > 1 or compact imply vectorized)"""
+        
+        if vectorized or self.num_workers > 1 or self.compact:
+            return self.generate_sessions_vectorized()
         
         print(f"Generating {self.num_sessions} e-commerce sessions...")
         
@@ -134,22 +175,22 @@ class EcommerceDataGenerator:
         for i in range(self.num_sessions):
             # Basic info
             session_id = f"SES_{i+1:06d}"
-            user_id = f"USER_{random.randint(1, int(self.num_sessions * 0.7)):06d}"  # Some returning users
+            user_id = f"USER_{self.random.randint(1, int(self.num_sessions * 0.7)):06d}"  # Some returning users
             timestamp = self.generate_timestamp()
             
             # Random attributes
-            traffic_source = random.choices(
+            traffic_source = self.random.choices(
                 self.traffic_sources,
-                weights=[30, 25, 20, 10, 10, 5]  # Weighted distribution
+                weights=self.traffic_weights  # Weighted distribution
             )[0]
             
-            device = random.choices(
+            device = self.random.choices(
                 self.devices,
-                weights=[35, 45, 20]  # Mobile dominant
+                weights=self.device_weights
             )[0]
             
-            location = random.choice(self.locations)
-            category = random.choice(self.categories)
+            location = self.random.choice(self.locations)
+            category = self.random.choice(self.categories)
             
             # Simulate journey
             journey = self.simulate_user_journey(traffic_source, device)
@@ -158,7 +199,7 @@ class EcommerceDataGenerator:
             ad_spend = self.ad_costs.get(traffic_source, 0)
             
             # Is returning customer?
-            is_returning = random.random() < 0.3  # 30% returning
+            is_returning = self.random.random() < 0.3  # 30% returning
             
             session_data = {
                 'session_id': session_id,
@@ -195,91 +236,451 @@ class EcommerceDataGenerator:
         print(f"✓ Generated {len(df)} sessions successfully!")
         return df
     
+    def generate_sessions_vectorized(self):
+        """Generate the session dataset with whole-column NumPy draws
+        
+        Produces the same columns and marginal distributions as the loop
+        engine. Every attribute is drawn independently of the timestamp, so
+        sorting the timestamp column alone is equivalent to sorting the frame;
+        session ids are therefore assigned in time order.
+        """
+        
+        print(f"Generating {self.num_sessions} e-commerce sessions (vectorized)...")
+        
+        if self.num_workers > 1:
+            df = self._generate_sharded_sessions()
+        else:
+            timestamps = self._draw_timestamps(self.rng, self.num_sessions)
+            df = self._draw_sessions(self.rng, timestamps)
+        
+        print(f"✓ Generated {len(df)} sessions successfully!")
+        report_memory(df, 'sessions')
+        return df
+    
+    def _generate_sharded_sessions(self):
+        """Generate one shard per worker from derived seeds, merged by timestamp
+        
+        Shard k owns a contiguous block of session ids. Shards come back as
+        plain arrays, each sorted; a stable sort of the concatenation (a k-way
+        merge for timsort) breaks timestamp ties by shard order, keeping runs
+        repeatable. Only the final frame build happens in this process.
+        """
+        
+        base, extra = divmod(self.num_sessions, self.num_workers)
+        sizes = [base + (shard < extra) for shard in range(self.num_workers)]
+        first_sessions = [1 + sum(sizes[:shard]) for shard in range(self.num_workers)]
+        seeds = self.seed_sequence.spawn(self.num_workers)
+        
+        with ProcessPoolExecutor(max_workers=self.num_workers) as pool:
+            shards = list(pool.map(_generate_shard, [self] * self.num_workers,
+                                   seeds, sizes, first_sessions))
+        
+        merged = {name: np.concatenate([shard[name] for shard in shards]) for name in shards[0]}
+        order = np.argsort(merged['timestamp'], kind='stable')
+        return self._sessions_frame({name: column[order] for name, column in merged.items()})
+    
+    def _draw_sessions(self, rng, timestamps, first_session=1):
+        """Draw one session per (sorted) timestamp, numbered from first_session"""
+        
+        return self._sessions_frame(self._draw_session_columns(rng, timestamps, first_session))
+    
+    def _draw_session_columns(self, rng, timestamps, first_session=1):
+        """Draw session attributes as plain NumPy arrays
+        
+        Dimensions stay integer codes and ids stay integers (compact) or
+        unicode arrays until _sessions_frame, so shards can be shipped between
+        processes cheaply.
+        """
+        
+        n = len(timestamps)
+        
+        # Categorical attributes as integer codes
+        source_idx = self._weighted_choice(rng, self.traffic_weights, n)
+        device_idx = self._weighted_choice(rng, self.device_weights, n)
+        location_idx = rng.integers(0, len(self.locations), n)
+        category_idx = rng.integers(0, len(self.categories), n)
+        is_returning = rng.random(n) < 0.3
+        
+        # Funnel stages as cascaded Bernoulli masks
+        conversion_prob = (
+            np.array([self.conversion_rates.get(s, 0.14) for s in self.traffic_sources])[source_idx]
+            * np.array([self.device_multipliers.get(d, 1.0) for d in self.devices])[device_idx]
+        )
+        viewed_product = rng.random(n) < 0.65
+        added_to_cart = viewed_product & (rng.random(n) < 0.54)
+        started_checkout = added_to_cart & (rng.random(n) < 0.57)
+        completed_purchase = started_checkout & (rng.random(n) < conversion_prob * 2.8)
+        
+        # Stage-conditioned uniform draws for duration and pages
+        stage = (viewed_product.astype(np.int8) + added_to_cart + started_checkout
+                 + completed_purchase)
+        durations = np.array(self.stage_durations)
+        pages = np.array(self.stage_pages)
+        session_duration = rng.integers(durations[stage, 0], durations[stage, 1] + 1)
+        pages_viewed = rng.integers(pages[stage, 0], pages[stage, 1] + 1)
+        
+        revenue = np.where(completed_purchase, np.round(rng.uniform(500, 5000, n), 2), 0.0)
+        
+        num_users = int(self.num_sessions * 0.7)
+        session_ids = np.arange(first_session, first_session + n)
+        user_ids = rng.integers(1, num_users + 1, n)
+        if not self.compact:
+            session_ids = format_ids('SES_', session_ids, 6)
+            user_ids = format_ids('USER_', user_ids, 6)
+        
+        return {
+            'session_id': session_ids,
+            'user_id': user_ids,
+            'timestamp': timestamps,
+            'traffic_source': source_idx,
+            'device': device_idx,
+            'location': location_idx,
+            'category': category_idx,
+            'is_returning': is_returning,
+            'viewed_product': viewed_product,
+            'added_to_cart': added_to_cart,
+            'started_checkout': started_checkout,
+            'completed_purchase': completed_purchase,
+            'session_duration_seconds': session_duration,
+            'pages_viewed': pages_viewed,
+            'revenue': revenue
+        }
+    
+    def _sessions_frame(self, columns):
+        """Build the sessions DataFrame from _draw_session_columns output"""
+        
+        n = len(columns['timestamp'])
+        timestamps = columns['timestamp']
+        days = timestamps.astype('datetime64[D]')
+        hours = (timestamps - days).astype(np.int64) // 3600
+        # 1970-01-01 was a Thursday (weekday 3)
+        weekdays = (days.astype(np.int64) + 3) % 7
+        source_idx = columns['traffic_source']
+        
+        ad_spend = np.array([self.ad_costs.get(s, 0) for s in self.traffic_sources],
+                            dtype=float)[source_idx]
+        
+        if self.compact:
+            return self._compact_sessions_frame(columns, hours, weekdays, ad_spend)
+        
+        return pd.DataFrame({
+            'session_id': columns['session_id'].astype(object),
+            'user_id': columns['user_id'].astype(object),
+            'timestamp': timestamps.astype('datetime64[ns]'),
+            'date': days.astype('datetime64[ns]'),
+            'hour': hours,
+            'day_of_week': np.array(WEEKDAYS, dtype=object)[weekdays],
+            'traffic_source': np.array(self.traffic_sources, dtype=object)[source_idx],
+            'device': np.array(self.devices, dtype=object)[columns['device']],
+            'location': np.array(self.locations, dtype=object)[columns['location']],
+            'category': np.array(self.categories, dtype=object)[columns['category']],
+            'is_returning': columns['is_returning'],
+            'landed': np.ones(n, dtype=bool),
+            'viewed_product': columns['viewed_product'],
+            'added_to_cart': columns['added_to_cart'],
+            'started_checkout': columns['started_checkout'],
+            'completed_purchase': columns['completed_purchase'],
+            'session_duration_seconds': columns['session_duration_seconds'],
+            'pages_viewed': columns['pages_viewed'],
+            'bounced': ~columns['viewed_product'],
+            'revenue': columns['revenue'],
+            'ad_spend': ad_spend
+        })
+    
+    def _compact_sessions_frame(self, columns, hours, weekdays, ad_spend):
+        """Sessions frame in the compact schema (no string materialization)"""
+        
+        def categorical(codes, column):
+            return pd.Categorical.from_codes(codes, dtype=SESSION_DTYPES[column])
+        
+        viewed_product = columns['viewed_product']
+        return pd.DataFrame({
+            'session_id': columns['session_id'].astype(np.int32),
+            'user_id': columns['user_id'].astype(np.int32),
+            'timestamp': columns['timestamp'].astype('datetime64[ns]'),
+            'hour': hours.astype(np.int8),
+            'day_of_week': categorical(weekdays, 'day_of_week'),
+            'traffic_source': categorical(columns['traffic_source'], 'traffic_source'),
+            'device': categorical(columns['device'], 'device'),
+            'location': categorical(columns['location'], 'location'),
+            'category': categorical(columns['category'], 'category'),
+            'is_returning': columns['is_returning'],
+            'landed': np.ones(len(viewed_product), dtype=bool),
+            'viewed_product': viewed_product,
+            'added_to_cart': columns['added_to_cart'],
+            'started_checkout': columns['started_checkout'],
+            'completed_purchase': columns['completed_purchase'],
+            'session_duration_seconds': columns['session_duration_seconds'].astype(np.int16),
+            'pages_viewed': columns['pages_viewed'].astype(np.int8),
+            'bounced': ~viewed_product,
+            'revenue': columns['revenue'],
+            'ad_spend': ad_spend
+        })
+    
+    def _draw_timestamps(self, rng, n):
+        """Vectorized equivalent of generate_timestamp, returned in sorted order
+        
+        Offsets fall on a fixed one-second grid over the 91 days, so large
+        draws are ordered with a linear-time counting sort (bincount + repeat).
+        """
+        
+        day_offsets = rng.integers(0, 91, n)
+        hours = self._weighted_choice(rng, self.hour_weights, n)
+        seconds_in_hour = rng.integers(0, 3600, n)
+        
+        offsets = day_offsets * 86400 + hours * 3600 + seconds_in_hour
+        grid_size = 91 * 86400
+        if n < grid_size // 16:
+            offsets = np.sort(offsets)
+        else:
+            counts = np.bincount(offsets, minlength=grid_size)
+            offsets = np.repeat(np.arange(grid_size), counts)
+        
+        return self._first_day() + offsets.astype('timedelta64[s]')
+    
+    def _iter_timestamps(self, rng, n, batch_size):
+        """Yield n sorted timestamps in batches of batch_size
+        
+        Draws how many sessions land on each day, then on each second of that
+        day (multinomial splits have the same joint law as n independent draws
+        followed by a sort). Only one day's per-second counts are held at a
+        time, so memory does not grow with n.
+        """
+        
+        first_day = self._first_day()
+        hour_p = np.asarray(self.hour_weights, dtype=float)
+        second_p = np.repeat(hour_p / hour_p.sum() / 3600, 3600)
+        
+        pending, pending_size = [], 0
+        for day, day_count in enumerate(rng.multinomial(n, np.full(91, 1 / 91))):
+            if day_count == 0:
+                continue
+            cumulative = np.cumsum(rng.multinomial(day_count, second_p))
+            day_start = first_day + np.timedelta64(day * 86400, 's')
+            
+            position = 0
+            while position < day_count:
+                take = min(batch_size - pending_size, day_count - position)
+                seconds = np.searchsorted(cumulative, np.arange(position, position + take),
+                                          side='right')
+                pending.append(day_start + seconds.astype('timedelta64[s]'))
+                pending_size += take
+                position += take
+                
+                if pending_size == batch_size:
+                    yield np.concatenate(pending)
+                    pending, pending_size = [], 0
+        
+        if pending:
+            yield np.concatenate(pending)
+    
+    def _first_day(self):
+        """Midnight of the first day in the 91-day window, as datetime64[s]"""
+        
+        return np.datetime64((self.end_date - timedelta(days=90)).date(), 's')
+    
+    @staticmethod
+    def _weighted_choice(rng, weights, n):
+        """Draw n indices into weights with probability proportional to weight"""
+        
+        p = np.asarray(weights, dtype=float)
+        return rng.choice(len(p), size=n, p=p / p.sum())
+    
     def generate_event_log(self, sessions_df):
-        """Generate detailed event log from sessions"""
+        """Generate detailed event log from sessions
+        
+        Each session emits a landing page view plus one event per funnel stage
+        it reached. The (session, step) pairs are expanded column-wise and the
+        step timestamps are cumulative sums of random gaps within a session.
+        """
         
         print("\nGenerating event-level data...")
         
-        events = []
+        if self.num_workers > 1 and len(sessions_df) > 0:
+            events_df = self._generate_sharded_events(sessions_df)
+        else:
+            events_df = self._expand_events(self.rng, sessions_df)
+        print(f"✓ Generated {len(events_df)} events!")
+        report_memory(events_df, 'events')
+        
+        return events_df
+    
+    def _generate_sharded_events(self, sessions_df):
+        """Expand contiguous session blocks in a process pool
         
-        for _, session in sessions_df.iterrows():
-            session_id = session['session_id']
-            user_id = session['user_id']
-            timestamp = session['timestamp']
-            
-            # Landing event
-            events.append({
-                'event_id': f"EVT_{len(events)+1:08d}",
-                'session_id': session_id,
-                'user_id': user_id,
-                'timestamp': timestamp,
-                'event_type': 'page_view',
-                'page': 'homepage'
+        Event counts follow from the stage flags, so each block's first
+        event id is known before any worker starts.
+        """
+        
+        inputs = self._event_inputs(sessions_df)
+        for name in ('session_id', 'user_id'):
+            if inputs[name].dtype == object:
+                # Fixed-width unicode pickles as one buffer instead of per-object
+                inputs[name] = inputs[name].astype(str)
+        bounds = np.linspace(0, len(sessions_df), self.num_workers + 1).astype(int)
+        blocks = [{name: column[start:end] for name, column in inputs.items()}
+                  for start, end in zip(bounds[:-1], bounds[1:])]
+        
+        counts = [int(block['reached'].sum()) for block in blocks]
+        first_events = [1 + sum(counts[:shard]) for shard in range(len(blocks))]
+        seeds = self.seed_sequence.spawn(len(blocks))
+        
+        with ProcessPoolExecutor(max_workers=self.num_workers) as pool:
+            shards = list(pool.map(_expand_shard, [self] * len(blocks),
+                                   seeds, blocks, first_events))
+        
+        merged = {name: np.concatenate([shard[name] for shard in shards]) for name in shards[0]}
+        return self._events_frame(merged)
+    
+    def _expand_events(self, rng, sessions_df, first_event=1):
+        """Expand sessions into their event rows, numbered from first_event"""
+        
+        inputs = self._event_inputs(sessions_df)
+        return self._events_frame(self._draw_event_columns(rng, inputs, first_event))
+    
+    def _event_inputs(self, sessions_df):
+        """Session columns needed for event expansion, as NumPy arrays"""
+        
+        # Which of the five steps each session reached; landing is always present
+        reached = np.ones((len(sessions_df), len(self.event_steps)), dtype=bool)
+        for step, flag in enumerate(['viewed_product', 'added_to_cart',
+                                     'started_checkout', 'completed_purchase'], 1):
+            reached[:, step] = sessions_df[flag].to_numpy(dtype=bool)
+        
+        return {
+            'session_id': sessions_df['session_id'].to_numpy(),
+            'user_id': sessions_df['user_id'].to_numpy(),
+            'timestamp': pd.to_datetime(sessions_df['timestamp']).to_numpy(),
+            'reached': reached
+        }
+    
+    def _draw_event_columns(self, rng, inputs, first_event=1):
+        """Expand reached steps into event columns with random step gaps"""
+        
+        reached = inputs['reached']
+        
+        # Row-major nonzero keeps every session's steps together and in order
+        session_idx, step = np.nonzero(reached)
+        events_per_session = reached.sum(axis=1)
+        
+        gap_bounds = np.array(self.event_gaps)
+        gaps = rng.integers(gap_bounds[step, 0], gap_bounds[step, 1] + 1)
+        elapsed = np.cumsum(gaps)
+        session_start = np.repeat(elapsed[np.cumsum(events_per_session) - events_per_session],
+                                  events_per_session)
+        offsets = (elapsed - session_start).astype('timedelta64[s]')
+        
+        event_ids = np.arange(first_event, first_event + len(step))
+        if not self.compact:
+            event_ids = format_ids('EVT_', event_ids, 8)
+        
+        return {
+            'event_id': event_ids,
+            'session_id': inputs['session_id'][session_idx],
+            'user_id': inputs['user_id'][session_idx],
+            'timestamp': inputs['timestamp'][session_idx] + offsets,
+            'step': step
+        }
+    
+    def _events_frame(self, columns):
+        """Build the events DataFrame from _draw_event_columns output"""
+        
+        if self.compact:
+            type_codes = np.array([EVENT_TYPES.index(event_type) for event_type, _ in self.event_steps])
+            page_codes = np.array([PAGES.index(page) for _, page in self.event_steps])
+            return pd.DataFrame({
+                'event_id': columns['event_id'].astype(np.int64),
+                'session_id': columns['session_id'].astype(np.int32),
+                'user_id': columns['user_id'].astype(np.int32),
+                'timestamp': columns['timestamp'].astype('datetime64[ns]'),
+                'event_type': pd.Categorical.from_codes(type_codes[columns['step']],
+                                                        dtype=EVENT_DTYPES['event_type']),
+                'page': pd.Categorical.from_codes(page_codes[columns['step']],
+                                                  dtype=EVENT_DTYPES['page'])
             })
+        
+        event_types = np.array([event_type for event_type, _ in self.event_steps], dtype=object)
+        pages = np.array([page for _, page in self.event_steps], dtype=object)
+        
+        return pd.DataFrame({
+            'event_id': columns['event_id'].astype(object),
+            'session_id': columns['session_id'].astype(object),
+            'user_id': columns['user_id'].astype(object),
+            'timestamp': columns['timestamp'].astype('datetime64[ns]'),
+            'event_type': event_types[columns['step']],
+            'page': pages[columns['step']]
+        })
+    
+    def iter_batches(self, batch_size=100000):
+        """Yield (sessions_df, events_df) batches covering num_sessions
+        
+        Sessions arrive in global timestamp order across batches, session and
+        event ids continue from one batch to the next, and user ids are drawn
+        from the same pool as a full in-memory run.
+        """
+        
+        next_session, next_event = 1, 1
+        for timestamps in self._iter_timestamps(self.rng, self.num_sessions, batch_size):
+            sessions_df = self._draw_sessions(self.rng, timestamps, first_session=next_session)
+            events_df = self._expand_events(self.rng, sessions_df, first_event=next_event)
             
-            current_time = timestamp
-            
-            # Product view
-            if session['viewed_product']:
-                current_time += timedelta(seconds=random.randint(10, 60))
-                events.append({
-                    'event_id': f"EVT_{len(events)+1:08d}",
-                    'session_id': session_id,
-                    'user_id': user_id,
-                    'timestamp': current_time,
-                    'event_type': 'page_view',
-                    'page': 'product_page'
-                })
-            
-            # Add to cart
-            if session['added_to_cart']:
-                current_time += timedelta(seconds=random.randint(30, 120))
-                events.append({
-                    'event_id': f"EVT_{len(events)+1:08d}",
-                    'session_id': session_id,
-                    'user_id': user_id,
-                    'timestamp': current_time,
-                    'event_type': 'add_to_cart',
-                    'page': 'product_page'
-                })
-            
-            # Checkout
-            if session['started_checkout']:
-                current_time += timedelta(seconds=random.randint(20, 90))
-                events.append({
-                    'event_id': f"EVT_{len(events)+1:08d}",
-                    'session_id': session_id,
-                    'user_id': user_id,
-                    'timestamp': current_time,
-                    'event_type': 'checkout_start',
-                    'page': 'checkout'
-                })
-            
-            # Purchase
-            if session['completed_purchase']:
-                current_time += timedelta(seconds=random.randint(60, 180))
-                events.append({
-                    'event_id': f"EVT_{len(events)+1:08d}",
-                    'session_id': session_id,
-                    'user_id': user_id,
-                    'timestamp': current_time,
-                    'event_type': 'purchase',
-                    'page': 'confirmation'
-                })
-        
-        events_df = pd.DataFrame(events)
-        print(f"✓ Generated {len(events_df)} events!")
+            next_session += len(sessions_df)
+            next_event += len(events_df)
+            yield sessions_df, events_df
+    
+    def save_data_stream(self, output_dir='data', file_format='csv', batch_size=100000):
+        """Generate and write data batch by batch with flat peak memory
         
-        return events_df
+        file_format is 'csv', 'parquet' (requires pyarrow) or 'sqlite'.
+        Returns the paths written.
+        """
+        
+        writers = {
+            'csv': _CsvBatchWriter,
+            'parquet': _ParquetBatchWriter,
+            'sqlite': _SqliteBatchWriter
+        }
+        if file_format not in writers:
+            raise ValueError(f"Unsupported file format: {file_format}")
+        
+        os.makedirs(output_dir, exist_ok=True)
+        writer = writers[file_format](output_dir)
+        
+        print(f"Streaming {self.num_sessions} sessions to {file_format} "
+              f"in batches of {batch_size}...")
+        
+        totals = [0, 0]
+        
+        def batches():
+            for sessions_df, events_df in self.iter_batches(batch_size):
+                yield sessions_df, events_df
+                totals[0] += len(sessions_df)
+                totals[1] += len(events_df)
+                print(f"  Written {totals[0]} sessions...")
+        
+        try:
+            writer.write_batches(batches())
+        finally:
+            writer.close()
+        
+        print(f"\n✓ Streamed {totals[0]} sessions and {totals[1]} events:")
+        for path in writer.paths:
+            print(f"  - {path}")
+        
+        return writer.paths
     
-    def save_data(self, sessions_df, events_df, output_dir='data'):
-        """Save generated data to CSV"""
+    def save_data(self, sessions_df, events_df, output_dir='data', file_format='csv'):
+        """Save generated data as CSV, Parquet or Feather
+        
+        The columnar formats dictionary-encode the dimension columns and keep
+        native datetime and bool types (both require pyarrow).
+        """
         
-        sessions_path = f'{output_dir}/sessions_data.csv'
-        events_path = f'{output_dir}/events_data.csv'
+        sessions_path = dataset_path('sessions', output_dir, file_format)
+        events_path = dataset_path('events', output_dir, file_format)
         
-        sessions_df.to_csv(sessions_path, index=False)
-        events_df.to_csv(events_path, index=False)
+        write_table(sessions_df, sessions_path)
+        write_table(events_df, events_path)
         
         print(f"\n✓ Data saved:")
         print(f"  - {sessions_path}")
@@ -288,6 +689,91 @@ class EcommerceDataGenerator:
         return sessions_path, events_path
 
 
+def _generate_shard(generator, seed, size, first_session):
+    """Process-pool task: draw one sorted shard of session columns from its own seed"""
+    
+    rng = np.random.default_rng(seed)
+    return generator._draw_session_columns(rng, generator._draw_timestamps(rng, size),
+                                           first_session)
+
+
+def _expand_shard(generator, seed, inputs, first_event):
+    """Process-pool task: expand one block of sessions into event columns"""
+    
+    return generator._draw_event_columns(np.random.default_rng(seed), inputs, first_event)
+
+
+class _CsvBatchWriter:
+    """Append batches to sessions_data.csv / events_data.csv"""
+    
+    def __init__(self, output_dir):
+        self.paths = (f'{output_dir}/sessions_data.csv', f'{output_dir}/events_data.csv')
+        self.header = True
+    
+    def write_batches(self, batches):
+        for sessions_df, events_df in batches:
+            mode = 'w' if self.header else 'a'
+            sessions_df.to_csv(self.paths[0], mode=mode, header=self.header, index=False)
+            events_df.to_csv(self.paths[1], mode=mode, header=self.header, index=False)
+            self.header = False
+    
+    def close(self):
+        pass
+
+
+class _ParquetBatchWriter:
+    """Append batches as row groups of sessions_data.parquet / events_data.parquet"""
+    
+    def __init__(self, output_dir):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow)")
+        
+        self.pa, self.pq = pa, pq
+        self.paths = (f'{output_dir}/sessions_data.parquet', f'{output_dir}/events_data.parquet')
+        self.writers = [None, None]
+    
+    def write_batches(self, batches):
+        for sessions_df, events_df in batches:
+            for i, df in enumerate((sessions_df, events_df)):
+                table = self.pa.Table.from_pandas(to_columnar(df), preserve_index=False)
+                if self.writers[i] is None:
+                    self.writers[i] = self.pq.ParquetWriter(self.paths[i], table.schema)
+                self.writers[i].write_table(table.cast(self.writers[i].schema))
+    
+    def close(self):
+        for writer in self.writers:
+            if writer is not None:
+                writer.close()
+
+
+class _SqliteBatchWriter:
+    """Load batches into the sessions / events tables of ecommerce.db
+    
+    Batches go through EcommerceDatabase.ingest_batches(), the same bulk
+    load as load_data(): load PRAGMAs, deferred indexes, the rollup and
+    sketches, and the watermark later appends start from.
+    """
+    
+    def __init__(self, output_dir):
+        from database import EcommerceDatabase
+        
+        self.paths = (f'{output_dir}/ecommerce.db',)
+        if os.path.exists(self.paths[0]):
+            os.remove(self.paths[0])
+        
+        self.db = EcommerceDatabase(self.paths[0])
+        self.db.connect()
+    
+    def write_batches(self, batches):
+        self.db.ingest_batches(batches)
+    
+    def close(self):
+        self.db.close()
+
+
 if __name__ == "__main__":
     # Generate data
     generator = EcommerceDataGenerator(num_sessions=15000)
@@ -3,22 +3,220 @@ Database Module
 Handles SQLite operations and analytical queries
 """
 
+import re
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
 
+from connection_pool import ConnectionPool
+from event_funnel import EventFunnel
+from hyperloglog import HyperLogLog, HyperLogLogAggregate, group_registers, hash_ids
+from query_cache import QueryCache
+from query_profiler import PROGRESS_INTERVAL, QueryProfiler
+from quantile_sketch import (QuantileSketch, QuantileSketchBuild, QuantileSketchMerge,
+                             group_sketches, sketch_count, sketch_mean, sketch_quantile)
+from schema import (DERIVED_COLUMNS, DURATION_BUCKETS, EVENT_TYPES, ID_FORMATS, PAGES,
+                    derived_columns, to_compact_events, to_legacy_events, to_legacy_sessions)
+from storage import read_table
+
+
+# Table column order, used for bulk inserts. Sessions end with the integer
+# DERIVED_COLUMNS computed at load, which the filters and query 14 read.
+SESSION_COLUMNS = ['session_id', 'user_id', 'timestamp', 'date', 'hour', 'day_of_week',
+                   'traffic_source', 'device', 'location', 'category', 'is_returning',
+                   'landed', 'viewed_product', 'added_to_cart', 'started_checkout',
+                   'completed_purchase', 'session_duration_seconds', 'pages_viewed',
+                   'bounced', 'revenue', 'ad_spend'] + DERIVED_COLUMNS
+EVENT_COLUMNS = ['event_id', 'session_id', 'user_id', 'timestamp', 'event_type', 'page']
+
+# Table definitions of the plain layout (partitions reuse them per period)
+SESSIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    timestamp DATETIME NOT NULL,
+    date DATE NOT NULL,
+    hour INTEGER,
+    day_of_week TEXT,
+    traffic_source TEXT,
+    device TEXT,
+    location TEXT,
+    category TEXT,
+    is_returning BOOLEAN,
+    landed BOOLEAN,
+    viewed_product BOOLEAN,
+    added_to_cart BOOLEAN,
+    started_checkout BOOLEAN,
+    completed_purchase BOOLEAN,
+    session_duration_seconds INTEGER,
+    pages_viewed INTEGER,
+    bounced BOOLEAN,
+    revenue REAL,
+    ad_spend REAL,
+    epoch INTEGER NOT NULL,
+    day_index INTEGER NOT NULL,
+    iso_week INTEGER,
+    month INTEGER,
+    weekday INTEGER,
+    duration_bucket_id INTEGER
+)
+"""
+EVENTS_TABLE = """
+CREATE TABLE IF NOT EXISTS events (
+    event_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    timestamp DATETIME NOT NULL,
+    event_type TEXT,
+    page TEXT,
+    FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+)
+"""
+
+# Star-schema layout: these dimensions live in dim_<name>(id, label) lookup
+# tables, the sessions_fact table keeps <name>_id integer keys, and a sessions
+# view looks the labels back up so every query reads the same columns
+STAR_DIMENSIONS = ['day_of_week', 'traffic_source', 'device', 'location', 'category']
+STAR_SESSION_COLUMNS = [f'{column}_id' if column in STAR_DIMENSIONS else column
+                        for column in SESSION_COLUMNS]
+
+# Compact events layout: a WITHOUT ROWID events_compact table clustered by
+# (session_id, seq) with integer ids, epoch-second timestamps and enum codes
+# into dim_event_type / dim_page, behind an events view in the plain format
+EVENT_ENUMS = {'event_type': EVENT_TYPES, 'page': PAGES}
+COMPACT_EVENT_COLUMNS = ['session_id', 'seq', 'event_id', 'user_id', 'timestamp',
+                         'event_type_id', 'page_id']
+
+# Time-partitioned layout: each period's sessions and events live in their own
+# sessions_p<period> / events_p<period> tables, registered in partitions, behind
+# UNION ALL sessions and events views. Values are the pandas period frequency
+# and the format of the <period> suffix.
+PARTITION_PERIODS = {
+    'month': ('M', '%Y_%m'),
+    'quarter': ('Q', '%Y_q%q'),
+    'year': ('Y', '%Y')
+}
+
+# Secondary indexes, built after bulk inserts rather than maintained row by row.
+# Each sessions index leads with a GROUP BY column of queries 4-11 and covers
+# the measures that query reads, so the report is answered from the index alone.
+INDEXES = {
+    'idx_sessions_traffic_source': 'sessions(traffic_source, completed_purchase, bounced, revenue, ad_spend)',
+    'idx_sessions_device': 'sessions(device, completed_purchase, session_duration_seconds, pages_viewed, revenue)',
+    'idx_sessions_hour': 'sessions(hour, completed_purchase, revenue)',
+    'idx_sessions_date': 'sessions(day_index, completed_purchase, revenue, session_duration_seconds)',
+    'idx_sessions_day_of_week': 'sessions(day_of_week, completed_purchase, revenue)',
+    'idx_sessions_category': 'sessions(category, completed_purchase, revenue)',
+    'idx_sessions_is_returning': 'sessions(is_returning, completed_purchase, revenue)',
+    'idx_sessions_location': 'sessions(location, completed_purchase, revenue)',
+    'idx_events_session_timestamp': 'events(session_id, timestamp)'
+}
+
+# Indexes created by earlier versions of the schema
+RETIRED_INDEXES = ['idx_events_session_id']
+
+# The rollup aggregates each grouping set per date. A full cube over all eight
+# dimensions would have about as many cells as there are sessions, so only the
+# sets the reports group by are materialized.
+ROLLUP_DIMENSIONS = ['hour', 'day_of_week', 'traffic_source', 'device', 'category',
+                     'location', 'is_returning', 'duration_bucket_id']
+ROLLUP_SETS = {
+    'date': [],
+    'hour': ['hour'],
+    'day_of_week': ['day_of_week'],
+    'traffic_source': ['traffic_source'],
+    'device': ['device'],
+    'category': ['category'],
+    'location': ['location'],
+    'is_returning': ['is_returning'],
+    'duration_bucket': ['duration_bucket_id'],
+    'traffic_source,device': ['traffic_source', 'device']
+}
+ROLLUP_MEASURES = ['sessions', 'product_views', 'carts', 'checkouts', 'purchases', 'bounces',
+                   'revenue', 'order_revenue', 'ad_spend', 'duration_sum', 'pages_sum']
+ROLLUP_COLUMNS = ['grouping_set', 'date', 'day_index'] + ROLLUP_DIMENSIONS + ROLLUP_MEASURES
+
+# Per day and rollup key, session_sketches keeps a HyperLogLog sketch of the
+# distinct users and quantile sketches of the durations of purchasing and
+# other sessions and of the order values (see hyperloglog.py and
+# quantile_sketch.py for the error bounds). segment is the key's dimension
+# values as text, so the primary key stays unique where dimensions are NULL.
+# Sketches are merged in memory during a load and written in one pass, or
+# earlier once the buffer holds SKETCH_BUFFER_LIMIT keys (about 14 KB each).
+SKETCHES = {
+    'users': HyperLogLog,
+    'purchase_durations': QuantileSketch,
+    'browse_durations': QuantileSketch,
+    'order_values': QuantileSketch
+}
+SKETCH_COLUMNS = ['grouping_set', 'day_index'] + ROLLUP_DIMENSIONS + ['segment'] + list(SKETCHES)
+SKETCH_BUFFER_LIMIT = 5000
+
+# Value distributions get_value_quantiles() reports, as the quantile sketch
+# columns each one merges
+VALUE_MEASURES = {
+    'session_duration': ['purchase_durations', 'browse_durations'],
+    'purchase_duration': ['purchase_durations'],
+    'browse_duration': ['browse_durations'],
+    'order_value': ['order_values']
+}
+
+# Connection settings for the load window: in-memory rollback journal, no
+# fsync per commit, a large page cache and in-memory temp b-trees for sorting
+BULK_LOAD_PRAGMAS = {
+    'journal_mode': 'MEMORY',
+    'synchronous': 'OFF',
+    'cache_size': -262144,
+    'temp_store': 'MEMORY'
+}
+
 
 class EcommerceDatabase:
     """Manage SQLite database for e-commerce analytics"""
     
-    def __init__(self, db_path='database/ecommerce.db'):
+    def __init__(self, db_path='database/ecommerce.db', cache_entries=128, cache_mb=64,
+                 slow_query_log=None, slow_query_ms=500, star_schema=False,
+                 compact_events=False, partition_by=None):
+        if partition_by is not None and partition_by not in PARTITION_PERIODS:
+            raise ValueError(f"partition_by must be one of: {', '.join(PARTITION_PERIODS)}")
+        if partition_by and (star_schema or compact_events):
+            raise ValueError("partition_by works with the plain sessions and events layouts only")
+        
         self.db_path = db_path
         self.conn = None
         self.cursor = None
+        # Layouts for newly created tables; an existing database keeps its own
+        # until a full (non-append) load recreates the tables
+        self.star_schema = star_schema
+        self.compact_events = compact_events
+        self.partition_by = partition_by
+        self._explaining = False
+        # Set while bulk_load() defers index builds, so new partitions skip them
+        self._indexes_deferred = False
+        # Query results are reused until a load changes the data
+        self.cache = QueryCache(max_entries=cache_entries, max_mb=cache_mb)
+        self.profiler = QueryProfiler(slow_query_log, slow_query_ms)
+        # (data version, rollup ready, star dimension ids, partitions) as last read
+        self._read_state = None
+        # PRAGMA data_version last seen per connection: it changes when another
+        # connection (another instance or process) commits
+        self._data_versions = {}
+        # Sketches of the rows inserted since the last flush, by sketch key
+        self._sketches = {}
+        # Read-only connections for concurrent queries, and the one a worker
+        # thread has borrowed
+        self.pool = None
+        self._local = threading.local()
     
     def connect(self):
         """Establish database connection"""
         try:
             self.conn = sqlite3.connect(self.db_path)
+            _register_functions(self.conn)
             self.cursor = self.conn.cursor()
             print(f"✓ Connected to database: {self.db_path}")
             return True
@@ -29,243 +227,1394 @@ class EcommerceDatabase:
     def create_tables(self):
         """Create database schema"""
         
-        # Sessions table
-        sessions_table = """
-        CREATE TABLE IF NOT EXISTS sessions (
-            session_id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            timestamp DATETIME NOT NULL,
+        star = self._star_layout()
+        compact = self._compact_events_layout()
+        partitioned = self._partitioned_layout()
+        
+        sessions_table = SESSIONS_TABLE
+        events_table = EVENTS_TABLE
+        
+        # Pre-aggregated measures per date and grouping set; dimensions outside
+        # the row's grouping set are NULL
+        rollup_table = """
+        CREATE TABLE IF NOT EXISTS sessions_rollup (
+            grouping_set TEXT NOT NULL,
             date DATE NOT NULL,
+            day_index INTEGER NOT NULL,
             hour INTEGER,
             day_of_week TEXT,
             traffic_source TEXT,
             device TEXT,
-            location TEXT,
             category TEXT,
+            location TEXT,
             is_returning BOOLEAN,
-            landed BOOLEAN,
-            viewed_product BOOLEAN,
-            added_to_cart BOOLEAN,
-            started_checkout BOOLEAN,
-            completed_purchase BOOLEAN,
-            session_duration_seconds INTEGER,
-            pages_viewed INTEGER,
-            bounced BOOLEAN,
+            duration_bucket_id INTEGER,
+            sessions INTEGER,
+            product_views INTEGER,
+            carts INTEGER,
+            checkouts INTEGER,
+            purchases INTEGER,
+            bounces INTEGER,
             revenue REAL,
-            ad_spend REAL
+            order_revenue REAL,
+            ad_spend REAL,
+            duration_sum INTEGER,
+            pages_sum INTEGER
         )
         """
         
-        # Events table
-        events_table = """
-        CREATE TABLE IF NOT EXISTS events (
-            event_id TEXT PRIMARY KEY,
-            session_id TEXT NOT NULL,
-            user_id TEXT NOT NULL,
-            timestamp DATETIME NOT NULL,
-            event_type TEXT,
-            page TEXT,
-            FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+        # Distinct-user and value-distribution sketches per day and rollup key
+        sketches_table = """
+        CREATE TABLE IF NOT EXISTS session_sketches (
+            grouping_set TEXT NOT NULL,
+            day_index INTEGER NOT NULL,
+            hour INTEGER,
+            day_of_week TEXT,
+            traffic_source TEXT,
+            device TEXT,
+            category TEXT,
+            location TEXT,
+            is_returning BOOLEAN,
+            duration_bucket_id INTEGER,
+            segment TEXT NOT NULL,
+            users BLOB NOT NULL,
+            purchase_durations BLOB NOT NULL,
+            browse_durations BLOB NOT NULL,
+            order_values BLOB NOT NULL,
+            PRIMARY KEY (grouping_set, day_index, segment)
         )
         """
         
-        self.cursor.execute(sessions_table)
-        self.cursor.execute(events_table)
+        facts_view = (f"CREATE VIEW IF NOT EXISTS session_facts AS "
+                      f"{_session_facts_select('sessions_fact' if star else 'sessions', star)}")
+        
+        # One row per period of the partitioned layout, with its date range
+        partitions_table = """
+        CREATE TABLE IF NOT EXISTS partitions (
+            period TEXT PRIMARY KEY,
+            granularity TEXT NOT NULL,
+            start_date DATE NOT NULL,
+            end_date DATE NOT NULL
+        )
+        """
+        
+        # High-water mark of loaded session timestamps, for append loads
+        watermarks_table = """
+        CREATE TABLE IF NOT EXISTS load_watermarks (
+            table_name TEXT PRIMARY KEY,
+            watermark DATETIME NOT NULL
+        )
+        """
+        
+        if star:
+            # Same columns, with integer keys into the dimension tables
+            for dimension in STAR_DIMENSIONS:
+                sessions_table = sessions_table.replace(
+                    f" {dimension} TEXT,", f" {dimension}_id INTEGER REFERENCES dim_{dimension}(id),")
+                self.cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS dim_{dimension} (
+                    id INTEGER PRIMARY KEY,
+                    label TEXT NOT NULL UNIQUE
+                )
+                """)
+            sessions_table = sessions_table.replace("EXISTS sessions (", "EXISTS sessions_fact (")
+            events_table = events_table.replace("REFERENCES sessions(", "REFERENCES sessions_fact(")
+            
+            star_view = f"CREATE VIEW IF NOT EXISTS sessions AS {_star_sessions_select()}"
+        
+        if partitioned:
+            if self.cursor.execute("SELECT 1 FROM sqlite_master").fetchone() is None:
+                # Only settable before the first table: drop_partition() can
+                # then hand a dropped period's pages back to the filesystem
+                self.cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.cursor.execute(partitions_table)
+            if self.cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'sessions'").fetchone() is None:
+                self._create_partition_views()
+        else:
+            self.cursor.execute(sessions_table)
+        if star:
+            self.cursor.execute(star_view)
+        if compact:
+            self._create_events_compact()
+            self.cursor.execute(f"CREATE VIEW IF NOT EXISTS events AS {_compact_events_select()}")
+        elif not partitioned:
+            self.cursor.execute(events_table)
+        self.cursor.execute(rollup_table)
+        self.cursor.execute(sketches_table)
+        self.cursor.execute(watermarks_table)
+        self._create_enum_tables({'duration_bucket': [label for _, label in DURATION_BUCKETS]})
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_rollup_set_date ON sessions_rollup(grouping_set, day_index)")
+        self.cursor.execute(facts_view)
         self.conn.commit()
         print("✓ Database tables created")
     
-    def load_data(self, sessions_path, events_path):
-        """Load CSV data into database"""
-        
-        # Load sessions
-        sessions_df = pd.read_csv(sessions_path)
-        sessions_df.to_sql('sessions', self.conn, if_exists='replace', index=False)
-        print(f"✓ Loaded {len(sessions_df)} sessions")
+    def _create_enum_tables(self, enums):
+        """Create dim_<column>(id, label) tables for fixed label lists, ids by list position"""
         
-        # Load events
-        events_df = pd.read_csv(events_path)
-        events_df.to_sql('events', self.conn, if_exists='replace', index=False)
-        print(f"✓ Loaded {len(events_df)} events")
+        for column, labels in enums.items():
+            self.cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS dim_{column} (
+                id INTEGER PRIMARY KEY,
+                label TEXT NOT NULL UNIQUE
+            )
+            """)
+            self.cursor.executemany(f"INSERT OR IGNORE INTO dim_{column} (id, label) VALUES (?, ?)",
+                                    list(enumerate(labels)))
     
-    # ==================== ANALYTICAL QUERIES ====================
+    def _create_events_compact(self):
+        """Create events_compact and its enum tables (not the events view)"""
+        
+        self._create_enum_tables(EVENT_ENUMS)
+        
+        # One session's events are adjacent in the primary key b-tree, so a
+        # per-session scan is a sequential read
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS events_compact (
+            session_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            event_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            event_type_id INTEGER NOT NULL REFERENCES dim_event_type(id),
+            page_id INTEGER NOT NULL REFERENCES dim_page(id),
+            PRIMARY KEY (session_id, seq)
+        ) WITHOUT ROWID
+        """)
     
-    def get_overall_metrics(self):
-        """Query 1: Overall key metrics"""
-        query = """
+    def convert_events(self, vacuum=True):
+        """Convert a plain events table to the compact layout in place
+        
+        The rows are rewritten by one INSERT ... SELECT, numbering each
+        session's events in timestamp order. vacuum=True then rewrites the
+        file so the freed pages are returned to the filesystem.
+        """
+        
+        if self._compact_events_layout():
+            print("✓ Events already use the compact layout")
+            return
+        if self._partitioned_layout():
+            raise ValueError("Partitioned events cannot be converted to the compact layout")
+        
+        self._create_events_compact()
+        self.cursor.execute(f"""
+        INSERT OR IGNORE INTO events_compact ({', '.join(COMPACT_EVENT_COLUMNS)})
         SELECT 
-            COUNT(DISTINCT session_id) as total_sessions,
-            COUNT(DISTINCT user_id) as unique_users,
-            SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) as conversions,
-            ROUND(SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) * 100.0 / 
-                  COUNT(*), 2) as conversion_rate,
-            ROUND(SUM(CASE WHEN bounced = 1 THEN 1 ELSE 0 END) * 100.0 / 
-                  COUNT(*), 2) as bounce_rate,
-            ROUND(AVG(session_duration_seconds), 2) as avg_session_duration,
-            ROUND(AVG(pages_viewed), 2) as avg_pages_per_session,
-            ROUND(SUM(revenue), 2) as total_revenue,
-            ROUND(SUM(ad_spend), 2) as total_ad_spend,
-            ROUND((SUM(revenue) - SUM(ad_spend)) / SUM(ad_spend) * 100, 2) as overall_roi
-        FROM sessions
+            {_integer_id_sql('session_id')},
+            ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY timestamp, event_id) - 1,
+            {_integer_id_sql('event_id')},
+            {_integer_id_sql('user_id')},
+            CAST(strftime('%s', timestamp) AS INTEGER),
+            (SELECT id FROM dim_event_type WHERE label = events.event_type),
+            (SELECT id FROM dim_page WHERE label = events.page)
+        FROM events
+        """)
+        self.cursor.execute("DROP TABLE events")
+        self.cursor.execute(f"CREATE VIEW events AS {_compact_events_select()}")
+        self.conn.commit()
+        self.compact_events = True
+        
+        if vacuum:
+            self.cursor.execute("VACUUM")
+        count = self.cursor.execute("SELECT COUNT(*) FROM events_compact").fetchone()[0]
+        print(f"✓ Converted {count:,} events to the compact layout")
+    
+    def _create_partition_views(self):
+        """(Re)create the sessions and events views over the registered partitions"""
+        
+        periods = [row[0] for row in self.cursor.execute(
+            "SELECT period FROM partitions ORDER BY start_date")]
+        for table in ['sessions', 'events']:
+            self.cursor.execute(f"DROP VIEW IF EXISTS {table}")
+            self.cursor.execute(f"CREATE VIEW {table} AS {_partition_union(table, periods)}")
+    
+    def _add_partitions(self, periods):
+        """Table suffix of each pandas Period, creating the partitions not there yet
+        
+        New partitions get their indexes straight away unless bulk_load() is
+        deferring index builds to the end of the load.
         """
-        return pd.read_sql_query(query, self.conn)
+        
+        granularity = self._partition_granularity()
+        suffix = PARTITION_PERIODS[granularity][1]
+        existing = {row[0] for row in self.cursor.execute("SELECT period FROM partitions")}
+        keys = {}
+        created = False
+        for period in periods:
+            key = keys[period] = period.strftime(suffix)
+            if key in existing:
+                continue
+            self.cursor.execute(SESSIONS_TABLE.replace("EXISTS sessions (", f"EXISTS sessions_p{key} ("))
+            self.cursor.execute(EVENTS_TABLE.replace("EXISTS events (", f"EXISTS events_p{key} (")
+                                .replace("REFERENCES sessions(", f"REFERENCES sessions_p{key}("))
+            self.cursor.execute("INSERT INTO partitions VALUES (?, ?, ?, ?)",
+                                (key, granularity, f"{period.start_time:%Y-%m-%d}",
+                                 f"{period.end_time:%Y-%m-%d}"))
+            existing.add(key)
+            created = True
+        
+        if created:
+            self._create_partition_views()
+            if not self._indexes_deferred:
+                self.create_indexes(analyze=False)
+        return keys
     
-    def get_conversion_funnel(self):
-        """Query 2: Conversion funnel stages"""
-        query = """
-        SELECT 
-            'Landing Page' as stage,
-            1 as stage_order,
-            COUNT(*) as users,
-            100.0 as percentage,
-            0 as drop_off
-        FROM sessions
+    def _partition_granularity(self):
+        """Period length of the partitions: that of the existing ones, else partition_by"""
         
-        UNION ALL
+        row = self.cursor.execute("SELECT granularity FROM partitions LIMIT 1").fetchone()
+        return row[0] if row else (self.partition_by or 'month')
+    
+    def list_partitions(self):
+        """Partitions of the partitioned layout, oldest first, with their date ranges"""
         
-        SELECT 
-            'Product View' as stage,
-            2 as stage_order,
-            SUM(CASE WHEN viewed_product = 1 THEN 1 ELSE 0 END) as users,
-            ROUND(SUM(CASE WHEN viewed_product = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) as percentage,
-            ROUND((COUNT(*) - SUM(CASE WHEN viewed_product = 1 THEN 1 ELSE 0 END)) * 100.0 / COUNT(*), 2) as drop_off
-        FROM sessions
+        return pd.read_sql_query(
+            "SELECT period, granularity, start_date, end_date FROM partitions ORDER BY start_date",
+            self.conn)
+    
+    def drop_partition(self, period, archive_path=None):
+        """Remove one period's sessions and events, e.g. drop_partition('2024_01')
         
-        UNION ALL
+        The period's tables are dropped whole, so the cost does not depend on
+        how many rows they hold; only the period's few rollup rows are
+        deleted. With archive_path the rows are first copied into sessions and
+        events tables of that SQLite file (appending when it already has them),
+        which can then be kept or deleted on its own.
         
-        SELECT 
-            'Add to Cart' as stage,
-            3 as stage_order,
-            SUM(CASE WHEN added_to_cart = 1 THEN 1 ELSE 0 END) as users,
-            ROUND(SUM(CASE WHEN added_to_cart = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) as percentage,
-            ROUND((SUM(CASE WHEN viewed_product = 1 THEN 1 ELSE 0 END) - 
-                   SUM(CASE WHEN added_to_cart = 1 THEN 1 ELSE 0 END)) * 100.0 / 
-                   SUM(CASE WHEN viewed_product = 1 THEN 1 ELSE 0 END), 2) as drop_off
-        FROM sessions
+        Partitioned databases created with this version use incremental
+        auto-vacuum, so the dropped tables' pages are released and the file
+        shrinks. Older files keep the pages for reuse by later loads; run
+        VACUUM on them to give the space back.
+        """
         
-        UNION ALL
+        row = self.cursor.execute(
+            "SELECT start_date, end_date FROM partitions WHERE period = ?", (period,)).fetchone()
+        if row is None:
+            raise ValueError(f"No partition for period {period}")
         
-        SELECT 
-            'Checkout Started' as stage,
-            4 as stage_order,
-            SUM(CASE WHEN started_checkout = 1 THEN 1 ELSE 0 END) as users,
-            ROUND(SUM(CASE WHEN started_checkout = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) as percentage,
-            ROUND((SUM(CASE WHEN added_to_cart = 1 THEN 1 ELSE 0 END) - 
-                   SUM(CASE WHEN started_checkout = 1 THEN 1 ELSE 0 END)) * 100.0 / 
-                   SUM(CASE WHEN added_to_cart = 1 THEN 1 ELSE 0 END), 2) as drop_off
-        FROM sessions
+        self.conn.commit()
+        if archive_path:
+            self.cursor.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+            try:
+                for table, definition in [('sessions', SESSIONS_TABLE), ('events', EVENTS_TABLE)]:
+                    self.cursor.execute(definition.replace(f"EXISTS {table} (",
+                                                           f"EXISTS archive.{table} ("))
+                    self.cursor.execute(
+                        f"INSERT OR IGNORE INTO archive.{table} SELECT * FROM {table}_p{period}")
+                self.conn.commit()
+            finally:
+                self.cursor.execute("DETACH DATABASE archive")
         
-        UNION ALL
+        self.cursor.execute(f"DROP TABLE IF EXISTS events_p{period}")
+        self.cursor.execute(f"DROP TABLE IF EXISTS sessions_p{period}")
+        self.cursor.execute("DELETE FROM partitions WHERE period = ?", (period,))
+        self.cursor.execute("DELETE FROM sessions_rollup WHERE date BETWEEN ? AND ?", row)
+        self.cursor.execute("DELETE FROM session_sketches WHERE day_index BETWEEN ? AND ?",
+                            [int(np.datetime64(day, 'D').astype(np.int64)) for day in row])
+        self._create_partition_views()
+        self.conn.commit()
+        if self.cursor.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            # INCREMENTAL: truncate the freed pages off the end of the file
+            # (executescript steps the pragma to completion, one page per step)
+            self.conn.executescript("PRAGMA incremental_vacuum")
+        else:
+            print("  (the freed pages stay in the file until a VACUUM)")
+        self.cache.bump_version()
+        print(f"✓ Dropped partition {period}" + (f" (archived to {archive_path})" if archive_path else ""))
+    
+    def create_indexes(self, analyze=True):
+        """Create the secondary indexes and refresh the planner statistics"""
         
-        SELECT 
-            'Purchase Complete' as stage,
-            5 as stage_order,
-            SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) as users,
-            ROUND(SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) as percentage,
-            ROUND((SUM(CASE WHEN started_checkout = 1 THEN 1 ELSE 0 END) - 
-                   SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END)) * 100.0 / 
-                   SUM(CASE WHEN started_checkout = 1 THEN 1 ELSE 0 END), 2) as drop_off
-        FROM sessions
+        existing = dict(self.cursor.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index'").fetchall())
+        for name in RETIRED_INDEXES:
+            self.cursor.execute(f"DROP INDEX IF EXISTS {name}")
+        for name, target in self._index_targets().items():
+            definition = f"CREATE INDEX {name} ON {target}"
+            if existing.get(name) == definition:
+                continue
+            # Rebuild indexes whose definition changed since they were created
+            self.cursor.execute(f"DROP INDEX IF EXISTS {name}")
+            self.cursor.execute(definition)
+        if analyze:
+            self.cursor.execute("ANALYZE")
+        self.conn.commit()
+    
+    def _index_targets(self):
+        """INDEXES adjusted to the layouts in use
         
-        ORDER BY stage_order
+        The star layout moves sessions indexes onto sessions_fact's keys; the
+        compact events table needs none, its primary key already orders
+        events by session and time. The partitioned layout indexes every
+        partition on its own.
         """
-        return pd.read_sql_query(query, self.conn)
+        
+        targets = dict(INDEXES)
+        if self._compact_events_layout():
+            targets = {name: target for name, target in targets.items()
+                       if not target.startswith('events(')}
+        if self._partitioned_layout():
+            periods = [row[0] for row in self.cursor.execute("SELECT period FROM partitions")]
+            return {f"{name}_p{period}": target.replace('(', f"_p{period}(", 1)
+                    for period in periods for name, target in targets.items()}
+        if not self._star_layout():
+            return targets
+        
+        dimension = re.compile(r"\b({})\b".format('|'.join(STAR_DIMENSIONS)))
+        return {name: dimension.sub(r"\1_id", target.replace('sessions(', 'sessions_fact('))
+                if target.startswith('sessions(') else target
+                for name, target in targets.items()}
     
-    def get_cart_abandonment_rate(self):
-        """Query 3: Cart abandonment analysis"""
+    def _star_layout(self, conn=None):
+        """True when sessions is stored in the star layout (sessions is then a view)"""
+        
+        return self._has_layout_table('sessions_fact', self.star_schema, conn)
+    
+    def _compact_events_layout(self, conn=None):
+        """True when events are stored in events_compact (events is then a view)"""
+        
+        return self._has_layout_table('events_compact', self.compact_events, conn)
+    
+    def _partitioned_layout(self, conn=None):
+        """True when sessions and events are stored in per-period partitions (behind views)"""
+        
+        return self._has_layout_table('partitions', self.partition_by is not None, conn)
+    
+    def _has_layout_table(self, table, default, conn=None):
+        """Whether the database has a layout's table; default while there are no tables yet"""
+        
+        conn = conn or self.conn
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sessions'").fetchone() is None:
+            return default
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone() is not None
+    
+    def drop_indexes(self):
+        """Drop the secondary indexes (primary keys are part of the tables)"""
+        
+        for name in self._index_targets():
+            self.cursor.execute(f"DROP INDEX IF EXISTS {name}")
+        self.conn.commit()
+    
+    def list_indexes(self):
+        """Indexes present in the database, with their definitions"""
+        
         query = """
-        SELECT 
-            COUNT(CASE WHEN added_to_cart = 1 THEN 1 END) as carts_created,
-            COUNT(CASE WHEN added_to_cart = 1 AND completed_purchase = 0 THEN 1 END) as carts_abandoned,
-            COUNT(CASE WHEN completed_purchase = 1 THEN 1 END) as carts_purchased,
-            ROUND(COUNT(CASE WHEN added_to_cart = 1 AND completed_purchase = 0 THEN 1 END) * 100.0 / 
-                  COUNT(CASE WHEN added_to_cart = 1 THEN 1 END), 2) as abandonment_rate
-        FROM sessions
+        SELECT name, tbl_name as table_name, sql
+        FROM sqlite_master
+        WHERE type = 'index'
+        ORDER BY tbl_name, name
         """
         return pd.read_sql_query(query, self.conn)
     
-    def get_traffic_source_performance(self):
+    def explain_queries(self, verbose=True):
+        """EXPLAIN QUERY PLAN for every analytical query
+        
+        Returns one row per plan step; index_served is False when a step of
+        the query scans a table's rows (SCAN of a table without a covering
+        index). Keyed SEARCH steps, rowid lookups included, and scans of
+        subquery results count as served.
+        """
+        
+        plans = []
+        self._explaining = True
+        try:
+            for name in QUERY_METHODS:
+                plan = getattr(self, name)()
+                plan.insert(0, 'query', name[len('get_'):])
+                plans.append(plan)
+        finally:
+            self._explaining = False
+        
+        plans = pd.concat(plans, ignore_index=True)
+        tables = {row[0] for row in self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")}
+        words = plans['detail'].str.split()
+        table_scans = ((words.str[0] == 'SCAN') & words.str[1].isin(tables)
+                       & ~plans['detail'].str.contains('COVERING INDEX'))
+        plans['index_served'] = ~table_scans.groupby(plans['query'], sort=False).transform('any')
+        
+        if verbose:
+            for name, plan in plans.groupby('query', sort=False):
+                status = "✓" if plan['index_served'].iloc[0] else "✗"
+                print(f"{status} {name}")
+                for detail in plan['detail']:
+                    print(f"    {detail}")
+        return plans
+    
+    @contextmanager
+    def bulk_load(self, rebuild_indexes=True):
+        """Tune the connection for a bulk insert, restoring its settings after
+        
+        Secondary indexes are dropped for the load and rebuilt in one pass
+        once the rows are in; the tables keep their declared schema. Appends
+        pass rebuild_indexes=False, since rebuilding costs the whole table.
+        """
+        
+        self.conn.commit()
+        pragmas = dict(BULK_LOAD_PRAGMAS)
+        if self.cursor.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+            # Leaving WAL needs exclusive access, which pooled readers prevent
+            del pragmas['journal_mode']
+        saved = {name: self.cursor.execute(f"PRAGMA {name}").fetchone()[0]
+                 for name in pragmas}
+        for name, value in pragmas.items():
+            self.cursor.execute(f"PRAGMA {name} = {value}")
+        if rebuild_indexes:
+            self.drop_indexes()
+        self._indexes_deferred = rebuild_indexes
+        
+        try:
+            yield
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self._indexes_deferred = False
+            if rebuild_indexes:
+                self.create_indexes()
+            for name, value in saved.items():
+                self.cursor.execute(f"PRAGMA {name} = {value}")
+    
+    def load_data(self, sessions_path, events_path, append=False):
+        """Bulk load CSV, Parquet or Feather data into database
+        
+        With append=True only sessions newer than the stored watermark are
+        added (see ingest_batches) instead of replacing the tables.
+        """
+        
+        self.ingest_frames(read_table(sessions_path), read_table(events_path), append=append)
+    
+    def reset_tables(self):
+        """Drop and recreate the tables, in the star_schema / compact_events / partition_by layouts"""
+        
+        self.cursor.execute("DROP VIEW IF EXISTS session_facts")
+        if self._partitioned_layout():
+            self.cursor.execute("DROP VIEW IF EXISTS sessions")
+            self.cursor.execute("DROP VIEW IF EXISTS events")
+            for (table,) in self.cursor.execute("""
+                    SELECT name FROM sqlite_master
+                    WHERE type = 'table' AND (name GLOB 'events_p*' OR name GLOB 'sessions_p*')
+                    ORDER BY name""").fetchall():
+                self.cursor.execute(f"DROP TABLE {table}")
+            self.cursor.execute("DROP TABLE IF EXISTS partitions")
+        if self._star_layout():
+            self.cursor.execute("DROP VIEW IF EXISTS sessions")
+        if self._compact_events_layout():
+            self.cursor.execute("DROP VIEW IF EXISTS events")
+        self.cursor.execute("DROP TABLE IF EXISTS sessions_rollup")
+        self.cursor.execute("DROP TABLE IF EXISTS session_sketches")
+        self.cursor.execute("DROP TABLE IF EXISTS user_sketches")
+        self.cursor.execute("DROP TABLE IF EXISTS load_watermarks")
+        self.cursor.execute("DROP TABLE IF EXISTS events")
+        self.cursor.execute("DROP TABLE IF EXISTS sessions")
+        self.cursor.execute("DROP TABLE IF EXISTS sessions_fact")
+        self.cursor.execute("DROP TABLE IF EXISTS events_compact")
+        for dimension in STAR_DIMENSIONS + list(EVENT_ENUMS) + ['duration_bucket']:
+            self.cursor.execute(f"DROP TABLE IF EXISTS dim_{dimension}")
+        self.conn.commit()
+        self._sketches = {}
+        self.cache.bump_version()
+        self.create_tables()
+    
+    def ingest_frames(self, sessions_df, events_df, batch_size=100000, append=False):
+        """Insert in-memory generator frames directly, without a file round-trip"""
+        
+        # Each batch carries the events of its own sessions (events without a
+        # session go with the first batch)
+        ids = pd.Index(sessions_df['session_id'])
+        first_rows = np.flatnonzero(~ids.duplicated())
+        matches = ids[first_rows].get_indexer(events_df['session_id'])
+        positions = np.where(matches >= 0, first_rows[matches], 0)
+        event_batches = positions // batch_size
+        order = np.argsort(event_batches, kind='stable')
+        starts = np.searchsorted(event_batches[order], np.arange(len(sessions_df) // batch_size + 2))
+        
+        def batches():
+            for number, start in enumerate(range(0, len(sessions_df), batch_size)):
+                yield (sessions_df.iloc[start:start + batch_size],
+                       events_df.iloc[order[starts[number]:starts[number + 1]]])
+        
+        return self.ingest_batches(batches(), append=append)
+    
+    def ingest_batches(self, batches, rows_per_commit=1000000, append=False):
+        """Stream (sessions_df, events_df) batches into the tables
+        
+        Accepts legacy or compact frames, e.g. EcommerceDataGenerator.iter_batches().
+        Rows go in through executemany under bulk_load() and are committed in
+        large transactions of about rows_per_commit rows.
+        
+        By default the tables are replaced. With append=True, sessions older
+        than the watermark or whose id is already stored (on any day) are
+        skipped along with their events, indexes are maintained in place and
+        only the rollup dates the new rows touch are re-compacted, so the cost
+        follows the new rows rather than the table size. A new session whose
+        events reuse stored event ids raises ValueError rather than losing
+        those events.
+        """
+        
+        if append:
+            self.create_tables()
+            self.upgrade_tables()
+        else:
+            self.reset_tables()
+        
+        watermark = self.get_watermark() if append else None
+        
+        total_sessions, total_events, skipped, pending = 0, 0, 0, 0
+        first, latest = None, None
+        with self.bulk_load(rebuild_indexes=not append):
+            for sessions_df, events_df in batches:
+                if append:
+                    received = len(sessions_df)
+                    sessions_df, events_df = _new_rows(sessions_df, events_df, watermark)
+                    sessions_df, events_df = self._unstored_rows(sessions_df, events_df)
+                    skipped += received - len(sessions_df)
+                if len(sessions_df) == 0:
+                    continue
+                
+                self.insert_frames(sessions_df, events_df)
+                timestamps = pd.to_datetime(sessions_df['timestamp'])
+                first = min(first or timestamps.min(), timestamps.min())
+                latest = max(latest or timestamps.max(), timestamps.max())
+                
+                total_sessions += len(sessions_df)
+                total_events += len(events_df)
+                pending += len(sessions_df) + len(events_df)
+                if pending >= rows_per_commit:
+                    self.conn.commit()
+                    pending = 0
+            if latest is not None:
+                self.compact_rollup(since=f"{first:%Y-%m-%d}" if append else None)
+                latest = f"{latest:%Y-%m-%d %H:%M:%S}"
+                if watermark is None or latest > watermark:
+                    self.cursor.execute(
+                        "INSERT OR REPLACE INTO load_watermarks VALUES ('sessions', ?)", (latest,))
+        
+        print(f"✓ Ingested {total_sessions} sessions")
+        print(f"✓ Ingested {total_events} events")
+        if skipped:
+            print(f"✓ Skipped {skipped} sessions already loaded")
+        return total_sessions, total_events
+    
+    def _unstored_rows(self, sessions_df, events_df):
+        """The batch's sessions whose ids are not stored yet, and their events
+        
+        Ids are looked up through the primary keys of every session table, so
+        the cost follows the batch. Events already stored for their session
+        are dropped; raises ValueError when an event id is stored for another
+        session.
+        """
+        
+        stored = self._stored_ids(self._session_tables(), 'session_id', sessions_df['session_id'])
+        sessions_df = sessions_df[~sessions_df['session_id'].isin(stored)]
+        events_df = events_df[events_df['session_id'].isin(sessions_df['session_id'])]
+        
+        if self._compact_events_layout():
+            # events_compact is keyed by (session_id, seq), not event_id
+            return sessions_df, events_df
+        if self._partitioned_layout():
+            tables = [f"events_p{table[len('sessions_p'):]}" for table in self._session_tables()]
+        else:
+            tables = ['events']
+        owners = self._stored_ids(tables, 'event_id', events_df['event_id'], owner='session_id')
+        stored = events_df['event_id'].map(owners)
+        taken = set(events_df['event_id'][stored.notna() & (stored != events_df['session_id'])])
+        events_df = events_df[stored.isna()]
+        if taken:
+            raise ValueError(f"{len(taken)} new events reuse stored event ids "
+                             f"(e.g. {sorted(taken)[0]}); renumber them before appending")
+        return sessions_df, events_df
+    
+    def _stored_ids(self, tables, column, ids, owner=None):
+        """The ids that some table already holds in column (a key lookup per id and table)
+        
+        With owner, a dict of each stored id's value in that column instead.
+        """
+        
+        if not len(ids) or not tables:
+            return {} if owner else set()
+        self.cursor.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_ids (id TEXT PRIMARY KEY)")
+        self.cursor.execute("DELETE FROM lookup_ids")
+        self.cursor.executemany("INSERT OR IGNORE INTO lookup_ids VALUES (?)",
+                                [(value,) for value in pd.unique(ids)])
+        if owner:
+            values = ", ".join(f"(SELECT {owner} FROM {table} WHERE {column} = lookup_ids.id)"
+                               for table in tables)
+            values = f"COALESCE({values}, NULL)"
+            return dict(self.cursor.execute(
+                f"SELECT id, value FROM (SELECT id, {values} as value FROM lookup_ids) "
+                "WHERE value IS NOT NULL"))
+        found = " OR ".join(f"EXISTS (SELECT 1 FROM {table} WHERE {column} = lookup_ids.id)"
+                            for table in tables)
+        return {row[0] for row in self.cursor.execute(f"SELECT id FROM lookup_ids WHERE {found}")}
+    
+    def get_watermark(self):
+        """Latest loaded session timestamp ('YYYY-MM-DD HH:MM:SS'), or None"""
+        
+        if self.cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'load_watermarks'").fetchone():
+            row = self.cursor.execute(
+                "SELECT watermark FROM load_watermarks WHERE table_name = 'sessions'").fetchone()
+            if row:
+                return row[0]
+        # Databases loaded before watermarks were kept: the date index finds the last day
+        return self.cursor.execute("""
+            SELECT MAX(timestamp) FROM sessions
+            WHERE day_index = (SELECT MAX(day_index) FROM sessions)
+        """).fetchone()[0]
+    
+    def insert_frames(self, sessions_df, events_df):
+        """Insert one batch of frames in the open transaction (caller commits)
+        
+        The batch's rollup rows are appended too, and its sessions added to
+        the buffered sketches; compact_rollup() merges the rollup rows and
+        writes the sketches once the load is done.
+        """
+        
+        if self._partitioned_layout():
+            self._insert_partitions(sessions_df, events_df)
+        elif self._star_layout():
+            self._insert_rows('sessions_fact', STAR_SESSION_COLUMNS,
+                              _session_rows(sessions_df, self._dimension_ids(sessions_df)))
+        else:
+            self._insert_rows('sessions', SESSION_COLUMNS, _session_rows(sessions_df))
+        if self._compact_events_layout():
+            self._insert_rows('events_compact', COMPACT_EVENT_COLUMNS,
+                              _compact_event_rows(events_df), or_ignore=True)
+        elif not self._partitioned_layout():
+            self._insert_rows('events', EVENT_COLUMNS, _event_rows(events_df), or_ignore=True)
+        self._insert_rows('sessions_rollup', ROLLUP_COLUMNS, _rollup_rows(sessions_df))
+        self._buffer_sketches(sessions_df)
+        self.cache.bump_version()
+    
+    def _insert_partitions(self, sessions_df, events_df):
+        """Insert a batch into the partitions of its sessions' periods, adding new ones
+        
+        Events go to their session's partition; events whose session is not
+        in the batch go by their own timestamp.
+        """
+        
+        sessions_df = to_legacy_sessions(sessions_df)
+        events_df = to_legacy_events(events_df)
+        freq = PARTITION_PERIODS[self._partition_granularity()][0]
+        
+        # Each partition's primary key only sees its own period, so check ids
+        # across partitions the way the single sessions table would
+        duplicated = sessions_df['session_id'][sessions_df['session_id'].duplicated()]
+        stored = self._stored_ids(self._session_tables(), 'session_id', sessions_df['session_id'])
+        if len(duplicated) or stored:
+            example = duplicated.iloc[0] if len(duplicated) else sorted(stored)[0]
+            raise sqlite3.IntegrityError(
+                f"UNIQUE constraint failed: sessions.session_id ({example} repeated across partitions)")
+        
+        session_periods = pd.to_datetime(sessions_df['timestamp']).dt.to_period(freq)
+        event_periods = pd.to_datetime(events_df['timestamp']).dt.to_period(freq)
+        ids = pd.Index(sessions_df['session_id'])
+        first_rows = np.flatnonzero(~ids.duplicated())
+        matches = ids[first_rows].get_indexer(events_df['session_id'])
+        session_ordinals = session_periods.array.asi8
+        event_ordinals = np.where(matches >= 0, session_ordinals[first_rows[matches]],
+                                  event_periods.array.asi8)
+        
+        periods = [pd.Period(ordinal=ordinal, freq=freq)
+                   for ordinal in np.unique(np.concatenate([session_ordinals, event_ordinals]))]
+        for period, key in self._add_partitions(periods).items():
+            self._insert_rows(f'sessions_p{key}', SESSION_COLUMNS,
+                              _session_rows(sessions_df[session_ordinals == period.ordinal]))
+            self._insert_rows(f'events_p{key}', EVENT_COLUMNS,
+                              _event_rows(events_df[event_ordinals == period.ordinal]),
+                              or_ignore=True)
+    
+    def _dimension_ids(self, sessions_df):
+        """Lookup-table id of every label in the batch, per star dimension
+        
+        Labels not seen before are added to their dimension table.
+        """
+        
+        ids = {}
+        for dimension in STAR_DIMENSIONS:
+            labels = pd.unique(sessions_df[dimension].astype(str))
+            self.cursor.executemany(f"INSERT OR IGNORE INTO dim_{dimension} (label) VALUES (?)",
+                                    [(label,) for label in labels])
+            ids[dimension] = dict(self.cursor.execute(f"SELECT label, id FROM dim_{dimension}"))
+        return ids
+    
+    def compact_rollup(self, since=None):
+        """Merge rollup rows that share a key (optionally only from date since on)
+        
+        Appended batches leave several partial rows per key; the queries sum
+        them either way, this just keeps the table small. The buffered
+        sketches are written too.
+        """
+        
+        self._flush_sketches()
+        
+        keys = ', '.join(['grouping_set', 'date', 'day_index'] + ROLLUP_DIMENSIONS)
+        sums = ', '.join(f"SUM({measure})" for measure in ROLLUP_MEASURES)
+        where, params = ("WHERE date >= ?", (since,)) if since else ("", ())
+        
+        self.cursor.execute("DROP TABLE IF EXISTS temp.rollup_compacted")
+        self.cursor.execute(f"""
+            CREATE TEMP TABLE rollup_compacted AS
+            SELECT {keys}, {sums} FROM sessions_rollup {where} GROUP BY {keys}
+        """, params)
+        self.cursor.execute(f"DELETE FROM sessions_rollup {where}", params)
+        self.cursor.execute("INSERT INTO sessions_rollup SELECT * FROM temp.rollup_compacted")
+        self.cursor.execute("DROP TABLE temp.rollup_compacted")
+        self.conn.commit()
+        self.cache.bump_version()
+    
+    def _buffer_sketches(self, sessions_df):
+        """Fold a sessions batch into the buffered sketches, flushing a full buffer"""
+        
+        for key, sketches in _sketch_groups(sessions_df):
+            buffered = self._sketches.get(key)
+            if buffered is None:
+                self._sketches[key] = sketches
+            else:
+                for sketch, other in zip(buffered, sketches):
+                    sketch.merge(other)
+        if len(self._sketches) > SKETCH_BUFFER_LIMIT:
+            self._flush_sketches()
+    
+    def _flush_sketches(self):
+        """Merge the buffered sketches into session_sketches (in the open transaction)"""
+        
+        if not self._sketches:
+            return
+        days = [key[1] for key in self._sketches]
+        stored = {tuple(row[:3]): row[3:] for row in self.cursor.execute(f"""
+            SELECT grouping_set, day_index, segment, {', '.join(SKETCHES)} FROM session_sketches
+            WHERE day_index BETWEEN ? AND ?""", (min(days), max(days)))}
+        
+        rows = []
+        for key, sketches in self._sketches.items():
+            segment = ','.join('' if value is None else str(value) for value in key[2:])
+            blobs = stored.get((key[0], key[1], segment))
+            if blobs is not None:
+                for sketch, kind, blob in zip(sketches, SKETCHES.values(), blobs):
+                    sketch.merge(kind.from_blob(blob))
+            rows.append(key + (segment,) + tuple(sketch.to_blob() for sketch in sketches))
+        self.cursor.executemany(
+            f"INSERT OR REPLACE INTO session_sketches ({', '.join(SKETCH_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(SKETCH_COLUMNS))})", rows)
+        self._sketches = {}
+    
+    def rebuild_rollup(self, chunksize=200000):
+        """Recompute the rollup and sketches from the sessions table (e.g. for older databases)"""
+        
+        self.create_tables()
+        self.cursor.execute("DELETE FROM sessions_rollup")
+        self.cursor.execute("DELETE FROM session_sketches")
+        self._sketches = {}
+        for chunk in pd.read_sql_query("SELECT * FROM sessions", self.conn, chunksize=chunksize):
+            self._insert_rows('sessions_rollup', ROLLUP_COLUMNS, _rollup_rows(chunk))
+            self._buffer_sketches(chunk)
+        self.compact_rollup()
+        
+        count = self.cursor.execute("SELECT COUNT(*) FROM sessions_rollup").fetchone()[0]
+        print(f"✓ Rebuilt rollup: {count} rows")
+    
+    def upgrade_tables(self):
+        """Add the derived session columns and sketches to a database loaded before they existed
+        
+        Each sessions table is filled by one UPDATE computing the columns from
+        the stored text timestamps; the views, the rollup and the sketches,
+        which read them, are then recreated. Does nothing for an up-to-date
+        database.
+        """
+        
+        tables = self._session_tables()
+        missing = {table: [column for column in DERIVED_COLUMNS
+                           if column not in self._table_columns(table)] for table in tables}
+        if ('day_index' in self._table_columns('sessions_rollup')
+                and self._table_columns('session_sketches') and not any(missing.values())):
+            return
+        
+        expressions = _derived_columns_sql()
+        for table, columns in missing.items():
+            for column in columns:
+                self.cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER")
+            if columns:
+                assignments = ', '.join(f"{column} = {expressions[column]}" for column in columns)
+                self.cursor.execute(f"UPDATE {table} SET {assignments}")
+        
+        self.cursor.execute("DROP VIEW IF EXISTS session_facts")
+        self.cursor.execute("DROP TABLE IF EXISTS user_sketches")
+        if self._star_layout():
+            self.cursor.execute("DROP VIEW sessions")
+            self.cursor.execute(f"CREATE VIEW sessions AS {_star_sessions_select()}")
+        self.cursor.execute("DROP TABLE IF EXISTS sessions_rollup")
+        self.conn.commit()
+        self.rebuild_rollup()
+        self.create_indexes()
+        if any(missing.values()):
+            print(f"✓ Added derived columns to {len(tables)} sessions table(s)")
+    
+    def _session_tables(self):
+        """Tables physically holding the session rows, in the layout in use"""
+        
+        if self._partitioned_layout():
+            return [f"sessions_p{row[0]}" for row in
+                    self.cursor.execute("SELECT period FROM partitions ORDER BY start_date")]
+        return ['sessions_fact' if self._star_layout() else 'sessions']
+    
+    def _table_columns(self, table):
+        """Column names of a table (empty when it does not exist)"""
+        
+        return {row[1] for row in self.cursor.execute(f"PRAGMA table_info({table})")}
+    
+    def _read_layout(self):
+        """(rollup ready, dimension ids, partitions) for the current data version
+        
+        dimension ids map each star dimension's labels to their keys, and
+        are None when sessions uses the plain layout. partitions lists the
+        (period, start_date, end_date) of the partitioned layout, else None.
+        """
+        
+        if self._read_state is None or self._read_state[0] != self.cache.version:
+            reader = self._reader()
+            rollup_columns = {row[1] for row in reader.execute("PRAGMA table_info(sessions_rollup)")}
+            sketches = reader.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'session_sketches'").fetchone()
+            if 'day_index' not in rollup_columns or sketches is None:
+                # Database loaded before the rollup, the derived columns or the
+                # sketches existed
+                self.upgrade_tables()
+            ready = reader.execute("SELECT 1 FROM sessions_rollup LIMIT 1").fetchone()
+            ids = None
+            if self._star_layout(reader):
+                ids = {dimension: dict(reader.execute(f"SELECT label, id FROM dim_{dimension}"))
+                       for dimension in STAR_DIMENSIONS}
+            partitions = None
+            if self._partitioned_layout(reader):
+                partitions = reader.execute(
+                    "SELECT period, start_date, end_date FROM partitions ORDER BY start_date").fetchall()
+            self._read_state = (self.cache.version, bool(ready), ids, partitions)
+        return self._read_state[1:]
+    
+    def _rollup_source(self, grouping_set, filters=None):
+        """FROM clause for a report: a rollup grouping set, or the raw sessions
+        
+        A filter on dimensions outside grouping_set moves the report to the
+        smallest grouping set that holds them too (date is in every set); when
+        no set does, the report reads session_facts.
+        """
+        
+        rollup_ready = self._read_layout()[0]
+        needed = set(ROLLUP_SETS[grouping_set]) | (filters.columns() if filters else set())
+        candidates = [name for name, dims in ROLLUP_SETS.items() if needed <= set(dims)]
+        if rollup_ready and candidates:
+            grouping_set = min(candidates, key=lambda name: len(ROLLUP_SETS[name]))
+            return f"(SELECT * FROM sessions_rollup WHERE grouping_set = '{grouping_set}')"
+        return "session_facts"
+    
+    def _run_query(self, name, query, params=(), rollup=None, filters=None):
+        """Run one analytical query through the result cache
+        
+        rollup names the query's grouping set; the placeholders (see
+        _compose) are filled only on a cache miss. filters, a QueryFilter, is
+        part of the cache key. Under explain_queries() the plan is returned
+        instead, bypassing the cache; under stream() a generator of chunks.
+        """
+        
+        if self._explaining:
+            query, params = self._compose(query, params, rollup, filters)
+            return pd.read_sql_query(f"EXPLAIN QUERY PLAN {query}", self._reader(), params=params)
+        
+        stream = getattr(self._local, 'stream', None)
+        if stream and stream[0] == name:
+            query, params = self._compose(query, params, rollup, filters)
+            return self._stream_rows(name, query, params, stream[1])
+        
+        start = time.perf_counter()
+        self._check_data_version()
+        key = (name, tuple(params), filters.key() if filters else None)
+        version = self.cache.version
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.profiler.record(name, (time.perf_counter() - start) * 1000, len(cached),
+                                 int(cached.memory_usage(deep=True).sum()), cached=True)
+            return cached
+        
+        query, params = self._compose(query, params, rollup, filters)
+        conn = self._reader()
+        
+        # Count VM work through the progress handler while the query runs
+        ticks = [0]
+        
+        def tick():
+            ticks[0] += 1
+        
+        conn.set_progress_handler(tick, PROGRESS_INTERVAL)
+        try:
+            df = pd.read_sql_query(query, conn, params=params)
+        finally:
+            conn.set_progress_handler(None, PROGRESS_INTERVAL)
+        wall_ms = (time.perf_counter() - start) * 1000
+        
+        if (name, key[2]) not in self.profiler.plans:
+            plan = pd.read_sql_query(f"EXPLAIN QUERY PLAN {query}", conn, params=params)
+            self.profiler.add_plan(name, key[2], ' | '.join(plan['detail']))
+        self.profiler.record(name, wall_ms, len(df), int(df.memory_usage(deep=True).sum()),
+                             vm_steps=ticks[0] * PROGRESS_INTERVAL, filters_key=key[2])
+        
+        self.cache.put(key, df, version)
+        return df
+    
+    def _check_data_version(self):
+        """Drop the cached results if another connection committed since the
+        reading connection last looked
+        
+        Loads through this instance bump the cache themselves; this catches
+        loads through another EcommerceDatabase or process. A connection seen
+        for the first time only records its value, so opening the pool does
+        not drop the results its workers have just cached.
+        """
+        
+        conn = self._reader()
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        previous = self._data_versions.setdefault(id(conn), version)
+        if previous != version:
+            self._data_versions[id(conn)] = version
+            self.cache.bump_version()
+    
+    def _compose(self, query, params, rollup=None, filters=None):
+        """Fill a query's placeholders, returning the SQL and its parameters
+        
+        {source} is the rollup grouping set or session_facts, {sessions} the
+        table holding the session rows and {where} the compiled filters. In
+        the star layout filters on raw rows match dimension keys, not labels;
+        in the partitioned layout raw rows are read only from the partitions
+        the filter's dates overlap. {users} is a one-row unique_users table
+        and {values} a table of quantile sketch columns (see _users_source and
+        _values_source); they bind their own filter parameters, after those of
+        {where}, so they must follow it in the query.
+        """
+        
+        source = self._rollup_source(rollup, filters) if rollup else None
+        dimension_ids = self._read_layout()[1]
+        star = dimension_ids is not None
+        if source not in (None, 'session_facts'):
+            # The rollup keeps labels
+            dimension_ids = None
+        where, filter_params = filters.compile(dimension_ids) if filters else ("", ())
+        sessions = 'sessions_fact' if star else self._sessions_source(filters)
+        if star and source == 'session_facts':
+            source, where = self._star_facts_source(rollup, query, where), ""
+        elif source == 'session_facts' and sessions != 'sessions':
+            source = f"({_session_facts_select(sessions)})"
+        users, user_params = "", ()
+        if '{users}' in query:
+            users, user_params = self._users_source(filters, sessions, where, filter_params)
+        values, value_params = "", ()
+        if '{values}' in query:
+            values, value_params = self._values_source(filters, sessions, where, filter_params)
+        if '{where}' not in query:
+            filter_params = ()
+        query = query.format(source=source, sessions=sessions, where=where, users=users,
+                             values=values)
+        return query, tuple(params) + filter_params + user_params + value_params
+    
+    def _users_source(self, filters, sessions, where, filter_params):
+        """Distinct users in the filter's slice, as a one-row table, and its parameters
+        
+        The user sketches of the smallest grouping set holding the filter's
+        dimensions are merged by the hll_count aggregate, an estimate within
+        the error bound of hyperloglog.py. Filters no grouping set holds, or a
+        database without a rollup, fall back to an exact COUNT(DISTINCT) over
+        the raw sessions.
+        """
+        
+        sketch_where = self._sketch_where(filters)
+        if sketch_where is None:
+            return (f"(SELECT COUNT(DISTINCT user_id) as unique_users FROM {sessions} {where})",
+                    filter_params)
+        where, params = sketch_where
+        return f"(SELECT hll_count(users) as unique_users FROM session_sketches {where})", params
+    
+    def _values_source(self, filters, sessions, where, filter_params):
+        """Quantile sketch columns of the filter's slice, and their parameters
+        
+        The session_sketches rows of the smallest grouping set holding the
+        filter's dimensions, for the caller to merge. Filters no grouping set
+        holds, or a database without a rollup, get one row of sketches built
+        from the raw sessions by the sketch_build aggregate.
+        """
+        
+        sketch_where = self._sketch_where(filters)
+        if sketch_where is None:
+            return (f"""(
+            SELECT 
+                sketch_build(CASE WHEN completed_purchase = 1 THEN session_duration_seconds END) as purchase_durations,
+                sketch_build(CASE WHEN completed_purchase = 0 THEN session_duration_seconds END) as browse_durations,
+                sketch_build(CASE WHEN completed_purchase = 1 THEN revenue END) as order_values
+            FROM {sessions}
+            {where}
+        )""", filter_params)
+        where, params = sketch_where
+        return (f"(SELECT purchase_durations, browse_durations, order_values "
+                f"FROM session_sketches {where})", params)
+    
+    def _sketch_where(self, filters):
+        """WHERE clause and parameters of the session_sketches rows covering a filter's slice
+        
+        The rows are those of the smallest grouping set holding the filter's
+        dimensions; None when no set holds them or there is no rollup.
+        """
+        
+        needed = filters.columns() if filters else set()
+        candidates = [name for name, dims in ROLLUP_SETS.items() if needed <= set(dims)]
+        if not (self._read_layout()[0] and candidates):
+            return None
+        
+        grouping_set = min(candidates, key=lambda name: len(ROLLUP_SETS[name]))
+        where, params = filters.compile() if filters else ("", ())
+        where = f"WHERE grouping_set = '{grouping_set}'" + (f" AND {where[6:]}" if where else "")
+        return where, params
+    
+    def _sessions_source(self, filters=None):
+        """Session rows to read: in the partitioned layout, only the partitions
+        the filter's date range overlaps
+        
+        Returns the sessions view when every partition overlaps.
+        """
+        
+        partitions = self._read_layout()[2]
+        if partitions is None or filters is None:
+            return 'sessions'
+        periods = [period for period, start_date, end_date in partitions
+                   if (filters.start_date is None or end_date >= filters.start_date)
+                   and (filters.end_date is None or start_date <= filters.end_date)]
+        if len(periods) == len(partitions):
+            return 'sessions'
+        return f"({_partition_union('sessions', periods)})"
+    
+    def _star_facts_source(self, grouping_set, query, where):
+        """session_facts aggregated on dimension keys, for the star layout
+        
+        Grouping by the integer keys lets SQLite walk their small indexes, and
+        each label is looked up once per group rather than once per row. Only
+        the measures the query mentions are summed.
+        """
+        
+        keys = ROLLUP_SETS[grouping_set] or ['date']
+        columns = [f"{_label_sql(key, 'session_facts')} as {key}" if key in STAR_DIMENSIONS
+                   else key for key in keys]
+        columns += [f"SUM({measure}) as {measure}" for measure in ROLLUP_MEASURES
+                    if re.search(rf"\b{measure}\b", query)]
+        group_by = ', '.join(f"{key}_id" if key in STAR_DIMENSIONS else key for key in keys)
+        return f"(SELECT {', '.join(columns)} FROM session_facts {where} GROUP BY {group_by})"
+    
+    def stream(self, name, chunksize=10000, filters=None):
+        """Yield a get_* query's result as DataFrame chunks of up to chunksize rows
+        
+        name is 'get_daily_trends' or 'daily_trends'. Rows are fetched from
+        the cursor as the chunks are consumed and bypass the result cache, so
+        memory stays bounded by one chunk. The single-row headline frames
+        come back as one chunk.
+        """
+        
+        name = name[4:] if name.startswith('get_') else name
+        method = getattr(self, f'get_{name}')
+        self._local.stream = (name, chunksize)
+        try:
+            result = method(filters=filters)
+        finally:
+            self._local.stream = None
+        
+        if isinstance(result, pd.DataFrame):
+            yield result
+        else:
+            yield from result
+    
+    def stream_sessions(self, chunksize=50000, filters=None):
+        """Yield the raw session rows (optionally filtered) as DataFrame chunks"""
+        
+        dimension_ids = self._read_layout()[1]
+        where, params = filters.compile(dimension_ids) if filters else ("", ())
+        if dimension_ids is None:
+            select = f"SELECT * FROM {self._sessions_source(filters)}"
+        else:
+            select = _star_sessions_select()
+        query = f"{select} {where}"
+        yield from self._stream_rows('sessions', query, params, chunksize)
+    
+    def stream_session_events(self, chunksize=500000, filters=None, steps=None):
+        """Yield the events of the (optionally filtered) sessions, sorted by
+        session then time, as DataFrame chunks that never split a session
+        
+        Chunks have session_id, timestamp (epoch seconds) and event_type and
+        page codes (positions in EVENT_TYPES and PAGES). The order comes from
+        the events_compact primary key or idx_events_session_timestamp, so
+        the events are read in one pass without sorting; partitions are read
+        one at a time, skipping those outside the filter's dates. Filters
+        keep the events of matching sessions, and steps, (event_type, page)
+        pairs as in EventFunnel.steps, the events matching one of them.
+        """
+        
+        for query, params in self._session_events_queries(filters, steps):
+            carry = None
+            for chunk in self._stream_rows('session_events', query, params, chunksize):
+                if not len(chunk):
+                    continue
+                if carry is not None:
+                    chunk = pd.concat([carry, chunk], ignore_index=True)
+                # Hold back the last session, which may continue in the next chunk
+                ids = chunk['session_id'].to_numpy()
+                cut = 0 if ids[0] == ids[-1] else len(ids) - int(np.argmin(ids[::-1] == ids[-1]))
+                carry = chunk.iloc[cut:]
+                if cut:
+                    yield _event_codes(chunk.iloc[:cut])
+            if carry is not None and len(carry):
+                yield _event_codes(carry)
+    
+    def _session_events_queries(self, filters=None, steps=None):
+        """(query, params) per events table read by stream_session_events()"""
+        
+        dimension_ids, partitions = self._read_layout()[1:]
+        where, params = filters.compile(dimension_ids) if filters else ("", ())
+        compact = self._compact_events_layout(self._reader())
+        sessions = 'sessions_fact' if dimension_ids is not None else 'sessions'
+        if compact:
+            sources = [('events_compact', sessions)]
+        elif partitions is None:
+            sources = [('events', sessions)]
+        else:
+            sources = [(f"events_p{period}", f"sessions_p{period}")
+                       for period, start_date, end_date in partitions
+                       if filters is None
+                       or ((filters.start_date is None or end_date >= filters.start_date)
+                           and (filters.end_date is None or start_date <= filters.end_date))]
+        
+        match, match_params = _event_match_sql(steps, compact)
+        if compact:
+            select = "session_id, timestamp, event_type_id as event_type, page_id as page"
+            session_id = _integer_id_sql('session_id')
+        else:
+            select = ("session_id, CAST(strftime('%s', timestamp) AS INTEGER) as timestamp, "
+                      "event_type, page")
+            session_id = 'session_id'
+        
+        queries = []
+        for events, sessions in sources:
+            conditions = [match] if match else []
+            if where:
+                conditions.append(f"session_id IN (SELECT {session_id} FROM {sessions} {where})")
+            # The table's timestamp, not the epoch alias, so the index gives the order
+            order = 'seq' if compact else f'{events}.timestamp'
+            query = f"""
+            SELECT {select}
+            FROM {events}
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            ORDER BY session_id, {order}
+            """
+            queries.append((query, match_params + params))
+        return queries
+    
+    def export_csv(self, name, path, chunksize=50000, filters=None):
+        """Write a get_* query's result, or 'sessions' for the raw rows, to CSV chunk by chunk"""
+        
+        if name == 'sessions':
+            chunks = self.stream_sessions(chunksize, filters)
+        else:
+            chunks = self.stream(name, chunksize, filters)
+        
+        rows = 0
+        for chunk in chunks:
+            chunk.to_csv(path, mode='a' if rows else 'w', header=not rows, index=False)
+            rows += len(chunk)
+        print(f"✓ Exported {rows:,} rows to {path}")
+        return rows
+    
+    def _stream_rows(self, name, query, params, chunksize):
+        """Chunks of a query read from the cursor, profiled once exhausted
+        
+        Only the time spent fetching is counted, not the consumer's time
+        between chunks.
+        """
+        
+        chunks = pd.read_sql_query(query, self._reader(), params=params, chunksize=chunksize)
+        fetch_seconds = 0.0
+        rows = 0
+        result_bytes = 0
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            fetch_seconds += time.perf_counter() - start
+            if chunk is None:
+                break
+            rows += len(chunk)
+            result_bytes += int(chunk.memory_usage(deep=True).sum())
+            yield chunk
+        self.profiler.record(name, fetch_seconds * 1000, rows, result_bytes)
+    
+    def _reader(self):
+        """Connection for reads: the worker's pooled one, else the main connection"""
+        
+        return getattr(self._local, 'conn', None) or self.conn
+    
+    def connection_pool(self, size=4):
+        """The read-only connection pool, switching the database to WAL on first use"""
+        
+        if self.pool is None:
+            self.cursor.execute("PRAGMA journal_mode = WAL")
+            # A read through the writer initializes the WAL index, which
+            # read-only connections cannot do themselves
+            self.cursor.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            self.pool = ConnectionPool(self.db_path, size, setup=_register_functions)
+        return self.pool
+    
+    def run_concurrent(self, queries=None, max_workers=4, filters=None):
+        """Run several get_* queries at once on pooled read-only connections
+        
+        queries are method names ('get_device_performance' or
+        'device_performance'), all of QUERY_METHODS by default, each run with
+        the same filters. Returns a dict of DataFrames keyed like queries.
+        """
+        
+        queries = list(queries or QUERY_METHODS)
+        pool = self.connection_pool(max_workers)
+        self.prepare_pooled_reads()
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(
+                lambda name: self.run_pooled(name, filters=filters), queries))
+        return dict(zip(queries, results))
+    
+    def prepare_pooled_reads(self):
+        """Resolve the read layout on the writer's thread, before pooled queries
+        
+        Picks up other connections' writes first. The layout check may upgrade
+        the tables or rebuild the rollup, which needs the writer connection,
+        so callers of run_pooled() run this from the thread that connected,
+        and again whenever the data may have changed.
+        """
+        
+        self._check_data_version()
+        self._read_layout()
+    
+    def run_pooled(self, name, *args, **kwargs):
+        """Call one get_* query on a pooled read-only connection (any thread)
+        
+        Call prepare_pooled_reads() first, from the connecting thread.
+        """
+        
+        method = getattr(self, name if name.startswith('get_') else f'get_{name}')
+        with self.connection_pool().connection() as conn:
+            self._local.conn = conn
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._local.conn = None
+    
+    def _insert_rows(self, table, columns, rows, or_ignore=False):
+        """executemany INSERT inside the current transaction"""
+        
+        placeholders = ', '.join('?' * len(columns))
+        verb = "INSERT OR IGNORE" if or_ignore else "INSERT"
+        self.cursor.executemany(
+            f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+    
+    # ==================== ANALYTICAL QUERIES ====================
+    
+    def get_overall_metrics(self, filters=None):
+        """Query 1: Overall key metrics"""
+        return self._headline_frame('overall_metrics', filters)
+    
+    def get_conversion_funnel(self, filters=None):
+        """Query 2: Conversion funnel stages"""
+        return self._headline_frame('conversion_funnel', filters)
+    
+    def get_cart_abandonment_rate(self, filters=None):
+        """Query 3: Cart abandonment analysis"""
+        return self._headline_frame('cart_abandonment_rate', filters)
+    
+    def get_traffic_source_performance(self, filters=None):
         """Query 4: Traffic source analysis"""
         query = """
         SELECT 
             traffic_source,
-            COUNT(*) as sessions,
-            SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) as conversions,
-            ROUND(SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) * 100.0 / 
-                  COUNT(*), 2) as conversion_rate,
-            ROUND(SUM(CASE WHEN bounced = 1 THEN 1 ELSE 0 END) * 100.0 / 
-                  COUNT(*), 2) as bounce_rate,
+            SUM(sessions) as sessions,
+            SUM(purchases) as conversions,
+            ROUND(SUM(purchases) * 100.0 / SUM(sessions), 2) as conversion_rate,
+            ROUND(SUM(bounces) * 100.0 / SUM(sessions), 2) as bounce_rate,
             ROUND(SUM(revenue), 2) as total_revenue,
             ROUND(SUM(ad_spend), 2) as total_ad_spend,
             ROUND((SUM(revenue) - SUM(ad_spend)) / NULLIF(SUM(ad_spend), 0) * 100, 2) as roi_percent,
-            ROUND(SUM(revenue) / COUNT(*), 2) as revenue_per_session
-        FROM sessions
+            ROUND(SUM(revenue) / SUM(sessions), 2) as revenue_per_session
+        FROM {source}
+        {where}
         GROUP BY traffic_source
         ORDER BY conversions DESC
         """
-        return pd.read_sql_query(query, self.conn)
+        return self._run_query('traffic_source_performance', query, rollup='traffic_source', filters=filters)
     
-    def get_device_performance(self):
+    def get_device_performance(self, filters=None):
         """Query 5: Device-wise performance"""
         query = """
         SELECT 
             device,
-            COUNT(*) as sessions,
-            SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) as conversions,
-            ROUND(SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) * 100.0 / 
-                  COUNT(*), 2) as conversion_rate,
-            ROUND(AVG(session_duration_seconds), 2) as avg_duration,
-            ROUND(AVG(pages_viewed), 2) as avg_pages,
+            SUM(sessions) as sessions,
+            SUM(purchases) as conversions,
+            ROUND(SUM(purchases) * 100.0 / SUM(sessions), 2) as conversion_rate,
+            ROUND(SUM(duration_sum) * 1.0 / SUM(sessions), 2) as avg_duration,
+            ROUND(SUM(pages_sum) * 1.0 / SUM(sessions), 2) as avg_pages,
             ROUND(SUM(revenue), 2) as total_revenue
-        FROM sessions
+        FROM {source}
+        {where}
         GROUP BY device
         ORDER BY sessions DESC
         """
-        return pd.read_sql_query(query, self.conn)
+        return self._run_query('device_performance', query, rollup='device', filters=filters)
     
-    def get_hourly_patterns(self):
+    def get_hourly_patterns(self, filters=None):
         """Query 6: Hourly traffic and conversion patterns"""
         query = """
         SELECT 
             hour,
-            COUNT(*) as sessions,
-            SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) as conversions,
-            ROUND(SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) * 100.0 / 
-                  COUNT(*), 2) as conversion_rate,
+            SUM(sessions) as sessions,
+            SUM(purchases) as conversions,
+            ROUND(SUM(purchases) * 100.0 / SUM(sessions), 2) as conversion_rate,
             ROUND(SUM(revenue), 2) as revenue
-        FROM sessions
+        FROM {source}
+        {where}
         GROUP BY hour
         ORDER BY hour
         """
-        return pd.read_sql_query(query, self.conn)
+        return self._run_query('hourly_patterns', query, rollup='hour', filters=filters)
     
-    def get_daily_trends(self):
+    def get_daily_trends(self, filters=None):
         """Query 7: Daily trends over time"""
         query = """
         SELECT 
             date,
-            COUNT(*) as sessions,
-            SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) as conversions,
-            ROUND(SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) * 100.0 / 
-                  COUNT(*), 2) as conversion_rate,
+            SUM(sessions) as sessions,
+            SUM(purchases) as conversions,
+            ROUND(SUM(purchases) * 100.0 / SUM(sessions), 2) as conversion_rate,
             ROUND(SUM(revenue), 2) as revenue,
-            ROUND(AVG(session_duration_seconds), 2) as avg_duration
-        FROM sessions
+            ROUND(SUM(duration_sum) * 1.0 / SUM(sessions), 2) as avg_duration
+        FROM {source}
+        {where}
         GROUP BY date
         ORDER BY date
         """
-        return pd.read_sql_query(query, self.conn)
+        return self._run_query('daily_trends', query, rollup='date', filters=filters)
     
-    def get_weekday_performance(self):
+    def get_weekday_performance(self, filters=None):
         """Query 8: Day of week analysis"""
         query = """
         SELECT 
             day_of_week,
-            COUNT(*) as sessions,
-            SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) as conversions,
-            ROUND(SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) * 100.0 / 
-                  COUNT(*), 2) as conversion_rate,
+            SUM(sessions) as sessions,
+            SUM(purchases) as conversions,
+            ROUND(SUM(purchases) * 100.0 / SUM(sessions), 2) as conversion_rate,
             ROUND(SUM(revenue), 2) as revenue
-        FROM sessions
+        FROM {source}
+        {where}
         GROUP BY day_of_week
         ORDER BY 
             CASE day_of_week
@@ -278,142 +1627,706 @@ class EcommerceDatabase:
                 WHEN 'Sunday' THEN 7
             END
         """
-        return pd.read_sql_query(query, self.conn)
+        return self._run_query('weekday_performance', query, rollup='day_of_week', filters=filters)
     
-    def get_category_performance(self):
+    def get_category_performance(self, filters=None):
         """Query 9: Product category analysis"""
         query = """
         SELECT 
             category,
-            COUNT(*) as sessions,
-            SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) as conversions,
-            ROUND(SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) * 100.0 / 
-                  COUNT(*), 2) as conversion_rate,
+            SUM(sessions) as sessions,
+            SUM(purchases) as conversions,
+            ROUND(SUM(purchases) * 100.0 / SUM(sessions), 2) as conversion_rate,
             ROUND(SUM(revenue), 2) as total_revenue,
-            ROUND(AVG(CASE WHEN completed_purchase = 1 THEN revenue ELSE NULL END), 2) as avg_order_value
-        FROM sessions
+            ROUND(SUM(order_revenue) / NULLIF(SUM(purchases), 0), 2) as avg_order_value
+        FROM {source}
+        {where}
         GROUP BY category
         ORDER BY total_revenue DESC
         """
-        return pd.read_sql_query(query, self.conn)
+        return self._run_query('category_performance', query, rollup='category', filters=filters)
     
-    def get_returning_vs_new(self):
+    def get_returning_vs_new(self, filters=None):
         """Query 10: Returning vs new customer performance"""
         query = """
         SELECT 
             CASE WHEN is_returning = 1 THEN 'Returning' ELSE 'New' END as customer_type,
-            COUNT(*) as sessions,
-            SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) as conversions,
-            ROUND(SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) * 100.0 / 
-                  COUNT(*), 2) as conversion_rate,
+            SUM(sessions) as sessions,
+            SUM(purchases) as conversions,
+            ROUND(SUM(purchases) * 100.0 / SUM(sessions), 2) as conversion_rate,
             ROUND(SUM(revenue), 2) as total_revenue,
-            ROUND(AVG(CASE WHEN completed_purchase = 1 THEN revenue ELSE NULL END), 2) as avg_order_value
-        FROM sessions
+            ROUND(SUM(order_revenue) / NULLIF(SUM(purchases), 0), 2) as avg_order_value
+        FROM {source}
+        {where}
         GROUP BY is_returning
         """
-        return pd.read_sql_query(query, self.conn)
+        return self._run_query('returning_vs_new', query, rollup='is_returning', filters=filters)
     
-    def get_location_analysis(self):
+    def get_location_analysis(self, filters=None):
         """Query 11: Geographic performance"""
         query = """
         SELECT 
             location,
-            COUNT(*) as sessions,
-            SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) as conversions,
-            ROUND(SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) * 100.0 / 
-                  COUNT(*), 2) as conversion_rate,
+            SUM(sessions) as sessions,
+            SUM(purchases) as conversions,
+            ROUND(SUM(purchases) * 100.0 / SUM(sessions), 2) as conversion_rate,
             ROUND(SUM(revenue), 2) as total_revenue
-        FROM sessions
+        FROM {source}
+        {where}
         GROUP BY location
         ORDER BY total_revenue DESC
         """
-        return pd.read_sql_query(query, self.conn)
+        return self._run_query('location_analysis', query, rollup='location', filters=filters)
     
-    def get_checkout_drop_off_analysis(self):
+    def get_checkout_drop_off_analysis(self, filters=None):
         """Query 12: Detailed checkout drop-off"""
-        query = """
-        SELECT 
-            'Reached Checkout' as stage,
-            COUNT(CASE WHEN started_checkout = 1 THEN 1 END) as users,
-            100.0 as percentage
-        FROM sessions
-        
-        UNION ALL
-        
-        SELECT 
-            'Completed Purchase' as stage,
-            COUNT(CASE WHEN completed_purchase = 1 THEN 1 END) as users,
-            ROUND(COUNT(CASE WHEN completed_purchase = 1 THEN 1 END) * 100.0 / 
-                  COUNT(CASE WHEN started_checkout = 1 THEN 1 END), 2) as percentage
-        FROM sessions
-        WHERE started_checkout = 1
-        """
-        return pd.read_sql_query(query, self.conn)
+        return self._headline_frame('checkout_drop_off_analysis', filters)
     
-    def get_revenue_metrics(self):
+    def get_revenue_metrics(self, filters=None):
         """Query 13: Revenue breakdown"""
-        query = """
-        SELECT 
-            COUNT(CASE WHEN completed_purchase = 1 THEN 1 END) as total_orders,
-            ROUND(SUM(revenue), 2) as total_revenue,
-            ROUND(AVG(CASE WHEN completed_purchase = 1 THEN revenue END), 2) as avg_order_value,
-            ROUND(MIN(CASE WHEN completed_purchase = 1 THEN revenue END), 2) as min_order_value,
-            ROUND(MAX(CASE WHEN completed_purchase = 1 THEN revenue END), 2) as max_order_value,
-            ROUND(SUM(revenue) / COUNT(DISTINCT session_id), 2) as revenue_per_session,
-            ROUND(SUM(revenue) / COUNT(DISTINCT user_id), 2) as revenue_per_user
-        FROM sessions
-        """
-        return pd.read_sql_query(query, self.conn)
+        return self._headline_frame('revenue_metrics', filters)
     
-    def get_session_quality_metrics(self):
+    def get_session_quality_metrics(self, filters=None):
         """Query 14: Session quality indicators"""
         query = """
         SELECT 
-            CASE 
-                WHEN session_duration_seconds < 30 THEN '< 30 sec'
-                WHEN session_duration_seconds < 120 THEN '30 sec - 2 min'
-                WHEN session_duration_seconds < 300 THEN '2 - 5 min'
-                WHEN session_duration_seconds < 600 THEN '5 - 10 min'
-                ELSE '> 10 min'
-            END as duration_bucket,
-            COUNT(*) as sessions,
-            SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) as conversions,
-            ROUND(SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) * 100.0 / 
-                  COUNT(*), 2) as conversion_rate
-        FROM sessions
-        GROUP BY duration_bucket
-        ORDER BY 
-            CASE duration_bucket
-                WHEN '< 30 sec' THEN 1
-                WHEN '30 sec - 2 min' THEN 2
-                WHEN '2 - 5 min' THEN 3
-                WHEN '5 - 10 min' THEN 4
-                ELSE 5
-            END
+            (SELECT label FROM dim_duration_bucket WHERE id = duration_bucket_id) as duration_bucket,
+            SUM(sessions) as sessions,
+            SUM(purchases) as conversions,
+            ROUND(SUM(purchases) * 100.0 / SUM(sessions), 2) as conversion_rate
+        FROM {source}
+        {where}
+        GROUP BY duration_bucket_id
+        ORDER BY duration_bucket_id
         """
-        return pd.read_sql_query(query, self.conn)
+        return self._run_query('session_quality_metrics', query, rollup='duration_bucket', filters=filters)
     
-    def get_top_converting_segments(self):
+    def get_top_converting_segments(self, filters=None):
         """Query 15: Best performing segments"""
         query = """
         SELECT 
             traffic_source,
             device,
-            COUNT(*) as sessions,
-            SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) as conversions,
-            ROUND(SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) * 100.0 / 
-                  COUNT(*), 2) as conversion_rate,
+            SUM(sessions) as sessions,
+            SUM(purchases) as conversions,
+            ROUND(SUM(purchases) * 100.0 / SUM(sessions), 2) as conversion_rate,
             ROUND(SUM(revenue), 2) as revenue
-        FROM sessions
+        FROM {source}
+        {where}
         GROUP BY traffic_source, device
-        HAVING COUNT(*) > 100
+        HAVING SUM(sessions) > 100
         ORDER BY conversion_rate DESC
         LIMIT 10
         """
-        return pd.read_sql_query(query, self.conn)
+        return self._run_query('top_converting_segments', query, rollup='traffic_source,device', filters=filters)
+    
+    def get_headline_snapshot(self, filters=None):
+        """Query 16: Every headline KPI of queries 1-3, 12 and 13 in one table scan
+        
+        The inner SELECT aggregates sessions once; the outer one applies the
+        same rounding the individual queries used, so the derived frames
+        match them value for value. session_id is the primary key, so
+        total_sessions is the row count, with no DISTINCT b-tree. unique_users
+        (and revenue_per_user) come from the user sketches instead of a
+        COUNT(DISTINCT user_id) over the scan, so they are estimates (see
+        get_unique_users).
+        """
+        query = """
+        SELECT 
+            session_count as total_sessions,
+            unique_users,
+            conversions,
+            ROUND(conversions * 100.0 / session_count, 2) as conversion_rate,
+            ROUND(bounces * 100.0 / session_count, 2) as bounce_rate,
+            ROUND(avg_duration, 2) as avg_session_duration,
+            ROUND(avg_pages, 2) as avg_pages_per_session,
+            ROUND(revenue, 2) as total_revenue,
+            ROUND(ad_spend, 2) as total_ad_spend,
+            ROUND((revenue - ad_spend) / ad_spend * 100, 2) as overall_roi,
+            
+            session_count as landing_users,
+            product_views,
+            ROUND(product_views * 100.0 / session_count, 2) as product_view_percentage,
+            ROUND((session_count - product_views) * 100.0 / session_count, 2) as product_view_drop_off,
+            carts,
+            ROUND(carts * 100.0 / session_count, 2) as cart_percentage,
+            ROUND((product_views - carts) * 100.0 / product_views, 2) as cart_drop_off,
+            checkouts,
+            ROUND(checkouts * 100.0 / session_count, 2) as checkout_percentage,
+            ROUND((carts - checkouts) * 100.0 / carts, 2) as checkout_drop_off,
+            ROUND(conversions * 100.0 / session_count, 2) as purchase_percentage,
+            ROUND((checkouts - conversions) * 100.0 / checkouts, 2) as purchase_drop_off,
+            
+            COALESCE(carts, 0) as carts_created,
+            COALESCE(carts_abandoned, 0) as carts_abandoned,
+            COALESCE(conversions, 0) as carts_purchased,
+            ROUND(carts_abandoned * 100.0 / carts, 2) as abandonment_rate,
+            
+            COALESCE(checkouts, 0) as checkouts_reached,
+            COALESCE(checkout_purchases, 0) as checkout_purchases,
+            ROUND(checkout_purchases * 100.0 / checkouts, 2) as checkout_completion_rate,
+            
+            COALESCE(conversions, 0) as total_orders,
+            ROUND(avg_order_value, 2) as avg_order_value,
+            ROUND(min_order_value, 2) as min_order_value,
+            ROUND(max_order_value, 2) as max_order_value,
+            ROUND(revenue / session_count, 2) as revenue_per_session,
+            ROUND(revenue / unique_users, 2) as revenue_per_user
+        FROM (
+            SELECT 
+                COUNT(*) as session_count,
+                SUM(CASE WHEN viewed_product = 1 THEN 1 ELSE 0 END) as product_views,
+                SUM(CASE WHEN added_to_cart = 1 THEN 1 ELSE 0 END) as carts,
+                SUM(CASE WHEN started_checkout = 1 THEN 1 ELSE 0 END) as checkouts,
+                SUM(CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END) as conversions,
+                SUM(CASE WHEN added_to_cart = 1 AND completed_purchase = 0 THEN 1 ELSE 0 END) as carts_abandoned,
+                SUM(CASE WHEN started_checkout = 1 AND completed_purchase = 1 THEN 1 ELSE 0 END) as checkout_purchases,
+                SUM(CASE WHEN bounced = 1 THEN 1 ELSE 0 END) as bounces,
+                AVG(session_duration_seconds) as avg_duration,
+                AVG(pages_viewed) as avg_pages,
+                SUM(revenue) as revenue,
+                SUM(ad_spend) as ad_spend,
+                AVG(CASE WHEN completed_purchase = 1 THEN revenue END) as avg_order_value,
+                MIN(CASE WHEN completed_purchase = 1 THEN revenue END) as min_order_value,
+                MAX(CASE WHEN completed_purchase = 1 THEN revenue END) as max_order_value
+            FROM {sessions}
+            {where}
+        )
+        CROSS JOIN {users}
+        """
+        return self._run_query('headline_snapshot', query, filters=filters)
+    
+    def get_unique_users(self, filters=None):
+        """Query 17: Distinct users, estimated from the per-day user sketches
+        
+        The sketches of the filter's days and segments are merged, so the
+        cost follows the number of days rather than sessions. The relative
+        standard error is 1.6% (about 95% of estimates within 3.3%); filters
+        over dimension combinations with no sketch are counted exactly.
+        """
+        query = "SELECT unique_users FROM {users}"
+        return self._run_query('unique_users', query, filters=filters)
+    
+    def get_value_quantiles(self, filters=None):
+        """Query 18: Session duration and order value distributions from the quantile sketches
+        
+        One row per VALUE_MEASURES entry with the count, the exact mean,
+        minimum and maximum, and p25-p99 within 1% of the true values. Only
+        the slice's per-day sketches are read, never the raw sessions, unless
+        no grouping set holds the filter's dimensions.
+        """
+        merged = "\n            UNION ALL\n".join(
+            f"SELECT '{measure}' as measure, sketch_merge(sketch) as sketch "
+            f"FROM ({_sketch_columns_select(columns)})"
+            for measure, columns in VALUE_MEASURES.items())
+        query = f"""
+        WITH slice AS {{values}}
+        SELECT 
+            measure,
+            sketch_count(sketch) as count,
+            ROUND(sketch_mean(sketch), 2) as mean,
+            ROUND(sketch_quantile(sketch, 0), 2) as min,
+            ROUND(sketch_quantile(sketch, 0.25), 2) as p25,
+            ROUND(sketch_quantile(sketch, 0.5), 2) as p50,
+            ROUND(sketch_quantile(sketch, 0.75), 2) as p75,
+            ROUND(sketch_quantile(sketch, 0.9), 2) as p90,
+            ROUND(sketch_quantile(sketch, 0.99), 2) as p99,
+            ROUND(sketch_quantile(sketch, 1), 2) as max
+        FROM (
+            {merged}
+        )
+        """
+        return self._run_query('value_quantiles', query, filters=filters)
+    
+    def get_value_histogram(self, measure='order_value', bins=30, filters=None):
+        """Estimated histogram of one VALUE_MEASURES distribution, from the quantile sketches
+        
+        bins is a number of equal-width bins between the slice's minimum and
+        maximum, or a list of bin edges. Returns bin_start, bin_end and count
+        columns.
+        """
+        
+        query = f"""
+        WITH slice AS {{values}}
+        SELECT sketch_merge(sketch) as sketch FROM ({_sketch_columns_select(VALUE_MEASURES[measure])})
+        """
+        merged = self._run_query(f'{measure}_sketch', query, filters=filters)
+        if self._explaining:
+            return merged
+        
+        blob = merged['sketch'].iloc[0]
+        sketch = QuantileSketch() if blob is None else QuantileSketch.from_blob(blob)
+        counts, edges = sketch.histogram(bins)
+        return pd.DataFrame({'bin_start': edges[:-1], 'bin_end': edges[1:], 'count': counts})
+    
+    def get_event_funnel(self, steps, window=None, filters=None, chunksize=500000):
+        """Ordered funnel over the raw events, e.g.
+        get_event_funnel(['product_page', 'add_to_cart', 'purchase'], window=1800)
+        
+        steps and window are as for EventFunnel; the result has the columns
+        of get_conversion_funnel(), so users counts sessions, as it does
+        there. The events are streamed in session order
+        (stream_session_events) through the funnel kernel, so time and
+        memory stay linear in the events read, and the result is cached and
+        profiled as 'event_funnel'.
+        """
+        
+        funnel = EventFunnel(steps, window)
+        start = time.perf_counter()
+        self._check_data_version()
+        key = ('event_funnel', funnel.key(), filters.key() if filters else None)
+        version = self.cache.version
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.profiler.record('event_funnel', (time.perf_counter() - start) * 1000,
+                                 len(cached), int(cached.memory_usage(deep=True).sum()),
+                                 cached=True)
+            return cached
+        
+        conn = self._reader()
+        ticks = [0]
+        
+        def tick():
+            ticks[0] += 1
+        
+        # Events matching no step cannot move a session through the funnel
+        conn.set_progress_handler(tick, PROGRESS_INTERVAL)
+        try:
+            for events in self.stream_session_events(chunksize, filters, funnel.steps):
+                funnel.add(events)
+        finally:
+            conn.set_progress_handler(None, PROGRESS_INTERVAL)
+        df = funnel.result()
+        wall_ms = (time.perf_counter() - start) * 1000
+        
+        if ('event_funnel', key[2]) not in self.profiler.plans:
+            plans = []
+            for query, params in self._session_events_queries(filters, funnel.steps):
+                plan = pd.read_sql_query(f"EXPLAIN QUERY PLAN {query}", conn, params=params)
+                plans.append(' | '.join(plan['detail']))
+            self.profiler.add_plan('event_funnel', key[2], ' || '.join(plans))
+        self.profiler.record('event_funnel', wall_ms, len(df), int(df.memory_usage(deep=True).sum()),
+                             vm_steps=ticks[0] * PROGRESS_INTERVAL, filters_key=key[2])
+        
+        self.cache.put(key, df, version)
+        return df
+    
+    def get_headline_metrics(self, snapshot=None, filters=None):
+        """Queries 1-3, 12 and 13 as their usual frames, from one snapshot scan
+        
+        Returns a dict keyed 'overall_metrics', 'conversion_funnel',
+        'cart_abandonment_rate', 'checkout_drop_off_analysis' and
+        'revenue_metrics'.
+        """
+        
+        if snapshot is None:
+            snapshot = self.get_headline_snapshot(filters)
+        row = snapshot.to_dict('records')[0]
+        
+        def frame(columns):
+            return snapshot[columns].reset_index(drop=True)
+        
+        funnel = pd.DataFrame({
+            'stage': ['Landing Page', 'Product View', 'Add to Cart', 'Checkout Started',
+                      'Purchase Complete'],
+            'stage_order': [1, 2, 3, 4, 5],
+            'users': [row['landing_users'], row['product_views'], row['carts'],
+                      row['checkouts'], row['conversions']],
+            'percentage': [100.0, row['product_view_percentage'], row['cart_percentage'],
+                           row['checkout_percentage'], row['purchase_percentage']],
+            'drop_off': [0, row['product_view_drop_off'], row['cart_drop_off'],
+                         row['checkout_drop_off'], row['purchase_drop_off']]
+        })
+        
+        checkout = pd.DataFrame({
+            'stage': ['Reached Checkout', 'Completed Purchase'],
+            'users': [row['checkouts_reached'], row['checkout_purchases']],
+            'percentage': [100.0, row['checkout_completion_rate']]
+        })
+        
+        return {
+            'overall_metrics': frame(
+                ['total_sessions', 'unique_users', 'conversions', 'conversion_rate',
+                 'bounce_rate', 'avg_session_duration', 'avg_pages_per_session',
+                 'total_revenue', 'total_ad_spend', 'overall_roi']),
+            'conversion_funnel': funnel,
+            'cart_abandonment_rate': frame(
+                ['carts_created', 'carts_abandoned', 'carts_purchased', 'abandonment_rate']),
+            'checkout_drop_off_analysis': checkout,
+            'revenue_metrics': frame(
+                ['total_orders', 'total_revenue', 'avg_order_value', 'min_order_value',
+                 'max_order_value', 'revenue_per_session', 'revenue_per_user'])
+        }
+    
+    def _headline_frame(self, name, filters=None):
+        """One frame of get_headline_metrics() (the snapshot's plan when explaining)"""
+        
+        if self._explaining:
+            return self.get_headline_snapshot(filters)
+        return self.get_headline_metrics(filters=filters)[name]
     
     def close(self):
         """Close database connection"""
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+        self._data_versions = {}
         if self.conn:
             self.conn.close()
             print("✓ Database connection closed")
+
+
+# Analytical query methods ("Query N: ..." docstrings), in report order
+QUERY_METHODS = [name for name, method in vars(EcommerceDatabase).items()
+                 if name.startswith('get_') and (method.__doc__ or '').startswith('Query ')]
+
+
+def _session_rows(sessions_df, dimension_ids=None):
+    """Row tuples for the sessions table from a legacy or compact frame
+    
+    With dimension_ids ({dimension: {label: id}}, see _dimension_ids) those
+    dimensions hold their ids, giving sessions_fact rows.
+    """
+    
+    df = to_legacy_sessions(sessions_df)
+    dimension_ids = dimension_ids or {}
+    columns = {column: _sql_values(df[column]) for column in SESSION_COLUMNS
+               if column != 'date' and column not in dimension_ids
+               and column not in DERIVED_COLUMNS}
+    for dimension, ids in dimension_ids.items():
+        columns[dimension] = df[dimension].astype(str).map(ids).tolist()
+    for column, values in derived_columns(df).items():
+        columns[column] = values.tolist()
+    
+    if pd.api.types.is_datetime64_any_dtype(df['date']):
+        columns['date'] = np.datetime_as_string(
+            df['date'].to_numpy(dtype='datetime64[D]'), unit='D').tolist()
+    else:
+        columns['date'] = df['date'].tolist()
+    
+    return zip(*(columns[column] for column in SESSION_COLUMNS))
+
+
+def _label_sql(dimension, table='sessions_fact'):
+    """Correlated lookup of a star dimension's label for the current row of table"""
+    
+    return f"(SELECT label FROM dim_{dimension} WHERE id = {table}.{dimension}_id)"
+
+
+def _star_sessions_select():
+    """SELECT giving sessions_fact rows the sessions columns, labels included
+    
+    Correlated lookups rather than joins: SQLite only evaluates the label
+    columns a query actually reads.
+    """
+    
+    columns = ",\n".join(
+        f"            {_label_sql(column)} as {column}" if column in STAR_DIMENSIONS
+        else f"            {column}" for column in SESSION_COLUMNS)
+    return f"""
+        SELECT 
+{columns}
+        FROM sessions_fact
+        """
+
+
+def _session_facts_select(table, star=False):
+    """SELECT giving each session of table as a one-session rollup row
+    
+    Every report query then runs unchanged against the raw rows when the
+    rollup is unavailable. The star layout reads the fact table, looking
+    labels up only for the columns a query uses and exposing the integer
+    keys for filters.
+    """
+    
+    dimensions = ("date, day_index, hour, day_of_week, traffic_source, device, category, "
+                  "location, is_returning")
+    if star:
+        dimensions = ",\n            ".join(
+            ['date', 'day_index', 'hour'] +
+            [f"{_label_sql(dimension)} as {dimension}" for dimension in
+             ['day_of_week', 'traffic_source', 'device', 'category', 'location']] +
+            ['is_returning'] + [f"{dimension}_id" for dimension in STAR_DIMENSIONS])
+    return f"""
+        SELECT
+            {dimensions},
+            duration_bucket_id,
+            1 as sessions,
+            CASE WHEN viewed_product = 1 THEN 1 ELSE 0 END as product_views,
+            CASE WHEN added_to_cart = 1 THEN 1 ELSE 0 END as carts,
+            CASE WHEN started_checkout = 1 THEN 1 ELSE 0 END as checkouts,
+            CASE WHEN completed_purchase = 1 THEN 1 ELSE 0 END as purchases,
+            CASE WHEN bounced = 1 THEN 1 ELSE 0 END as bounces,
+            revenue,
+            CASE WHEN completed_purchase = 1 THEN revenue ELSE 0 END as order_revenue,
+            ad_spend,
+            session_duration_seconds as duration_sum,
+            pages_viewed as pages_sum
+        FROM {table}
+        """
+
+
+def _derived_columns_sql():
+    """SQL computing each of DERIVED_COLUMNS from the text timestamp, date and duration
+    
+    Used once, to fill the columns of databases loaded before they existed;
+    loads compute them in NumPy (schema.derived_columns).
+    """
+    
+    # The ISO year and week are those of the week's Thursday
+    weekday = "((CAST(strftime('%w', date) AS INTEGER) + 6) % 7)"
+    thursday = f"date(date, '-' || {weekday} || ' days', '+3 days')"
+    buckets = " ".join(f"WHEN session_duration_seconds < {bound} THEN {number}"
+                       for number, (bound, _) in enumerate(DURATION_BUCKETS[:-1]))
+    return {
+        'epoch': "CAST(strftime('%s', timestamp) AS INTEGER)",
+        'day_index': "CAST(strftime('%s', date) AS INTEGER) / 86400",
+        'iso_week': (f"CAST(strftime('%Y', {thursday}) AS INTEGER) * 100 + "
+                     f"(CAST(strftime('%j', {thursday}) AS INTEGER) - 1) / 7 + 1"),
+        'month': "CAST(strftime('%Y%m', date) AS INTEGER)",
+        'weekday': weekday,
+        'duration_bucket_id': f"CASE {buckets} ELSE {len(DURATION_BUCKETS) - 1} END"
+    }
+
+
+def _partition_union(table, periods):
+    """UNION ALL of table's partitions for the given periods (an empty SELECT for none)"""
+    
+    if not periods:
+        columns = SESSION_COLUMNS if table == 'sessions' else EVENT_COLUMNS
+        return f"SELECT {', '.join(f'NULL as {column}' for column in columns)} WHERE 0"
+    return "\n        UNION ALL ".join(f"SELECT * FROM {table}_p{period}" for period in periods)
+
+
+def _new_rows(sessions_df, events_df, watermark):
+    """Sessions at or after the watermark (first of each id), and their events"""
+    
+    sessions_df = to_legacy_sessions(sessions_df).drop_duplicates('session_id')
+    events_df = to_legacy_events(events_df)
+    
+    if watermark is not None:
+        sessions_df = sessions_df[pd.to_datetime(sessions_df['timestamp']) >= watermark]
+    events_df = events_df[events_df['session_id'].isin(sessions_df['session_id'])]
+    return sessions_df, events_df
+
+
+def _rollup_rows(sessions_df):
+    """Rollup row tuples (one per date and grouping-set key) for a sessions batch"""
+    
+    df = sessions_df
+    derived = derived_columns(df)
+    
+    def flag(column):
+        return df[column].to_numpy().astype(np.int64)
+    
+    purchases = flag('completed_purchase')
+    revenue = df['revenue'].to_numpy(dtype=np.float64)
+    facts = pd.DataFrame({
+        'day_index': derived['day_index'],
+        'hour': df['hour'].to_numpy().astype(np.int64),
+        'day_of_week': df['day_of_week'].astype(str).to_numpy(),
+        'traffic_source': df['traffic_source'].to_numpy(),
+        'device': df['device'].to_numpy(),
+        'category': df['category'].to_numpy(),
+        'location': df['location'].to_numpy(),
+        'is_returning': flag('is_returning'),
+        'duration_bucket_id': derived['duration_bucket_id'],
+        'sessions': np.ones(len(df), dtype=np.int64),
+        'product_views': flag('viewed_product'),
+        'carts': flag('added_to_cart'),
+        'checkouts': flag('started_checkout'),
+        'purchases': purchases,
+        'bounces': flag('bounced'),
+        'revenue': revenue,
+        'order_revenue': np.where(purchases == 1, revenue, 0.0),
+        'ad_spend': df['ad_spend'].to_numpy(dtype=np.float64),
+        'duration_sum': df['session_duration_seconds'].to_numpy().astype(np.int64),
+        'pages_sum': df['pages_viewed'].to_numpy().astype(np.int64)
+    })
+    
+    rows = []
+    for grouping_set, dimensions in ROLLUP_SETS.items():
+        grouped = facts.groupby(['day_index'] + dimensions, sort=False)[ROLLUP_MEASURES].sum()
+        grouped = grouped.reset_index()
+        grouped['date'] = np.datetime_as_string(
+            grouped['day_index'].to_numpy().astype('datetime64[D]'), unit='D')
+        grouped.insert(0, 'grouping_set', grouping_set)
+        
+        columns = [grouped[column].tolist() if column in grouped.columns
+                   else [None] * len(grouped) for column in ROLLUP_COLUMNS]
+        rows.extend(zip(*columns))
+    return rows
+
+
+def _sketch_groups(sessions_df):
+    """(sketch key, sketches) of a sessions batch per day and rollup key
+    
+    Keys are (grouping_set, day_index, *ROLLUP_DIMENSIONS) with None for the
+    dimensions outside the grouping set; sketches follow SKETCHES. Each
+    grouping set's sketches are built in one vectorized pass per column.
+    """
+    
+    df = sessions_df
+    derived = derived_columns(df)
+    keys = pd.DataFrame({
+        'day_index': derived['day_index'],
+        'hour': df['hour'].to_numpy().astype(np.int64),
+        'day_of_week': df['day_of_week'].astype(str).to_numpy(),
+        'traffic_source': df['traffic_source'].to_numpy(),
+        'device': df['device'].to_numpy(),
+        'category': df['category'].to_numpy(),
+        'location': df['location'].to_numpy(),
+        'is_returning': df['is_returning'].to_numpy().astype(np.int64),
+        'duration_bucket_id': derived['duration_bucket_id']
+    })
+    hashes = hash_ids(df['user_id'])
+    purchased = df['completed_purchase'].to_numpy().astype(bool)
+    durations = df['session_duration_seconds'].to_numpy(dtype=np.float64)
+    revenue = df['revenue'].to_numpy(dtype=np.float64)
+    
+    groups = []
+    for grouping_set, dimensions in ROLLUP_SETS.items():
+        grouped = keys.groupby(['day_index'] + dimensions, sort=False)
+        codes = grouped.ngroup().to_numpy()
+        count = grouped.ngroups
+        users = group_registers(codes, count, hashes)
+        sketches = zip(
+            [HyperLogLog(registers=registers) for registers in users],
+            group_sketches(codes[purchased], count, durations[purchased]),
+            group_sketches(codes[~purchased], count, durations[~purchased]),
+            group_sketches(codes[purchased], count, revenue[purchased]))
+        values = grouped.size().index.to_frame(index=False)
+        columns = [values[column].tolist() if column in values.columns
+                   else [None] * len(values) for column in ['day_index'] + ROLLUP_DIMENSIONS]
+        for key, group_sketch in zip(zip(*columns), sketches):
+            groups.append(((grouping_set,) + key, group_sketch))
+    return groups
+
+
+def _sketch_columns_select(columns):
+    """The quantile sketch columns of the slice CTE stacked into one sketch column"""
+    
+    return " UNION ALL ".join(f"SELECT {column} as sketch FROM slice" for column in columns)
+
+
+def _register_functions(conn):
+    """Register the SQL functions the queries use on a connection"""
+    
+    conn.create_aggregate('hll_count', 1, HyperLogLogAggregate)
+    conn.create_aggregate('sketch_merge', 1, QuantileSketchMerge)
+    conn.create_aggregate('sketch_build', 1, QuantileSketchBuild)
+    conn.create_function('sketch_quantile', 2, sketch_quantile)
+    conn.create_function('sketch_count', 1, sketch_count)
+    conn.create_function('sketch_mean', 1, sketch_mean)
+
+
+def _event_rows(events_df):
+    """Row tuples for the events table from a legacy or compact frame"""
+    
+    df = to_legacy_events(events_df)
+    return zip(*(_sql_values(df[column]) for column in EVENT_COLUMNS))
+
+
+def _compact_event_rows(events_df):
+    """Row tuples for events_compact from a legacy or compact frame
+    
+    Events are numbered within their session in timestamp order, so a batch
+    must hold all of a session's events (ingest_frames batches that way).
+    """
+    
+    df = to_compact_events(events_df)
+    df = df.sort_values(['session_id', 'timestamp', 'event_id'], kind='stable')
+    
+    codes = {}
+    for column, labels in EVENT_ENUMS.items():
+        codes[column] = df[column].cat.codes.to_numpy()
+        if (codes[column] < 0).any():
+            raise ValueError(f"{column} values outside {labels} cannot be stored compactly")
+    
+    columns = [
+        df['session_id'].to_numpy(),
+        df.groupby('session_id', sort=False).cumcount().to_numpy(),
+        df['event_id'].to_numpy(),
+        df['user_id'].to_numpy(),
+        df['timestamp'].to_numpy(dtype='datetime64[s]').astype(np.int64),
+        codes['event_type'],
+        codes['page']
+    ]
+    return zip(*(column.tolist() for column in columns))
+
+
+def _compact_events_select():
+    """SELECT rendering events_compact rows as the plain events columns"""
+    
+    columns = {column: f"printf('{prefix}%0{width}d', {column})"
+               for column, (prefix, width) in ID_FORMATS.items()}
+    columns['timestamp'] = "datetime(timestamp, 'unixepoch')"
+    for column in EVENT_ENUMS:
+        columns[column] = _label_sql(column, 'events_compact')
+    
+    select = ",\n".join(f"            {columns[column]} as {column}" for column in EVENT_COLUMNS)
+    return f"""
+        SELECT 
+{select}
+        FROM events_compact
+        """
+
+
+def _event_codes(events):
+    """Events chunk with event_type and page as their EVENT_TYPES / PAGES positions"""
+    
+    events = events.reset_index(drop=True)
+    for column, labels in [('event_type', EVENT_TYPES), ('page', PAGES)]:
+        if not pd.api.types.is_integer_dtype(events[column]):
+            events[column] = pd.Categorical(events[column], categories=labels).codes
+    return events
+
+
+def _event_match_sql(steps, compact=False):
+    """Predicate keeping the events that match one of (event_type, page) steps,
+    and its parameters ("" when a step matches every event)
+    
+    compact matches the events_compact id columns instead of the labels.
+    """
+    
+    if not steps:
+        return "", ()
+    clauses = []
+    params = []
+    for step in steps:
+        parts = []
+        for column, value, labels in zip(['event_type', 'page'], step, [EVENT_TYPES, PAGES]):
+            if value is None:
+                continue
+            parts.append(f"{column}_id = ?" if compact else f"{column} = ?")
+            params.append(labels.index(value) if compact else value)
+        if not parts:
+            return "", ()
+        clauses.append(" AND ".join(parts))
+    return "(" + " OR ".join(f"({clause})" for clause in clauses) + ")", tuple(params)
+
+
+def _integer_id_sql(column):
+    """SQL for the integer part of a legacy id column such as 'SES_000042'"""
+    
+    return f"CAST(substr({column}, instr({column}, '_') + 1) AS INTEGER)"
+
+
+def _sql_values(series):
+    """Column values as native Python objects sqlite3 can bind
+    
+    Datetimes become 'YYYY-MM-DD HH:MM:SS' text and bools 0/1, matching
+    what pandas' to_sql stored.
+    """
+    
+    if pd.api.types.is_datetime64_any_dtype(series):
+        text = np.datetime_as_string(series.to_numpy(dtype='datetime64[s]'), unit='s')
+        # ISO 'T' separator -> space, written straight into the unicode buffer
+        if len(text):
+            text.view(np.uint32).reshape(len(text), -1)[:, 10] = ord(' ')
+        return text.tolist()
+    if pd.api.types.is_bool_dtype(series):
+        return series.to_numpy().astype(np.int8).tolist()
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype(object).tolist()
+    return series.tolist()
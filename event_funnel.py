@@ -0,0 +1,157 @@
+"""
+Event Funnel Module
+Ordered funnels over the raw events, in one sorted pass per session
+"""
+
+import numpy as np
+import pandas as pd
+
+from schema import EVENT_TYPES, PAGES
+
+
+# Marks "no chain start" in the kernel's int64 timestamp arrays
+NO_START = np.iinfo(np.int64).min
+
+
+class EventFunnel:
+    """Ordered funnel of event steps completed within a time window
+    
+    Each step is an event type ('add_to_cart'), a page ('product_page': any
+    event on that page) or an (event_type, page) pair. A session reaches
+    step k when it has events matching steps 1 to k in that order, each at
+    most window seconds after the event matching step 1 (no limit when
+    window is None), e.g.
+    EventFunnel(['product_page', 'add_to_cart', 'purchase'], window=1800).
+    
+    Feed it chunks of events sorted by session then time, holding whole
+    sessions (EcommerceDatabase.stream_session_events()), then read result().
+    """
+    
+    def __init__(self, steps, window=None):
+        if not steps:
+            raise ValueError("A funnel needs at least one step")
+        self.steps = [_parse_step(step) for step in steps]
+        self.labels = [' / '.join(part for part in step if part) for step in self.steps]
+        self.window = window
+        self.reached = np.zeros(len(self.steps), dtype=np.int64)
+    
+    def key(self):
+        """Hashable identity of the funnel, for result cache keys"""
+        
+        return (tuple(self.steps), self.window)
+    
+    def add(self, events):
+        """Count the sessions of one chunk reaching each step
+        
+        events has session_id, timestamp (epoch seconds) and the event_type
+        and page codes (positions in EVENT_TYPES and PAGES) columns.
+        """
+        
+        if not len(events):
+            return self
+        event_types = events['event_type'].to_numpy()
+        pages = events['page'].to_numpy()
+        matches = []
+        for event_type, page in self.steps:
+            match = np.ones(len(events), dtype=bool)
+            if event_type is not None:
+                match &= event_types == EVENT_TYPES.index(event_type)
+            if page is not None:
+                match &= pages == PAGES.index(page)
+            matches.append(match)
+        
+        levels = funnel_levels(events['session_id'].to_numpy(),
+                               events['timestamp'].to_numpy(dtype=np.int64), matches, self.window)
+        counts = np.bincount(levels, minlength=len(self.steps) + 1)
+        self.reached += np.cumsum(counts[::-1])[::-1][1:]
+        return self
+    
+    def result(self):
+        """Sessions reaching each step, like get_conversion_funnel()'s frame
+        
+        As in that frame, the users column counts sessions (the visualizer
+        plots either); percentage is relative to the first step and drop_off
+        to the step before.
+        """
+        
+        reached = self.reached.astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percentage = np.where(reached[0] > 0, reached * 100 / reached[0], 0.0)
+            previous = np.concatenate([[reached[0]], reached[:-1]])
+            drop_off = np.where(previous > 0, (previous - reached) * 100 / previous, 0.0)
+        return pd.DataFrame({
+            'stage': self.labels,
+            'stage_order': np.arange(1, len(self.steps) + 1),
+            'users': self.reached,
+            'percentage': np.round(percentage, 2),
+            'drop_off': np.round(drop_off, 2)
+        })
+
+
+def funnel_levels(sessions, timestamps, matches, window=None):
+    """Number of funnel steps each session reaches, in order of first appearance
+    
+    sessions and timestamps describe events sorted by session then time
+    (ties keep their order); matches holds one boolean array per step. The
+    pass is vectorized per step, so the cost is linear in the events:
+    every event completing step k keeps the latest start (step 1 time) of
+    the chains completing step k - 1 before it in its session, which is the
+    best start any later step can extend.
+    """
+    
+    if not len(timestamps):
+        return np.zeros(0, dtype=np.int64)
+    new = np.empty(len(timestamps), dtype=bool)
+    new[0] = True
+    new[1:] = sessions[1:] != sessions[:-1]
+    ordinal = np.cumsum(new) - 1
+    levels = np.zeros(ordinal[-1] + 1, dtype=np.int64)
+    
+    starts = np.where(matches[0], timestamps, NO_START)
+    levels[ordinal[matches[0]]] = 1
+    for step, match in enumerate(matches[1:], start=2):
+        prior = _previous_session_max(starts, ordinal, timestamps)
+        reached = match & (prior != NO_START)
+        if window is not None:
+            reached &= timestamps - np.where(reached, prior, timestamps) <= window
+        starts = np.where(reached, prior, NO_START)
+        levels[ordinal[reached]] = step
+    return levels
+
+
+def _previous_session_max(starts, ordinal, timestamps):
+    """Largest start before each event within its session (NO_START for none)
+    
+    One running maximum over all events: the session ordinal is packed
+    above the start, so a new session always outranks the previous ones.
+    """
+    
+    low = int(timestamps.min())
+    span = int(timestamps.max()) - low + 2
+    packed = np.where(starts == NO_START, 0, starts - low + 1) + ordinal * span
+    running = np.maximum.accumulate(packed)
+    
+    prior = np.full(len(starts), NO_START, dtype=np.int64)
+    before = running[:-1]
+    offset = before - ordinal[1:] * span
+    found = offset > 0
+    prior[1:][found] = offset[found] + low - 1
+    return prior
+
+
+def _parse_step(step):
+    """(event_type, page) of a step, None where the step does not restrict it"""
+    
+    if isinstance(step, str):
+        if step in EVENT_TYPES:
+            return (step, None)
+        if step in PAGES:
+            return (None, step)
+        raise ValueError(f"Unknown funnel step {step!r}: not an event type or page")
+    
+    event_type, page = step
+    if event_type is not None and event_type not in EVENT_TYPES:
+        raise ValueError(f"Unknown event type {event_type!r}")
+    if page is not None and page not in PAGES:
+        raise ValueError(f"Unknown page {page!r}")
+    return (event_type, page)
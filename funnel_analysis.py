@@ -7,14 +7,19 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 
+from schema import DURATION_BUCKETS, add_derived_columns
+
 
 class FunnelAnalyzer:
     """Analyze conversion funnel and user behavior"""
     
-    def __init__(self, sessions_df):
-        self.df = sessions_df
-        self.df['timestamp'] = pd.to_datetime(self.df['timestamp'])
-        self.df['date'] = pd.to_datetime(self.df['date'])
+    def __init__(self, sessions_df, db=None):
+        # Integer day / week / bucket columns, computed once per frame and
+        # reused by every analyzer built on it
+        self.df = add_derived_columns(sessions_df)
+        # Optional EcommerceDatabase holding the same sessions, whose sketches
+        # answer the distribution questions without the raw columns
+        self.db = db
     
     def calculate_funnel_metrics(self):
         """Calculate comprehensive funnel metrics"""
@@ -59,10 +64,10 @@ class FunnelAnalyzer:
             'abandonment_rate': (len(abandoned_carts) / len(cart_sessions) * 100) if len(cart_sessions) > 0 else 0,
             
             # Abandonment by traffic source
-            'abandonment_by_source': abandoned_carts.groupby('traffic_source').size().to_dict(),
+            'abandonment_by_source': abandoned_carts.groupby('traffic_source', observed=True).size().to_dict(),
             
             # Abandonment by device
-            'abandonment_by_device': abandoned_carts.groupby('device').size().to_dict(),
+            'abandonment_by_device': abandoned_carts.groupby('device', observed=True).size().to_dict(),
             
             # Average cart value (potential lost revenue)
             'potential_lost_revenue': abandoned_carts['revenue'].sum()  # This would be estimated
@@ -71,26 +76,43 @@ class FunnelAnalyzer:
         return insights
     
     def analyze_time_to_conversion(self):
-        """Analyze time spent before conversion"""
-        
-        converted = self.df[self.df['completed_purchase'] == True]
-        
-        if len(converted) == 0:
-            return None
-        
+        """Analyze time spent before conversion
+        
+        With a database, the statistics come from its purchase-duration
+        sketches (the median within 1%) and the bucket shares from query 14,
+        instead of the raw durations.
+        """
+        
+        if self.db is not None:
+            stats = self.db.get_value_quantiles().set_index('measure').loc['purchase_duration']
+            if stats['count'] == 0:
+                return None
+            quality = self.db.get_session_quality_metrics().set_index('duration_bucket')
+            buckets = quality['conversions'].reindex(
+                [label for _, label in DURATION_BUCKETS], fill_value=0).to_numpy()
+            stats = {'mean': stats['mean'], 'median': stats['p50'],
+                     'min': stats['min'], 'max': stats['max']}
+        else:
+            converted = self.df[self.df['completed_purchase'] == True]
+            if len(converted) == 0:
+                return None
+            buckets = np.bincount(converted['duration_bucket_id'], minlength=len(DURATION_BUCKETS))
+            durations = converted['session_duration_seconds']
+            stats = {'mean': durations.mean(), 'median': durations.median(),
+                     'min': durations.min(), 'max': durations.max()}
+        
+        total = buckets.sum()
         analysis = {
-            'avg_time_to_convert': converted['session_duration_seconds'].mean(),
-            'median_time_to_convert': converted['session_duration_seconds'].median(),
-            'min_time': converted['session_duration_seconds'].min(),
-            'max_time': converted['session_duration_seconds'].max(),
+            'avg_time_to_convert': stats['mean'],
+            'median_time_to_convert': stats['median'],
+            'min_time': stats['min'],
+            'max_time': stats['max'],
             
-            # Distribution
-            'under_2_min': len(converted[converted['session_duration_seconds'] < 120]) / len(converted) * 100,
-            '2_to_5_min': len(converted[(converted['session_duration_seconds'] >= 120) & 
-                                       (converted['session_duration_seconds'] < 300)]) / len(converted) * 100,
-            '5_to_10_min': len(converted[(converted['session_duration_seconds'] >= 300) & 
-                                        (converted['session_duration_seconds'] < 600)]) / len(converted) * 100,
-            'over_10_min': len(converted[converted['session_duration_seconds'] >= 600]) / len(converted) * 100,
+            # Distribution (duration buckets 0-1 are under 2 minutes)
+            'under_2_min': buckets[:2].sum() / total * 100,
+            '2_to_5_min': buckets[2] / total * 100,
+            '5_to_10_min': buckets[3] / total * 100,
+            'over_10_min': buckets[4] / total * 100,
         }
         
         return analysis
@@ -98,7 +120,7 @@ class FunnelAnalyzer:
     def segment_analysis(self, segment_by='traffic_source'):
         """Detailed segmentation analysis"""
         
-        segments = self.df.groupby(segment_by).agg({
+        segments = self.df.groupby(segment_by, observed=True).agg({
             'session_id': 'count',
             'completed_purchase': 'sum',
             'revenue': 'sum',
@@ -146,22 +168,22 @@ class FunnelAnalyzer:
     def cohort_analysis(self):
         """Analyze user cohorts by first visit date"""
         
-        # Get first session for each user
-        user_first_session = self.df.groupby('user_id')['date'].min().reset_index()
-        user_first_session.columns = ['user_id', 'cohort_date']
-        
-        # Merge back
-        cohort_df = self.df.merge(user_first_session, on='user_id')
+        # First session day of each user, and of each session's user
+        first_day = self.df.groupby('user_id')['day_index'].min()
+        cohort_day = self.df['user_id'].map(first_day).rename('cohort_day')
         
-        # Calculate cohort metrics
-        cohort_metrics = cohort_df.groupby('cohort_date').agg({
-            'user_id': 'nunique',
+        # Calculate cohort metrics. Every user is in exactly one cohort, so its
+        # user count is the number of first days, with no distinct count.
+        cohort_metrics = self.df.groupby(cohort_day).agg({
             'session_id': 'count',
             'completed_purchase': 'sum',
             'revenue': 'sum'
-        }).reset_index()
+        })
+        cohort_metrics.insert(0, 'users', first_day.value_counts())
+        cohort_metrics = cohort_metrics.reset_index()
         
         cohort_metrics.columns = ['cohort_date', 'users', 'sessions', 'conversions', 'revenue']
+        cohort_metrics['cohort_date'] = _day_dates(cohort_metrics['cohort_date'])
         cohort_metrics['conversion_rate'] = (cohort_metrics['conversions'] / cohort_metrics['sessions'] * 100).round(2)
         cohort_metrics['revenue_per_user'] = (cohort_metrics['revenue'] / cohort_metrics['users']).round(2)
         
@@ -216,15 +238,15 @@ class FunnelAnalyzer:
             'session_id': 'count',
             'completed_purchase': 'sum',
             'revenue': 'sum',
-            'timestamp': ['min', 'max']
+            'epoch': ['min', 'max']
         }).reset_index()
         
         user_metrics.columns = ['user_id', 'total_sessions', 'total_purchases', 
                                'total_revenue', 'first_visit', 'last_visit']
         
-        # Calculate days active
-        user_metrics['days_active'] = (pd.to_datetime(user_metrics['last_visit']) - 
-                                       pd.to_datetime(user_metrics['first_visit'])).dt.days + 1
+        # Calculate days active (whole days between first and last visit)
+        user_metrics['days_active'] = (user_metrics['last_visit'] - 
+                                       user_metrics['first_visit']) // 86400 + 1
         
         # Metrics
         avg_sessions_per_user = user_metrics['total_sessions'].mean()
@@ -252,7 +274,7 @@ class FunnelAnalyzer:
         """Analyze conversion trends over time"""
         
         if period == 'daily':
-            trends = self.df.groupby('date').agg({
+            trends = self.df.groupby('day_index').agg({
                 'session_id': 'count',
                 'completed_purchase': 'sum',
                 'revenue': 'sum',
@@ -262,10 +284,11 @@ class FunnelAnalyzer:
             
             trends.columns = ['date', 'sessions', 'conversions', 'revenue', 
                             'carts', 'checkouts']
+            trends['date'] = _day_dates(trends['date'])
         
         elif period == 'weekly':
-            self.df['week'] = self.df['date'].dt.isocalendar().week
-            trends = self.df.groupby('week').agg({
+            week = (self.df['iso_week'] % 100).rename('week')
+            trends = self.df.groupby(week).agg({
                 'session_id': 'count',
                 'completed_purchase': 'sum',
                 'revenue': 'sum'
@@ -281,3 +304,9 @@ class FunnelAnalyzer:
                                          trends['carts'] * 100).round(2)
         
         return trends
+
+
+def _day_dates(day_index):
+    """Dates of day_index values (days since 1970-01-01)"""
+    
+    return pd.to_datetime(day_index.to_numpy().astype('datetime64[D]').astype('datetime64[ns]'))
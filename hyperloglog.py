@@ -0,0 +1,170 @@
+"""
+HyperLogLog Module
+Mergeable distinct-count sketches, stored as SQLite blobs
+"""
+
+import zlib
+
+import numpy as np
+
+from schema import parse_ids
+
+
+# 2**12 one-byte registers per sketch. The relative standard error of an
+# estimate is 1.04 / sqrt(2**12) = 1.6%, so about 95% of estimates fall
+# within 3.3% of the true count and 99.7% within 4.9%, however many
+# sketches were merged; counts up to a few hundred are close to exact.
+HLL_PRECISION = 12
+
+
+class HyperLogLog:
+    """Distinct-count sketch over 64-bit hashes of integer ids
+    
+    Each register keeps the highest rank (leading zeros + 1) of the hashes
+    routed to it. The union of two sketches is their register-wise maximum,
+    so sketches of different days or segments merge into the sketch of
+    their union, with the same error bound as a sketch built directly.
+    """
+    
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        if registers is None:
+            registers = np.zeros(2 ** precision, dtype=np.uint8)
+        self.registers = registers
+    
+    @classmethod
+    def from_ids(cls, ids, precision=HLL_PRECISION):
+        """Sketch of a column of integer or legacy string ids"""
+        
+        return cls(precision, group_registers(np.zeros(len(ids), dtype=np.int64), 1,
+                                              hash_ids(ids), precision)[0])
+    
+    @classmethod
+    def from_blob(cls, blob):
+        """Sketch stored by to_blob()"""
+        
+        data = zlib.decompress(blob)
+        return cls(data[0], np.frombuffer(data, dtype=np.uint8, offset=1).copy())
+    
+    def to_blob(self):
+        """Compressed bytes: the precision, then the registers"""
+        
+        return zlib.compress(bytes([self.precision]) + self.registers.tobytes())
+    
+    def merge(self, other):
+        """Fold another sketch of the same precision into this one (in place)"""
+        
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge precision {other.precision} into {self.precision}")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+    
+    def count(self):
+        """Estimated number of distinct ids
+        
+        Uses Ertl's improved estimator ("New cardinality estimation algorithms
+        for HyperLogLog sketches", 2017), which corrects both the small-range
+        and the mid-range bias of the original HyperLogLog formula from the
+        register histogram alone.
+        """
+        
+        m = len(self.registers)
+        width = 64 - self.precision
+        counts = np.bincount(self.registers, minlength=width + 2)
+        z = m * _tau(1 - counts[width + 1] / m)
+        for rank in range(width, 0, -1):
+            z = 0.5 * (z + counts[rank])
+        z += m * _sigma(counts[0] / m)
+        if z == 0:
+            return 0
+        return int(round(m * m / (2 * np.log(2) * z)))
+    
+    def relative_error(self):
+        """Relative standard error of count()"""
+        
+        return 1.04 / np.sqrt(len(self.registers))
+
+
+class HyperLogLogAggregate:
+    """SQLite aggregate hll_count(registers): estimated distinct ids of the union of blobs"""
+    
+    def __init__(self):
+        self.sketch = None
+    
+    def step(self, blob):
+        if blob is None:
+            return
+        sketch = HyperLogLog.from_blob(blob)
+        self.sketch = sketch if self.sketch is None else self.sketch.merge(sketch)
+    
+    def finalize(self):
+        return 0 if self.sketch is None else self.sketch.count()
+
+
+def hash_ids(ids):
+    """64-bit hashes of integer or legacy string ids (SplitMix64 finalizer)"""
+    
+    x = np.asarray(parse_ids(ids), dtype=np.int64).view(np.uint64).copy()
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return x
+
+
+def group_registers(codes, groups, hashes, precision=HLL_PRECISION):
+    """Registers of one sketch per group, as a (groups, 2**precision) array
+    
+    codes numbers each hash's group from 0 to groups - 1. The top precision
+    bits of a hash pick its register; the rank is the position of the first
+    set bit in the rest.
+    """
+    
+    width = 64 - precision
+    index = (hashes >> np.uint64(width)).astype(np.int64)
+    rest = hashes & np.uint64((1 << width) - 1)
+    rank = width - _bit_length(rest) + 1
+    
+    registers = np.zeros(groups * 2 ** precision, dtype=np.uint8)
+    np.maximum.at(registers, np.asarray(codes, dtype=np.int64) * 2 ** precision + index,
+                  rank.astype(np.uint8))
+    return registers.reshape(groups, 2 ** precision)
+
+
+def _bit_length(values):
+    """Bit length of each uint64 (0 for 0), exact through float64 on 32-bit halves"""
+    
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1]).astype(np.int64)
+
+
+def _sigma(x):
+    """Series for the empty registers in Ertl's estimator"""
+    
+    if x == 1:
+        return np.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def _tau(x):
+    """Series for the saturated registers in Ertl's estimator"""
+    
+    if x == 0 or x == 1:
+        return 0.0
+    y, z = 1.0, 1 - x
+    while True:
+        x = np.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
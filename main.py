@@ -10,10 +10,12 @@ import os
 sys.path.append('src')
 
 from data_generator import EcommerceDataGenerator
+from async_database import REPORT_QUERIES
 from database import EcommerceDatabase
 from funnel_analysis import FunnelAnalyzer
 from visualization import EcommerceVisualizer
 from report_generator import ReportGenerator
+from storage import find_dataset, load_sessions
 
 
 def print_header(text):
@@ -54,10 +56,10 @@ def generate_data():
     """Generate e-commerce data"""
     print_header("DATA GENERATION")
     
-    generator = EcommerceDataGenerator(num_sessions=15000)
+    generator = EcommerceDataGenerator(num_sessions=15000, compact=True)
     sessions_df = generator.generate_sessions()
     events_df = generator.generate_event_log(sessions_df)
-    generator.save_data(sessions_df, events_df)
+    generator.save_data(sessions_df, events_df, file_format='parquet')
     
     print("\n✓ Data generation complete!")
     input("\nPress Enter to continue...")
@@ -71,7 +73,7 @@ def load_data_to_database():
     db = EcommerceDatabase()
     db.connect()
     db.create_tables()
-    db.load_data('data/sessions_data.csv', 'data/events_data.csv')
+    db.load_data(find_dataset('sessions'), find_dataset('events'))
     
     print("\n✓ Data loaded into database successfully!")
     input("\nPress Enter to continue...")
@@ -104,7 +106,8 @@ def analyze_funnel(db):
     """Analyze conversion funnel"""
     print_header("CONVERSION FUNNEL ANALYSIS")
     
-    funnel = db.get_conversion_funnel()
+    headline = db.get_headline_metrics()
+    funnel = headline['conversion_funnel']
     
     print("\n🎯 Conversion Funnel Breakdown:\n")
     for _, row in funnel.iterrows():
@@ -113,8 +116,14 @@ def analyze_funnel(db):
             print(f"{'':25}  ⚠️  Drop-off: {row['drop_off']}%")
         print()
     
+    # The same path traced through the event log, with a time limit
+    events_funnel = db.get_event_funnel(['product_page', 'add_to_cart', 'purchase'], window=1800)
+    print("\n⏱️  Product Page → Cart → Purchase within 30 minutes (event log, sessions per step):\n")
+    for _, row in events_funnel.iterrows():
+        print(f"{row['stage']:<25}: {row['users']:>7,} sessions ({row['percentage']:>6}%)")
+    
     # Cart abandonment
-    cart = db.get_cart_abandonment_rate()
+    cart = headline['cart_abandonment_rate']
     print("\n🛒 Cart Abandonment Analysis:\n")
     print(f"Carts Created:     {cart['carts_created'].values[0]:,}")
     print(f"Carts Abandoned:   {cart['carts_abandoned'].values[0]:,}")
@@ -152,7 +161,7 @@ def analyze_cart_abandonment(db, sessions_df):
     """Detailed cart abandonment analysis"""
     print_header("CART ABANDONMENT DEEP DIVE")
     
-    analyzer = FunnelAnalyzer(sessions_df)
+    analyzer = FunnelAnalyzer(sessions_df, db)
     insights = analyzer.get_cart_abandonment_insights()
     
     print("\n🛒 Cart Abandonment Insights:\n")
@@ -182,17 +191,20 @@ def generate_visualizations(db, sessions_df):
     
     visualizer = EcommerceVisualizer(sessions_df)
     
-    # Get data
-    funnel_data = db.get_conversion_funnel()
-    traffic_data = db.get_traffic_source_performance()
-    device_data = db.get_device_performance()
-    category_data = db.get_category_performance()
-    location_data = db.get_location_analysis()
-    weekday_data = db.get_weekday_performance()
-    returning_data = db.get_returning_vs_new()
-    hourly_data = db.get_hourly_patterns()
-    daily_data = db.get_daily_trends()
-    overall_metrics = db.get_overall_metrics()
+    # Get data (the queries are independent, so they run concurrently)
+    data = db.run_concurrent(REPORT_QUERIES)
+    headline = db.get_headline_metrics(data['headline_snapshot'])
+    funnel_data = headline['conversion_funnel']
+    traffic_data = data['traffic_source_performance']
+    device_data = data['device_performance']
+    category_data = data['category_performance']
+    location_data = data['location_analysis']
+    weekday_data = data['weekday_performance']
+    returning_data = data['returning_vs_new']
+    hourly_data = data['hourly_patterns']
+    daily_data = data['daily_trends']
+    overall_metrics = headline['overall_metrics']
+    value_quantiles = data['value_quantiles'].set_index('measure')
     
     # Generate charts
     visualizer.plot_conversion_funnel(funnel_data)
@@ -205,9 +217,10 @@ def generate_visualizations(db, sessions_df):
     visualizer.plot_conversion_trends(daily_data)
     visualizer.plot_weekday_performance(weekday_data)
     visualizer.plot_customer_segmentation(returning_data)
-    visualizer.plot_revenue_distribution(sessions_df)
+    visualizer.plot_revenue_distribution(db.get_value_histogram('order_value'),
+                                         value_quantiles.loc['order_value'])
     visualizer.plot_location_performance(location_data)
-    visualizer.plot_session_duration_analysis(sessions_df)
+    visualizer.plot_session_duration_analysis(value_quantiles)
     visualizer.create_kpi_dashboard(overall_metrics)
     
     print("\n✓ All visualizations created successfully!")
@@ -219,7 +232,7 @@ def create_excel_report(db, sessions_df):
     """Create Excel report"""
     print_header("EXCEL REPORT GENERATION")
     
-    analyzer = FunnelAnalyzer(sessions_df)
+    analyzer = FunnelAnalyzer(sessions_df, db)
     reporter = ReportGenerator()
     
     filename = reporter.create_excel_report(db, sessions_df, analyzer)
@@ -233,7 +246,7 @@ def generate_business_insights(db, sessions_df):
     """Generate business insights document"""
     print_header("BUSINESS INSIGHTS GENERATION")
     
-    analyzer = FunnelAnalyzer(sessions_df)
+    analyzer = FunnelAnalyzer(sessions_df, db)
     reporter = ReportGenerator()
     
     filename = reporter.create_business_insights_doc(db, analyzer)
@@ -261,11 +274,19 @@ def view_sql_queries(db):
     print("10. Revenue Metrics")
     
     print("\n✓ All SQL queries are documented in: reports/analytical_queries.sql")
+    
+    print_section("Query Plans (✓ = served from an index)")
+    db.explain_queries()
     input("\nPress Enter to continue...")
 
 
-def run_complete_analysis():
-    """Run complete end-to-end analysis"""
+def run_complete_analysis(save_files=False):
+    """Run complete end-to-end analysis
+    
+    Generated data goes straight into SQLite; pass save_files=True to also
+    write the Parquet datasets. Returns the generated sessions (None when
+    cancelled), so the menu's later analyses use the data just loaded.
+    """
     print_header("COMPLETE ANALYSIS PIPELINE")
     
     print("This will:\n")
@@ -279,25 +300,25 @@ def run_complete_analysis():
     confirm = input("Continue? (y/n): ")
     
     if confirm.lower() != 'y':
-        return
+        return None
     
     # Step 1: Generate data
     print_section("Step 1/6: Generating Data")
-    generator = EcommerceDataGenerator(num_sessions=15000)
+    generator = EcommerceDataGenerator(num_sessions=15000, compact=True)
     sessions_df = generator.generate_sessions()
     events_df = generator.generate_event_log(sessions_df)
-    generator.save_data(sessions_df, events_df)
+    if save_files:
+        generator.save_data(sessions_df, events_df, file_format='parquet')
     
-    # Step 2: Load to database
+    # Step 2: Load to database (directly from memory, no file round-trip)
     print_section("Step 2/6: Loading to Database")
     db = EcommerceDatabase()
     db.connect()
-    db.create_tables()
-    db.load_data('data/sessions_data.csv', 'data/events_data.csv')
+    db.ingest_frames(sessions_df, events_df)
     
     # Step 3: Run analytics
     print_section("Step 3/6: Running Analytics")
-    analyzer = FunnelAnalyzer(sessions_df)
+    analyzer = FunnelAnalyzer(sessions_df, db)
     funnel_metrics = analyzer.calculate_funnel_metrics()
     bottlenecks = analyzer.identify_bottlenecks()
     print(f"✓ Analyzed {len(sessions_df):,} sessions")
@@ -322,9 +343,12 @@ def run_complete_analysis():
     print(f"Sessions Analyzed:     {len(sessions_df):,}")
     print(f"Conversion Rate:       {funnel_metrics['overall_conversion_rate']:.2f}%")
     print(f"Cart Abandonment:      {analyzer.get_cart_abandonment_insights()['abandonment_rate']:.2f}%")
+    cache_stats = db.cache.stats()
+    print(f"Query Cache:           {cache_stats['hits']} hits / {cache_stats['misses']} misses")
     print(f"\n📁 Generated Files:\n")
-    print("  - data/sessions_data.csv")
-    print("  - data/events_data.csv")
+    if save_files:
+        print("  - data/sessions_data.parquet")
+        print("  - data/events_data.parquet")
     print("  - database/ecommerce.db")
     print("  - output/*.html (14 interactive charts)")
     print("  - output/*.png (chart images)")
@@ -332,9 +356,24 @@ def run_complete_analysis():
     print("  - reports/business_insights.md")
     print("  - reports/analytical_queries.sql")
     
+    print(f"\n⏱️  Query Profile:\n")
+    db.profiler.print_summary()
+    
     db.close()
     
     input("\n\nPress Enter to continue...")
+    return sessions_df
+
+
+def load_menu_sessions():
+    """Sessions from the saved datasets, or None (with a hint) when there are none yet"""
+    
+    try:
+        return load_sessions()
+    except FileNotFoundError as error:
+        print(f"\n⚠️  {error} (option 1), or run the complete analysis (option 11)")
+        input("Press Enter to continue...")
+        return None
 
 
 def main():
@@ -383,8 +422,9 @@ def main():
                 db = EcommerceDatabase()
                 db.connect()
             if sessions_df is None:
-                import pandas as pd
-                sessions_df = pd.read_csv('data/sessions_data.csv')
+                sessions_df = load_menu_sessions()
+            if sessions_df is None:
+                continue
             analyze_cart_abandonment(db, sessions_df)
         
         elif choice == 7:
@@ -392,8 +432,9 @@ def main():
                 db = EcommerceDatabase()
                 db.connect()
             if sessions_df is None:
-                import pandas as pd
-                sessions_df = pd.read_csv('data/sessions_data.csv')
+                sessions_df = load_menu_sessions()
+            if sessions_df is None:
+                continue
             generate_visualizations(db, sessions_df)
         
         elif choice == 8:
@@ -401,8 +442,9 @@ def main():
                 db = EcommerceDatabase()
                 db.connect()
             if sessions_df is None:
-                import pandas as pd
-                sessions_df = pd.read_csv('data/sessions_data.csv')
+                sessions_df = load_menu_sessions()
+            if sessions_df is None:
+                continue
             create_excel_report(db, sessions_df)
         
         elif choice == 9:
@@ -410,8 +452,9 @@ def main():
                 db = EcommerceDatabase()
                 db.connect()
             if sessions_df is None:
-                import pandas as pd
-                sessions_df = pd.read_csv('data/sessions_data.csv')
+                sessions_df = load_menu_sessions()
+            if sessions_df is None:
+                continue
             generate_business_insights(db, sessions_df)
         
         elif choice == 10:
@@ -421,7 +464,9 @@ def main():
             view_sql_queries(db)
         
         elif choice == 11:
-            run_complete_analysis()
+            analyzed = run_complete_analysis()
+            if analyzed is not None:
+                sessions_df = analyzed
         
         elif choice == 12:
             if db:
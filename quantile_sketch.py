@@ -0,0 +1,194 @@
+"""
+Quantile Sketch Module
+Mergeable relative-error quantile sketches, stored as SQLite blobs
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+
+# Every quantile is within 1% of the true value of that rank, however many
+# sketches were merged. Values from 1 to 1e7 get their own log-spaced
+# buckets (larger ones share the top bucket); values below 1 share bucket 0
+# and are reported as the sketch's minimum.
+SKETCH_ACCURACY = 0.01
+GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+MAX_VALUE = 1e7
+BUCKETS = int(np.ceil(np.log(MAX_VALUE) / np.log(GAMMA))) + 2
+
+# Bucket k >= 1 holds (GAMMA**(k-2), GAMMA**(k-1)] and bucket 0 holds [0, 1):
+# the value reported for each bucket, and the bounds between them
+BUCKET_VALUES = np.concatenate(
+    [[0.0], 2 * GAMMA ** np.arange(BUCKETS - 1) / (GAMMA + 1)])
+BUCKET_BOUNDS = np.concatenate([[0.0, 1.0], GAMMA ** np.arange(BUCKETS - 1)])
+
+
+class QuantileSketch:
+    """Log-bucketed quantile sketch of non-negative values (DDSketch-style)
+    
+    Each value is counted in the bucket of its logarithm base GAMMA, so the
+    sketch of a union is the sum of the bucket counts and merging loses no
+    accuracy. The count, sum, minimum and maximum are kept exactly.
+    """
+    
+    def __init__(self, counts=None, total=0.0, low=np.inf, high=-np.inf):
+        if counts is None:
+            counts = np.zeros(BUCKETS, dtype=np.uint32)
+        self.counts = counts
+        self.total = total
+        self.low = low
+        self.high = high
+    
+    @classmethod
+    def from_values(cls, values):
+        """Sketch of an array of values"""
+        
+        values = np.asarray(values, dtype=np.float64)
+        sketches = group_sketches(np.zeros(len(values), dtype=np.int64), 1, values)
+        return sketches[0]
+    
+    @classmethod
+    def from_blob(cls, blob):
+        """Sketch stored by to_blob()"""
+        
+        total, low, high = struct.unpack_from('<ddd', blob)
+        counts = np.frombuffer(zlib.decompress(blob[24:]), dtype='<u4').astype(np.uint32)
+        return cls(counts, total, low, high)
+    
+    def to_blob(self):
+        """Bytes: sum, minimum and maximum, then the compressed bucket counts"""
+        
+        return (struct.pack('<ddd', self.total, self.low, self.high)
+                + zlib.compress(self.counts.astype('<u4').tobytes()))
+    
+    def merge(self, other):
+        """Fold another sketch into this one (in place)"""
+        
+        self.counts += other.counts
+        self.total += other.total
+        self.low = min(self.low, other.low)
+        self.high = max(self.high, other.high)
+        return self
+    
+    def count(self):
+        """Number of values sketched"""
+        
+        return int(self.counts.sum())
+    
+    def mean(self):
+        """Exact mean of the values (None when empty)"""
+        
+        count = self.count()
+        return self.total / count if count else None
+    
+    def quantile(self, q):
+        """Value of rank q (0-1) in nearest-rank order; q = 0 and 1 are the exact extremes"""
+        
+        count = self.count()
+        if not count:
+            return None
+        if q <= 0:
+            return self.low
+        if q >= 1:
+            return self.high
+        bucket = np.searchsorted(np.cumsum(self.counts), q * (count - 1), side='right')
+        return float(min(max(BUCKET_VALUES[bucket], self.low), self.high))
+    
+    def histogram(self, bins=30):
+        """(counts, edges) like np.histogram: bins equal-width bins over
+        [minimum, maximum], or the given bin edges
+        
+        Counts are estimates: each bucket's count is spread evenly over the
+        part of its value range inside [minimum, maximum].
+        """
+        
+        count = self.count()
+        if not isinstance(bins, int):
+            edges = np.asarray(bins, dtype=np.float64)
+        elif self.high > self.low:
+            edges = np.linspace(self.low, self.high, bins + 1)
+        else:
+            center = self.high if count else 0.0
+            edges = np.linspace(center - 0.5, center + 0.5, bins + 1)
+        
+        if not count or self.high <= self.low:
+            # Empty, or a single distinct value
+            values = [self.high] if count else []
+            weights = [count] if count else None
+            return np.histogram(values, edges, weights=weights)[0].astype(np.int64), edges
+        
+        bounds = np.clip(BUCKET_BOUNDS, self.low, self.high)
+        cumulative = np.concatenate([[0], np.cumsum(self.counts, dtype=np.int64)])
+        counts = np.diff(np.interp(edges, bounds, cumulative))
+        return np.round(counts).astype(np.int64), edges
+
+
+class QuantileSketchMerge:
+    """SQLite aggregate sketch_merge(sketch): the blob of the union of sketch blobs"""
+    
+    def __init__(self):
+        self.sketch = None
+    
+    def step(self, blob):
+        if blob is None:
+            return
+        sketch = QuantileSketch.from_blob(blob)
+        self.sketch = sketch if self.sketch is None else self.sketch.merge(sketch)
+    
+    def finalize(self):
+        return None if self.sketch is None else self.sketch.to_blob()
+
+
+class QuantileSketchBuild:
+    """SQLite aggregate sketch_build(value): the blob sketching a column (NULLs skipped)"""
+    
+    def __init__(self):
+        self.values = []
+    
+    def step(self, value):
+        if value is not None:
+            self.values.append(value)
+    
+    def finalize(self):
+        return QuantileSketch.from_values(self.values).to_blob()
+
+
+def sketch_quantile(blob, q):
+    """SQL function sketch_quantile(sketch, q)"""
+    
+    return None if blob is None else QuantileSketch.from_blob(blob).quantile(q)
+
+
+def sketch_count(blob):
+    """SQL function sketch_count(sketch)"""
+    
+    return 0 if blob is None else QuantileSketch.from_blob(blob).count()
+
+
+def sketch_mean(blob):
+    """SQL function sketch_mean(sketch)"""
+    
+    return None if blob is None else QuantileSketch.from_blob(blob).mean()
+
+
+def group_sketches(codes, groups, values):
+    """One sketch per group, codes numbering each value's group from 0 to groups - 1"""
+    
+    codes = np.asarray(codes, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        buckets = np.where(values < 1, 0,
+                           np.ceil(np.log(np.maximum(values, 1)) / np.log(GAMMA)) + 1)
+    buckets = np.minimum(buckets, BUCKETS - 1).astype(np.int64)
+    
+    counts = np.bincount(codes * BUCKETS + buckets, minlength=groups * BUCKETS)
+    counts = counts.reshape(groups, BUCKETS).astype(np.uint32)
+    totals = np.bincount(codes, weights=values, minlength=groups)
+    lows = np.full(groups, np.inf)
+    np.minimum.at(lows, codes, values)
+    highs = np.full(groups, -np.inf)
+    np.maximum.at(highs, codes, values)
+    return [QuantileSketch(counts[group], float(totals[group]), float(lows[group]),
+                           float(highs[group])) for group in range(groups)]
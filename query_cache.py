@@ -0,0 +1,87 @@
+"""
+Query Cache Module
+Versioned LRU cache for analytical query results
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class QueryCache:
+    """LRU cache of query result frames, bounded by entry count and memory
+    
+    Entries are keyed by query name and parameters. Every load bumps the data
+    version, which drops all cached results, so a hit never serves stale data;
+    EcommerceDatabase also bumps it when PRAGMA data_version shows another
+    connection or process has written to the database.
+    """
+    
+    def __init__(self, max_entries=128, max_mb=64):
+        self.max_entries = max_entries
+        self.max_bytes = max_mb * 1024 * 1024
+        self.version = 0
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Pooled worker threads share the cache
+        self._lock = threading.RLock()
+    
+    def get(self, key):
+        """Cached frame for key (a copy callers may modify), or None"""
+        
+        with self._lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0].copy()
+    
+    def put(self, key, df, version=None):
+        """Store a result frame, evicting least recently used entries to fit
+        
+        version is the data version the frame was read under (taken before
+        the lookup); a frame read across a version bump is not stored.
+        """
+        
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (df.copy(), size)
+            self.total_bytes += size
+            
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+    
+    def bump_version(self):
+        """Mark the data as changed, invalidating every cached result"""
+        
+        with self._lock:
+            self.version += 1
+            self.entries.clear()
+            self.total_bytes = 0
+    
+    def stats(self):
+        """Hit/miss counters and current size"""
+        
+        lookups = self.hits + self.misses
+        return {
+            'version': self.version,
+            'entries': len(self.entries),
+            'memory_mb': round(self.total_bytes / 1024 / 1024, 3),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups * 100, 2) if lookups else 0.0
+        }
@@ -0,0 +1,119 @@
+"""
+Query Filter Module
+Date range, hour range and segment predicates shared by the analytical queries
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Session dimensions a filter can restrict to a list of values
+FILTER_DIMENSIONS = ['day_of_week', 'traffic_source', 'device', 'location', 'category',
+                     'is_returning']
+
+
+class QueryFilter:
+    """Slice of the sessions an analytical query should cover
+    
+    Dates and hours are inclusive ranges; every other keyword is a dimension
+    from FILTER_DIMENSIONS mapped to the values to keep, e.g.
+    QueryFilter(start_date='2024-06-01', device=['Mobile'], location=['Mumbai']).
+    The filter compiles to a parameterized WHERE clause over the columns the
+    sessions table, the session_facts view and the rollup share, so it can
+    use their date and dimension indexes. Dates are matched as integer
+    day_index ranges.
+    """
+    
+    def __init__(self, start_date=None, end_date=None, start_hour=None, end_hour=None,
+                 **dimensions):
+        unknown = set(dimensions) - set(FILTER_DIMENSIONS)
+        if unknown:
+            raise ValueError(f"Unknown filter dimensions: {', '.join(sorted(unknown))}")
+        
+        self.start_date = _day(start_date)
+        self.end_date = _day(end_date)
+        self.start_hour = start_hour
+        self.end_hour = end_hour
+        self.dimensions = {}
+        for column, values in dimensions.items():
+            if values is None:
+                continue
+            if isinstance(values, (str, bool, int)):
+                values = [values]
+            if column == 'is_returning':
+                values = [int(value) for value in values]
+            self.dimensions[column] = tuple(sorted(set(values)))
+    
+    @classmethod
+    def last_days(cls, days, end_date=None, **kwargs):
+        """Filter covering the `days` days up to end_date (today by default)"""
+        
+        end = pd.Timestamp(end_date or pd.Timestamp.today()).normalize()
+        return cls(start_date=end - pd.Timedelta(days=days - 1), end_date=end, **kwargs)
+    
+    def columns(self):
+        """Dimension columns the filter restricts, besides date"""
+        
+        columns = set(self.dimensions)
+        if self.start_hour is not None or self.end_hour is not None:
+            columns.add('hour')
+        return columns
+    
+    def compile(self, dimension_ids=None):
+        """WHERE clause ('' when the filter is empty) and its parameters
+        
+        dimension_ids maps dimensions stored as integer keys (the star
+        layout) to {label: key}; those are matched on <dimension>_id.
+        """
+        
+        clauses = []
+        params = []
+        for column, op, value in [('day_index', '>=', _day_index(self.start_date)),
+                                  ('day_index', '<=', _day_index(self.end_date)),
+                                  ('hour', '>=', self.start_hour), ('hour', '<=', self.end_hour)]:
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        for column, values in sorted(self.dimensions.items()):
+            if dimension_ids and column in dimension_ids:
+                ids = dimension_ids[column]
+                values = [ids[value] for value in values if value in ids]
+                column = f"{column}_id"
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        
+        if not clauses:
+            return "", ()
+        return "WHERE " + " AND ".join(clauses), tuple(params)
+    
+    def key(self):
+        """Hashable identity of the filter, for result cache keys"""
+        
+        return (self.start_date, self.end_date, self.start_hour, self.end_hour,
+                tuple(sorted(self.dimensions.items())))
+    
+    def __eq__(self, other):
+        return isinstance(other, QueryFilter) and self.key() == other.key()
+    
+    def __hash__(self):
+        return hash(self.key())
+    
+    def __repr__(self):
+        where, params = self.compile()
+        return f"QueryFilter({where or 'all sessions'}; {list(params)})"
+
+
+def _day(value):
+    """Normalize a date-like value to the 'YYYY-MM-DD' text the tables store"""
+    
+    if value is None:
+        return None
+    return pd.Timestamp(value).strftime('%Y-%m-%d')
+
+
+def _day_index(day):
+    """Days from 1970-01-01 to a 'YYYY-MM-DD' day, as stored in day_index"""
+    
+    if day is None:
+        return None
+    return int(np.datetime64(day, 'D').astype(np.int64))
@@ -0,0 +1,131 @@
+"""
+Query Profiler Module
+Timing histogram, plan capture and slow-query log for analytical queries
+"""
+
+import json
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+# Latency histogram bucket upper bounds in milliseconds (last bucket is open)
+LATENCY_BUCKETS_MS = [1, 5, 10, 50, 100, 500, 1000, 5000]
+
+# SQLite virtual-machine instructions between progress-handler callbacks
+PROGRESS_INTERVAL = 1000
+
+
+class QueryProfiler:
+    """Collect per-query timings, work done and plans
+    
+    vm_steps counts SQLite VM instructions (progress-handler callbacks times
+    PROGRESS_INTERVAL), a proxy for rows scanned that can be compared with
+    the rows returned. Calls slower than slow_query_ms are appended to the
+    JSONL file slow_query_log, when one is set.
+    
+    Memory stays bounded in a long-running process: each query keeps running
+    totals and latency bucket counts, and only the last recent_calls calls
+    are kept whole in records. plans maps (query, filter key) to the plan
+    captured on its first run, for the max_plans most recent pairs.
+    """
+    
+    def __init__(self, slow_query_log=None, slow_query_ms=500, recent_calls=1000,
+                 max_plans=500):
+        self.slow_query_log = slow_query_log
+        self.slow_query_ms = slow_query_ms
+        self.records = deque(maxlen=recent_calls)
+        self.totals = {}
+        self.plans = OrderedDict()
+        self.max_plans = max_plans
+        self._lock = threading.Lock()
+    
+    def add_plan(self, name, filters_key, plan):
+        """Keep the plan of a query under one filter, dropping the oldest beyond max_plans"""
+        
+        with self._lock:
+            self.plans[(name, filters_key)] = plan
+            while len(self.plans) > self.max_plans:
+                self.plans.popitem(last=False)
+    
+    def record(self, name, wall_ms, rows, result_bytes, vm_steps=0, cached=False,
+               filters_key=None):
+        """Add one query call (filters_key picks the plan for the slow-query log)"""
+        
+        entry = {
+            'query': name,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'wall_ms': round(wall_ms, 3),
+            'rows_returned': rows,
+            'result_bytes': result_bytes,
+            'vm_steps': vm_steps,
+            'cached': cached
+        }
+        bucket = int(np.searchsorted(LATENCY_BUCKETS_MS, wall_ms, side='left'))
+        with self._lock:
+            self.records.append(entry)
+            totals = self.totals.get(name)
+            if totals is None:
+                totals = self.totals[name] = {
+                    'calls': 0, 'cache_hits': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'rows_returned': 0, 'vm_steps': 0, 'result_bytes': 0,
+                    'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+            totals['calls'] += 1
+            totals['cache_hits'] += int(cached)
+            totals['total_ms'] += entry['wall_ms']
+            totals['max_ms'] = max(totals['max_ms'], entry['wall_ms'])
+            totals['rows_returned'] += rows
+            totals['vm_steps'] += vm_steps
+            totals['result_bytes'] += result_bytes
+            totals['buckets'][bucket] += 1
+            if self.slow_query_log and not cached and wall_ms >= self.slow_query_ms:
+                entry = dict(entry, plan=self.plans.get((name, filters_key)))
+                with open(self.slow_query_log, 'a') as f:
+                    f.write(json.dumps(entry) + '\n')
+    
+    def histogram(self):
+        """Call counts per latency bucket for each query"""
+        
+        with self._lock:
+            counts = {name: list(totals['buckets']) for name, totals in self.totals.items()}
+        if not counts:
+            return pd.DataFrame()
+        
+        labels = [f'<={bound}ms' for bound in LATENCY_BUCKETS_MS] + [f'>{LATENCY_BUCKETS_MS[-1]}ms']
+        df = pd.DataFrame.from_dict(counts, orient='index', columns=labels).sort_index()
+        df.index.name = 'query'
+        df.columns.name = 'bucket'
+        return df
+    
+    def summary(self):
+        """Calls, cache hits and timing / work totals per query, slowest first"""
+        
+        with self._lock:
+            rows = [dict(totals, query=name) for name, totals in self.totals.items()]
+        if not rows:
+            return pd.DataFrame()
+        
+        df = pd.DataFrame(rows)
+        df['mean_ms'] = df['total_ms'] / df['calls']
+        df['result_kb'] = df['result_bytes'] / 1024
+        summary = df[['query', 'calls', 'cache_hits', 'total_ms', 'mean_ms', 'max_ms',
+                      'rows_returned', 'vm_steps', 'result_kb']]
+        return summary.sort_values('total_ms', ascending=False).round(2).reset_index(drop=True)
+    
+    def print_summary(self):
+        """Print the summary table"""
+        
+        summary = self.summary()
+        if summary.empty:
+            print("No queries profiled")
+            return
+        
+        print(f"{'Query':<30} {'Calls':>5} {'Hits':>5} {'Total ms':>10} {'Max ms':>9} "
+              f"{'Rows':>7} {'VM steps':>11}")
+        for _, row in summary.iterrows():
+            print(f"{row['query']:<30} {row['calls']:>5} {row['cache_hits']:>5} "
+                  f"{row['total_ms']:>10.1f} {row['max_ms']:>9.1f} "
+                  f"{row['rows_returned']:>7} {row['vm_steps']:>11,}")
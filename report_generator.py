@@ -26,55 +26,73 @@ class ReportGenerator:
         
         filename = f'{self.output_dir}/ecommerce_analysis_report.xlsx'
         
+        # Fetch the independent queries concurrently; funnel, cart and
+        # overall KPIs all come from the one headline scan. Daily trends grow
+        # with the date range, so that sheet is streamed instead.
+        data = db.run_concurrent([
+            'headline_snapshot', 'traffic_source_performance', 'device_performance',
+            'category_performance', 'location_analysis', 'hourly_patterns'
+        ])
+        headline = db.get_headline_metrics(data['headline_snapshot'])
+        
         with pd.ExcelWriter(filename, engine='openpyxl') as writer:
             
             # Sheet 1: Executive Summary
-            summary_data = self._create_executive_summary(db, sessions_df, funnel_analyzer)
+            summary_data = self._create_executive_summary(db, sessions_df, funnel_analyzer, headline)
             summary_data.to_excel(writer, sheet_name='Executive Summary', index=False)
             
             # Sheet 2: Conversion Funnel
-            funnel_data = db.get_conversion_funnel()
+            funnel_data = headline['conversion_funnel']
             funnel_data.to_excel(writer, sheet_name='Conversion Funnel', index=False)
             
             # Sheet 3: Traffic Source Performance
-            traffic_data = db.get_traffic_source_performance()
+            traffic_data = data['traffic_source_performance']
             traffic_data.to_excel(writer, sheet_name='Traffic Sources', index=False)
             
             # Sheet 4: Device Performance
-            device_data = db.get_device_performance()
+            device_data = data['device_performance']
             device_data.to_excel(writer, sheet_name='Device Performance', index=False)
             
             # Sheet 5: Daily Trends
-            daily_data = db.get_daily_trends()
-            daily_data.to_excel(writer, sheet_name='Daily Trends', index=False)
+            self._write_sheet(writer, 'Daily Trends', db.stream('daily_trends'))
             
             # Sheet 6: Category Performance
-            category_data = db.get_category_performance()
+            category_data = data['category_performance']
             category_data.to_excel(writer, sheet_name='Category Performance', index=False)
             
             # Sheet 7: Location Analysis
-            location_data = db.get_location_analysis()
+            location_data = data['location_analysis']
             location_data.to_excel(writer, sheet_name='Location Analysis', index=False)
             
             # Sheet 8: Cart Abandonment
-            cart_data = db.get_cart_abandonment_rate()
+            cart_data = headline['cart_abandonment_rate']
             cart_data.to_excel(writer, sheet_name='Cart Abandonment', index=False)
             
             # Sheet 9: Hourly Patterns
-            hourly_data = db.get_hourly_patterns()
+            hourly_data = data['hourly_patterns']
             hourly_data.to_excel(writer, sheet_name='Hourly Patterns', index=False)
             
             # Sheet 10: Business Recommendations
-            recommendations = self._generate_recommendations(db, funnel_analyzer)
+            recommendations = self._generate_recommendations(db, funnel_analyzer, headline)
             recommendations.to_excel(writer, sheet_name='Recommendations', index=False)
         
         print(f"✓ Excel report saved: {filename}")
         return filename
     
-    def _create_executive_summary(self, db, sessions_df, funnel_analyzer):
+    def _write_sheet(self, writer, sheet_name, chunks):
+        """Write DataFrame chunks one below the other on a single sheet"""
+        
+        startrow = 0
+        for chunk in chunks:
+            chunk.to_excel(writer, sheet_name=sheet_name, index=False,
+                           header=startrow == 0, startrow=startrow)
+            startrow += len(chunk) + (1 if startrow == 0 else 0)
+    
+    def _create_executive_summary(self, db, sessions_df, funnel_analyzer, headline=None):
         """Create executive summary data"""
         
-        overall = db.get_overall_metrics()
+        headline = headline or db.get_headline_metrics()
+        overall = headline['overall_metrics']
         funnel_metrics = funnel_analyzer.calculate_funnel_metrics()
         
         summary = {
@@ -99,7 +117,7 @@ class ReportGenerator:
                 'Checkout → Purchase',
             ],
             'Value': [
-                f"{sessions_df['date'].min()} to {sessions_df['date'].max()}",
+                f"{sessions_df['timestamp'].min():%Y-%m-%d} to {sessions_df['timestamp'].max():%Y-%m-%d}",
                 f"{overall['total_sessions'].values[0]:,}",
                 f"{overall['unique_users'].values[0]:,}",
                 f"{overall['conversions'].values[0]:,}",
@@ -122,7 +140,7 @@ class ReportGenerator:
         
         return pd.DataFrame(summary)
     
-    def _generate_recommendations(self, db, funnel_analyzer):
+    def _generate_recommendations(self, db, funnel_analyzer, headline=None):
         """Generate business recommendations"""
         
         bottlenecks = funnel_analyzer.identify_bottlenecks()
@@ -153,7 +171,8 @@ class ReportGenerator:
         })
         
         # Priority 3: Cart recovery
-        cart_metrics = db.get_cart_abandonment_rate()
+        headline = headline or db.get_headline_metrics()
+        cart_metrics = headline['cart_abandonment_rate']
         abandonment = cart_metrics['abandonment_rate'].values[0]
         recommendations.append({
             'Priority': 'P5',
@@ -197,8 +216,9 @@ class ReportGenerator:
         
         filename = f'{self.output_dir}/business_insights.md'
         
-        overall = db.get_overall_metrics()
-        funnel_data = db.get_conversion_funnel()
+        headline = db.get_headline_metrics()
+        overall = headline['overall_metrics']
+        funnel_data = headline['conversion_funnel']
         traffic_data = db.get_traffic_source_performance()
         bottlenecks = funnel_analyzer.identify_bottlenecks()
         
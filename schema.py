@@ -0,0 +1,289 @@
+"""
+Schema Module
+Canonical compact dtypes for the sessions and events frames
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Dimension vocabularies; category codes follow this order everywhere
+TRAFFIC_SOURCES = ['Google Ads', 'Facebook Ads', 'Organic Search',
+                   'Direct', 'Email Campaign', 'Referral']
+DEVICES = ['Desktop', 'Mobile', 'Tablet']
+CATEGORIES = ['Electronics', 'Fashion', 'Home & Kitchen',
+              'Sports', 'Books', 'Beauty', 'Toys']
+LOCATIONS = ['Mumbai', 'Delhi', 'Bangalore', 'Hyderabad', 'Chennai',
+             'Kolkata', 'Pune', 'Ahmedabad', 'Jaipur', 'Lucknow']
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+EVENT_TYPES = ['page_view', 'add_to_cart', 'checkout_start', 'purchase']
+PAGES = ['homepage', 'product_page', 'checkout', 'confirmation']
+
+# Session-duration buckets of query 14, as (upper bound in seconds, label)
+DURATION_BUCKETS = [(30, '< 30 sec'), (120, '30 sec - 2 min'), (300, '2 - 5 min'),
+                    (600, '5 - 10 min'), (None, '> 10 min')]
+
+# Integer columns derived once from timestamp and session_duration_seconds:
+# epoch seconds, days since 1970-01-01, ISO year * 100 + ISO week,
+# year * 100 + month, weekday (0 = Monday) and the DURATION_BUCKETS index
+DERIVED_COLUMNS = ['epoch', 'day_index', 'iso_week', 'month', 'weekday', 'duration_bucket_id']
+
+# Prefix and minimum digits of the legacy string ids (SES_000001, ...)
+ID_FORMATS = {
+    'session_id': ('SES_', 6),
+    'user_id': ('USER_', 6),
+    'event_id': ('EVT_', 8)
+}
+
+# Compact sessions: integer surrogate ids, one datetime64 column (date is
+# derived from it), categories for dimensions, narrow ints and bool arrays
+SESSION_DTYPES = {
+    'session_id': 'int32',
+    'user_id': 'int32',
+    'timestamp': 'datetime64[ns]',
+    'hour': 'int8',
+    'day_of_week': pd.CategoricalDtype(WEEKDAYS, ordered=True),
+    'traffic_source': pd.CategoricalDtype(TRAFFIC_SOURCES),
+    'device': pd.CategoricalDtype(DEVICES),
+    'location': pd.CategoricalDtype(LOCATIONS),
+    'category': pd.CategoricalDtype(CATEGORIES),
+    'is_returning': 'bool',
+    'landed': 'bool',
+    'viewed_product': 'bool',
+    'added_to_cart': 'bool',
+    'started_checkout': 'bool',
+    'completed_purchase': 'bool',
+    'session_duration_seconds': 'int16',
+    'pages_viewed': 'int8',
+    'bounced': 'bool',
+    'revenue': 'float64',
+    'ad_spend': 'float64'
+}
+
+# event_id stays 64-bit: event counts pass 2**31 around a billion sessions
+EVENT_DTYPES = {
+    'event_id': 'int64',
+    'session_id': 'int32',
+    'user_id': 'int32',
+    'timestamp': 'datetime64[ns]',
+    'event_type': pd.CategoricalDtype(EVENT_TYPES),
+    'page': pd.CategoricalDtype(PAGES)
+}
+
+# Regression budget for compact frames, in MB of memory per million rows
+MEMORY_BUDGET_MB_PER_MILLION = {
+    'sessions': 64,
+    'events': 32
+}
+
+
+def is_compact(df):
+    """True if the frame uses integer surrogate ids"""
+    
+    return pd.api.types.is_integer_dtype(df['session_id'].dtype)
+
+
+def to_compact_sessions(df):
+    """Convert a sessions frame (legacy or compact) to the compact schema"""
+    
+    return _to_compact(df, SESSION_DTYPES)
+
+
+def to_compact_events(df):
+    """Convert an events frame (legacy or compact) to the compact schema"""
+    
+    return _to_compact(df, EVENT_DTYPES)
+
+
+def _to_compact(df, dtypes):
+    """Cast every schema column, parsing legacy string ids to integers"""
+    
+    columns = {}
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            if column == 'day_of_week':
+                weekdays = columns['timestamp'].dt.dayofweek.to_numpy()
+                columns[column] = pd.Categorical.from_codes(weekdays, dtype=dtype)
+            elif column == 'hour':
+                columns[column] = columns['timestamp'].dt.hour
+            else:
+                raise KeyError(f"Missing column: {column}")
+        
+        values = df[column] if column in df.columns else columns[column]
+        if column in ID_FORMATS:
+            values = parse_ids(values)
+        elif dtype == 'datetime64[ns]':
+            values = pd.to_datetime(values)
+        columns[column] = pd.Series(values, index=df.index).astype(dtype)
+    
+    return pd.DataFrame(columns).reset_index(drop=True)
+
+
+def derived_columns(df):
+    """DERIVED_COLUMNS of a sessions frame (legacy or compact), as NumPy arrays"""
+    
+    seconds = pd.to_datetime(df['timestamp']).to_numpy(dtype='datetime64[s]')
+    epoch = seconds.astype(np.int64)
+    days = seconds.astype('datetime64[D]')
+    day_index = days.astype(np.int64)
+    # 1970-01-01 was a Thursday
+    weekday = (day_index + 3) % 7
+    months = days.astype('datetime64[M]').astype(np.int64)
+    # The ISO year is the year of the week's Thursday
+    thursday = (day_index - weekday + 3).astype('datetime64[D]')
+    iso_year = thursday.astype('datetime64[Y]')
+    iso_week = (thursday - iso_year.astype('datetime64[D]')).astype(np.int64) // 7 + 1
+    
+    bounds = [bound for bound, _ in DURATION_BUCKETS[:-1]]
+    durations = df['session_duration_seconds'].to_numpy()
+    return {
+        'epoch': epoch,
+        'day_index': day_index.astype(np.int32),
+        'iso_week': ((iso_year.astype(np.int64) + 1970) * 100 + iso_week).astype(np.int32),
+        'month': ((months // 12 + 1970) * 100 + months % 12 + 1).astype(np.int32),
+        'weekday': weekday.astype(np.int8),
+        'duration_bucket_id': np.searchsorted(bounds, durations, side='right').astype(np.int8)
+    }
+
+
+def add_derived_columns(df):
+    """Add any missing DERIVED_COLUMNS to a sessions frame in place, and return it
+    
+    Text timestamps are parsed once and stored back as datetimes, so later
+    callers on the same frame parse nothing.
+    """
+    
+    if all(column in df.columns for column in DERIVED_COLUMNS):
+        return df
+    if not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+    for column, values in derived_columns(df).items():
+        if column not in df.columns:
+            df[column] = values
+    return df
+
+
+def to_legacy_sessions(df):
+    """Expand a compact sessions frame back to string ids and a date column"""
+    
+    if not is_compact(df):
+        return df
+    
+    legacy = _to_legacy(df)
+    legacy.insert(legacy.columns.get_loc('timestamp') + 1, 'date',
+                  legacy['timestamp'].dt.normalize())
+    return legacy
+
+
+def to_legacy_events(df):
+    """Expand a compact events frame back to string ids"""
+    
+    if not is_compact(df):
+        return df
+    return _to_legacy(df)
+
+
+def _to_legacy(df):
+    """String ids and object dimensions, as the original generator produced"""
+    
+    legacy = df.copy()
+    for column, (prefix, width) in ID_FORMATS.items():
+        if column in legacy.columns:
+            legacy[column] = format_ids(prefix, legacy[column].to_numpy(), width).astype(object)
+    for column in legacy.columns:
+        if isinstance(legacy[column].dtype, pd.CategoricalDtype):
+            legacy[column] = legacy[column].astype(object)
+    return legacy
+
+
+def parse_ids(values):
+    """Integer part of ids such as 'SES_000042'; integer input passes through"""
+    
+    values = pd.Series(values)
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return values.to_numpy()
+    return values.astype(str).str.rsplit('_', n=1).str[-1].astype(np.int64).to_numpy()
+
+
+def convert_legacy_csv(sessions_path, events_path, output_dir='data', file_format='parquet'):
+    """Rewrite legacy CSV datasets in the compact schema
+    
+    Returns the paths of the converted sessions and events files.
+    """
+    
+    from storage import dataset_path, write_table
+    
+    paths = []
+    for name, path, convert in (('sessions', sessions_path, to_compact_sessions),
+                                ('events', events_path, to_compact_events)):
+        df = convert(pd.read_csv(path))
+        output_path = dataset_path(name, output_dir, file_format)
+        write_table(df, output_path)
+        report_memory(df, name)
+        paths.append(output_path)
+    
+    return tuple(paths)
+
+
+def memory_per_million(df):
+    """Deep memory footprint of a frame in MB per million rows"""
+    
+    if len(df) == 0:
+        return 0.0
+    return df.memory_usage(deep=True, index=False).sum() / len(df)
+
+
+def report_memory(df, name):
+    """Print memory per million rows and flag frames over their budget"""
+    
+    mb_per_million = memory_per_million(df)
+    print(f"  {name}: {mb_per_million:,.1f} MB per million rows")
+    
+    budget = MEMORY_BUDGET_MB_PER_MILLION.get(name)
+    if budget is not None and is_compact(df) and mb_per_million > budget:
+        print(f"  ⚠️  {name} exceeds its budget of {budget} MB per million rows")
+    
+    return mb_per_million
+
+
+def format_ids(prefix, numbers, width):
+    """Format integer ids as zero-padded strings, e.g. SES_000042
+    
+    Writes the characters straight into fixed-width unicode buffers instead
+    of running a per-row f-string, and returns a NumPy unicode array (cheap
+    to pickle between processes). Like f"{n:06d}", ids wider than width keep
+    all their digits.
+    """
+    
+    numbers = np.asarray(numbers, dtype=np.uint64)
+    if len(numbers) == 0:
+        return np.empty(0, dtype=f'U{len(prefix) + width}')
+    
+    max_digits = max(width, len(str(int(numbers.max()))))
+    if max_digits == width:
+        return _format_fixed_width(prefix, numbers, width)
+    
+    formatted = np.empty(len(numbers), dtype=f'U{len(prefix) + max_digits}')
+    for digits in range(width, max_digits + 1):
+        mask = numbers < 10 ** digits
+        if digits > width:
+            mask &= numbers >= 10 ** (digits - 1)
+        if mask.any():
+            formatted[mask] = _format_fixed_width(prefix, numbers[mask], digits)
+    
+    return formatted
+
+
+def _format_fixed_width(prefix, numbers, digits):
+    """Render prefix + zero-padded numbers into a fixed-width unicode array"""
+    
+    size = len(prefix) + digits
+    chars = np.empty((len(numbers), size), dtype=np.uint32)
+    chars[:, :len(prefix)] = [ord(c) for c in prefix]
+    
+    remainder = numbers.astype(np.uint32 if digits <= 9 else np.uint64)
+    for position in range(size - 1, len(prefix) - 1, -1):
+        remainder, digit = np.divmod(remainder, 10)
+        chars[:, position] = digit + ord('0')
+    
+    return chars.view(f'U{size}').ravel()
@@ -0,0 +1,105 @@
+"""
+Storage Module
+Columnar (Parquet / Feather) and CSV persistence for generated datasets
+"""
+
+import os
+import pandas as pd
+
+from schema import to_compact_events, to_compact_sessions
+
+
+# Low-cardinality dimensions stored dictionary-encoded
+CATEGORICAL_COLUMNS = ['day_of_week', 'traffic_source', 'device', 'location', 'category',
+                       'event_type', 'page']
+DATETIME_COLUMNS = ['timestamp', 'date']
+BOOL_COLUMNS = ['is_returning', 'landed', 'viewed_product', 'added_to_cart',
+                'started_checkout', 'completed_purchase', 'bounced']
+
+# Preferred first between equally recent copies of a dataset
+FILE_FORMATS = {
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'csv': '.csv'
+}
+
+
+def dataset_path(name, data_dir='data', file_format='csv'):
+    """Path of a dataset file, e.g. data/sessions_data.parquet"""
+    
+    if file_format not in FILE_FORMATS:
+        raise ValueError(f"Unsupported file format: {file_format}")
+    return f'{data_dir}/{name}_data{FILE_FORMATS[file_format]}'
+
+
+def find_dataset(name, data_dir='data'):
+    """Return the most recently written file for name, in any format
+    
+    A stale copy in another format never shadows freshly generated data;
+    equally recent copies go by FILE_FORMATS order.
+    """
+    
+    paths = [dataset_path(name, data_dir, file_format) for file_format in FILE_FORMATS]
+    paths = [path for path in paths if os.path.exists(path)]
+    if not paths:
+        raise FileNotFoundError(f"No {name} data found in {data_dir}/ - generate data first")
+    return max(paths, key=lambda path: (os.path.getmtime(path), -paths.index(path)))
+
+
+def to_columnar(df):
+    """Apply storage dtypes: categories for dimensions, native datetimes and bools"""
+    
+    df = df.copy()
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    for column in DATETIME_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column])
+    for column in BOOL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype(bool)
+    return df
+
+
+def write_table(df, path):
+    """Write a frame in the format implied by the path's extension"""
+    
+    if path.endswith('.csv'):
+        df.to_csv(path, index=False)
+    elif path.endswith('.parquet'):
+        to_columnar(df).to_parquet(path, index=False)
+    elif path.endswith('.feather'):
+        to_columnar(df).reset_index(drop=True).to_feather(path)
+    else:
+        raise ValueError(f"Unsupported file type: {path}")
+
+
+def read_table(path):
+    """Read a dataset file into a typed frame
+    
+    Columnar files come back with their stored dtypes; CSVs are converted
+    to the same dtypes so every caller sees one shape.
+    """
+    
+    if path.endswith('.csv'):
+        return to_columnar(pd.read_csv(path))
+    elif path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    elif path.endswith('.feather'):
+        return pd.read_feather(path)
+    raise ValueError(f"Unsupported file type: {path}")
+
+
+def load_sessions(data_dir='data', compact=True):
+    """Load the sessions dataset from data_dir, in the compact schema by default"""
+    
+    df = read_table(find_dataset('sessions', data_dir))
+    return to_compact_sessions(df) if compact else df
+
+
+def load_events(data_dir='data', compact=True):
+    """Load the events dataset from data_dir, in the compact schema by default"""
+    
+    df = read_table(find_dataset('events', data_dir))
+    return to_compact_events(df) if compact else df
@@ -0,0 +1,56 @@
+"""
+Append Load Tests
+Appending a second generated dataset whose ids overlap the stored ones
+"""
+
+import pandas as pd
+import pytest
+
+from data_generator import EcommerceDataGenerator
+from database import EcommerceDatabase
+
+
+def generate(num_sessions, seed, end_date):
+    generator = EcommerceDataGenerator(num_sessions, seed=seed, end_date=end_date)
+    sessions_df = generator.generate_sessions()
+    return sessions_df, generator.generate_event_log(sessions_df)
+
+
+@pytest.mark.parametrize('layout', [{}, {'star_schema': True}, {'partition_by': 'month'},
+                                    {'compact_events': True}])
+def test_append_overlapping_dataset(tmp_path, layout):
+    db = EcommerceDatabase(str(tmp_path / 'ecommerce.db'), **layout)
+    db.connect()
+    first_sessions, first_events = generate(2000, 1, '2026-10-01')
+    db.ingest_frames(first_sessions, first_events)
+    
+    # Numbered from SES_000001 again: stored ids are skipped, new ones appended
+    sessions_df, events_df = generate(2500, 2, '2026-10-05')
+    watermark = db.get_watermark()
+    db.ingest_frames(sessions_df, events_df, append=True)
+    
+    new = sessions_df[(pd.to_datetime(sessions_df['timestamp']) >= watermark)
+                      & ~sessions_df['session_id'].isin(first_sessions['session_id'])]
+    total = len(first_sessions) + len(new)
+    stored = db.cursor.execute("SELECT COUNT(*), COUNT(DISTINCT session_id) FROM sessions").fetchone()
+    assert stored == (total, total)
+    events = db.cursor.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+    assert events == len(first_events) + events_df['session_id'].isin(new['session_id']).sum()
+    assert db.get_overall_metrics()['total_sessions'].iloc[0] == total
+    db.close()
+
+
+def test_append_rejects_reused_event_ids(tmp_path):
+    db = EcommerceDatabase(str(tmp_path / 'ecommerce.db'))
+    db.connect()
+    sessions_df, events_df = generate(300, 1, '2026-10-01')
+    db.ingest_frames(sessions_df, events_df)
+    
+    # A new session carrying events whose ids are already stored
+    last = sessions_df.iloc[[-1]].assign(session_id='SES_900001',
+                                         timestamp=pd.Timestamp('2026-10-02'))
+    events = events_df[events_df['session_id'] == sessions_df['session_id'].iloc[-1]]
+    with pytest.raises(ValueError, match='reuse stored event ids'):
+        db.ingest_frames(last, events.assign(session_id='SES_900001'), append=True)
+    assert db.cursor.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 300
+    db.close()
@@ -0,0 +1,34 @@
+"""
+Streamed Load Tests
+Generated batches written to SQLite by save_data_stream against the same batches loaded as frames
+"""
+
+import pandas as pd
+
+from data_generator import EcommerceDataGenerator
+from database import EcommerceDatabase
+
+
+def test_streamed_sqlite_sketches_match_frame_load(tmp_path):
+    generator = EcommerceDataGenerator(12000, seed=3, end_date='2026-10-01')
+    path, = generator.save_data_stream(str(tmp_path), file_format='sqlite', batch_size=3000)
+    streamed = EcommerceDatabase(path)
+    streamed.connect()
+    
+    # The same seed draws the same batches
+    batches = list(EcommerceDataGenerator(12000, seed=3, end_date='2026-10-01').iter_batches(3000))
+    loaded = EcommerceDatabase(str(tmp_path / 'frames.db'))
+    loaded.connect()
+    loaded.ingest_frames(pd.concat([batch[0] for batch in batches], ignore_index=True),
+                         pd.concat([batch[1] for batch in batches], ignore_index=True))
+    
+    pd.testing.assert_frame_equal(streamed.get_unique_users(), loaded.get_unique_users())
+    quantiles = streamed.get_value_quantiles()
+    pd.testing.assert_frame_equal(quantiles, loaded.get_value_quantiles())
+    counts = quantiles.set_index('measure')['count']
+    assert counts['session_duration'] == 12000
+    
+    # The bulk-load path also leaves the watermark a later append starts from
+    assert streamed.get_watermark() == loaded.get_watermark()
+    streamed.close()
+    loaded.close()
@@ -8,9 +8,12 @@ import seaborn as sns
 import plotly.graph_objects as go
 import plotly.express as px
 from plotly.subplots import make_subplots
+import numpy as np
 import pandas as pd
 import os
 
+from schema import WEEKDAYS, add_derived_columns
+
 
 class EcommerceVisualizer:
     """Create visualizations for e-commerce analytics"""
@@ -143,10 +146,16 @@ class EcommerceVisualizer:
     def plot_hourly_heatmap(self, hourly_data):
         """Plot hourly session heatmap"""
         
-        # Create day of week data
-        self.df['day_of_week'] = pd.to_datetime(self.df['timestamp']).dt.day_name()
+        # Day of week is stored on every session; only derive it if missing,
+        # from the weekday number computed once per frame
+        if 'day_of_week' in self.df.columns:
+            day_of_week = self.df['day_of_week'].astype(str)
+        else:
+            weekday = add_derived_columns(self.df)['weekday'].to_numpy()
+            day_of_week = pd.Series(np.array(WEEKDAYS)[weekday], index=self.df.index)
         
-        heatmap_data = self.df.groupby(['day_of_week', 'hour']).size().reset_index(name='sessions')
+        heatmap_data = self.df.groupby([day_of_week, self.df['hour']]).size().reset_index(name='sessions')
+        heatmap_data.columns = ['day_of_week', 'hour', 'sessions']
         heatmap_pivot = heatmap_data.pivot(index='day_of_week', columns='hour', values='sessions')
         
         # Reorder days
@@ -339,18 +348,23 @@ class EcommerceVisualizer:
         fig.write_html(filename)
         print(f"✓ Saved: {filename}")
     
-    def plot_revenue_distribution(self, sessions_df):
-        """Plot revenue distribution"""
+    def plot_revenue_distribution(self, revenue_histogram, revenue_stats):
+        """Plot revenue distribution
+        
+        Takes the order_value histogram and row of db.get_value_histogram()
+        and db.get_value_quantiles(), read from the sketches.
+        """
         
-        purchases = sessions_df[sessions_df['completed_purchase'] == True]['revenue']
+        widths = revenue_histogram['bin_end'] - revenue_histogram['bin_start']
         
         plt.figure(figsize=(12, 6))
-        plt.hist(purchases, bins=30, color='#2ecc71', edgecolor='black', alpha=0.7)
+        plt.bar(revenue_histogram['bin_start'], revenue_histogram['count'], width=widths,
+                align='edge', color='#2ecc71', edgecolor='black', alpha=0.7)
         plt.xlabel('Order Value (₹)', fontsize=12)
         plt.ylabel('Frequency', fontsize=12)
         plt.title('Revenue Distribution', fontsize=16, fontweight='bold')
-        plt.axvline(purchases.mean(), color='red', linestyle='--', linewidth=2, label=f'Mean: ₹{purchases.mean():.2f}')
-        plt.axvline(purchases.median(), color='blue', linestyle='--', linewidth=2, label=f'Median: ₹{purchases.median():.2f}')
+        plt.axvline(revenue_stats['mean'], color='red', linestyle='--', linewidth=2, label=f"Mean: ₹{revenue_stats['mean']:.2f}")
+        plt.axvline(revenue_stats['p50'], color='blue', linestyle='--', linewidth=2, label=f"Median: ₹{revenue_stats['p50']:.2f}")
         plt.legend()
         plt.tight_layout()
         
@@ -390,29 +404,29 @@ class EcommerceVisualizer:
         fig.write_html(filename)
         print(f"✓ Saved: {filename}")
     
-    def plot_session_duration_analysis(self, sessions_df):
-        """Plot session duration vs conversion"""
+    def plot_session_duration_analysis(self, value_quantiles):
+        """Plot session duration vs conversion
         
-        # Create duration buckets
-        sessions_df['duration_minutes'] = sessions_df['session_duration_seconds'] / 60
+        Takes db.get_value_quantiles() indexed by measure; the boxes are drawn
+        from its precomputed quartiles, with whiskers at the minimum and maximum.
+        """
         
         fig = go.Figure()
         
-        # Converted sessions
-        converted = sessions_df[sessions_df['completed_purchase'] == True]
-        fig.add_trace(go.Box(
-            y=converted['duration_minutes'],
-            name='Converted',
-            marker_color='#2ecc71'
-        ))
-        
-        # Non-converted sessions
-        not_converted = sessions_df[sessions_df['completed_purchase'] == False]
-        fig.add_trace(go.Box(
-            y=not_converted['duration_minutes'],
-            name='Not Converted',
-            marker_color='#e74c3c'
-        ))
+        for measure, name, color in [('purchase_duration', 'Converted', '#2ecc71'),
+                                     ('browse_duration', 'Not Converted', '#e74c3c')]:
+            minutes = value_quantiles.loc[measure, ['min', 'p25', 'p50', 'p75', 'max', 'mean']] / 60
+            fig.add_trace(go.Box(
+                x=[name],
+                q1=[minutes['p25']],
+                median=[minutes['p50']],
+                q3=[minutes['p75']],
+                lowerfence=[minutes['min']],
+                upperfence=[minutes['max']],
+                mean=[minutes['mean']],
+                name=name,
+                marker_color=color
+            ))
         
         fig.update_layout(
             title='Session Duration: Converted vs Non-Converted',